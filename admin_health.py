@@ -0,0 +1,133 @@
+import time
+import asyncio
+import logging
+from datetime import datetime
+from pyrogram.errors import Unauthorized
+from database import run_in_session, AdminAccount
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+probe_seconds = registry.histogram("admin_probe_seconds", "Длительность проверки клиента администратора", ["result"])
+
+
+def classify_error(error):
+    """
+    "revoked" - сессия отозвана или аккаунт удален (повтор не поможет),
+    "transient" - сетевые сбои, таймауты и прочие временные ошибки
+    """
+    return "revoked" if isinstance(error, Unauthorized) else "transient"
+
+
+def _save_health(session, results):
+    for account_id, checked_at, error in results:
+        values = {AdminAccount.health_checked_at: checked_at, AdminAccount.health_error: error}
+        if error is None:
+            values[AdminAccount.health_ok_at] = checked_at
+        session.query(AdminAccount).filter_by(id=account_id).update(values)
+    session.commit()
+
+
+class AccountHealth:
+    """
+    Результаты проверок одного аккаунта
+    """
+
+    def __init__(self):
+        self.last_success = None
+        self.latency = None
+        self.error = None
+        self.error_class = None
+        self.failures = 0
+
+
+class AdminHealthProber:
+    """
+    Фоновая проверка клиентов администраторов.
+
+    Раз в interval секунд каждый клиент пула выполняет get_me() с таймаутом.
+    После failure_threshold неудач подряд клиент перестает получать заявки,
+    после restart_threshold - перезапускается пулом. Ошибка авторизации
+    (отозванная сессия) сразу деактивирует аккаунт. Успешная проверка
+    возвращает клиент в работу. Обработка заявок сама ничего не проверяет.
+
+    Перед каждой проверкой пул сверяется с таблицей admin_accounts (reload):
+    новые аккаунты запускаются, удаленные убираются без перезапуска бота.
+    """
+
+    def __init__(self, pool, interval=60, timeout=10, failure_threshold=2, restart_threshold=5):
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.restart_threshold = restart_threshold
+        self.health = {}
+        self._task = None
+
+    async def probe(self, account_id, client):
+        """
+        Проверяет один клиент и применяет результат к пулу
+        """
+        health = self.health.setdefault(account_id, AccountHealth())
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(client.get_me(), self.timeout)
+        except Exception as e:
+            health.latency = time.perf_counter() - started
+            health.error = type(e).__name__
+            health.error_class = classify_error(e)
+            health.failures += 1
+            probe_seconds.observe(health.latency, result=health.error_class)
+            logger.warning(f"Проверка клиента аккаунта {account_id} не удалась ({health.error_class}): {health.error}: {e}")
+
+            if health.error_class == "revoked":
+                await self.pool.revoke(account_id)
+                self.health.pop(account_id, None)
+            elif health.failures >= self.restart_threshold:
+                health.failures = 0
+                await self.pool.restart(account_id)
+            elif health.failures >= self.failure_threshold:
+                await self.pool.set_healthy(account_id, False)
+            return health
+
+        health.latency = time.perf_counter() - started
+        health.last_success = datetime.now()
+        health.error = None
+        health.error_class = None
+        health.failures = 0
+        probe_seconds.observe(health.latency, result="ok")
+        await self.pool.set_healthy(account_id, True)
+        return health
+
+    async def probe_all(self):
+        clients = self.pool.clients()
+        await asyncio.gather(*(self.probe(account_id, client) for account_id, client in clients))
+
+        checked_at = datetime.now()
+        results = [
+            (account_id, checked_at, self.health[account_id].error)
+            for account_id, _ in clients if account_id in self.health
+        ]
+        if results:
+            try:
+                await run_in_session(_save_health, results)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении результатов проверки аккаунтов: {e}")
+
+    async def start(self):
+        async def run():
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.pool.reload()
+                    await self.probe_all()
+                except Exception as e:
+                    logger.error(f"Ошибка при проверке клиентов администраторов: {type(e).__name__}: {e}")
+
+        if self.interval > 0:
+            self._task = asyncio.create_task(run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
@@ -0,0 +1,466 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pyrogram import Client
+from pyrogram.errors import Unauthorized
+from database import run_in_session, AdminAccount, session_vault
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых клиент аккаунта считается неисправным и перезапускается
+ACCOUNT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError, Unauthorized)
+
+# Максимальная пауза между попытками перезапуска клиента (секунды)
+MAX_RESTART_DELAY = 600
+
+
+def _load_account(session, account_id):
+    admin_account = session.query(AdminAccount).filter_by(id=account_id, active=True).first()
+    if not admin_account:
+        return None
+    return admin_account.phone, admin_account.usage_count or 0, admin_account.session_data, admin_account.cooldown_until
+
+
+def _load_account_ids(session, index, count):
+    query = session.query(AdminAccount.id).filter_by(active=True)
+    if count > 1:
+        query = query.filter(AdminAccount.id % count == index)
+    return [row.id for row in query]
+
+
+def _deactivate_account(session, account_id):
+    session.query(AdminAccount).filter_by(id=account_id).update({AdminAccount.active: False})
+    session.commit()
+
+
+def _set_cooldown(session, account_id, cooldown_until):
+    session.query(AdminAccount).filter_by(id=account_id).update({AdminAccount.cooldown_until: cooldown_until})
+    session.commit()
+
+
+def _record_usage(session, account_id):
+    session.query(AdminAccount).filter_by(id=account_id).update({
+        AdminAccount.last_used: datetime.now(),
+        AdminAccount.usage_count: AdminAccount.usage_count + 1
+    })
+    session.commit()
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты добавлений: capacity операций подряд, затем одна операция в interval секунд
+    """
+
+    def __init__(self, capacity, interval):
+        self.capacity = capacity
+        self.interval = interval
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.interval > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) / self.interval)
+        else:
+            self.tokens = self.capacity
+        self.updated = now
+
+    def wait_time(self):
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * self.interval
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _Slot:
+    """
+    Запущенный клиент одного аккаунта администратора
+    """
+
+    def __init__(self, account_id, phone, client, served, bucket, cooldown_until=None):
+        self.account_id = account_id
+        self.phone = phone
+        self.client = client
+        self.leases = 0
+        self.served = served
+        self.bucket = bucket
+        self.cooldown_until = cooldown_until
+        # Сбрасывается фоновой проверкой (admin_health) после нескольких неудачных проверок подряд
+        self.healthy = True
+
+    def wait_time(self):
+        """
+        Через сколько секунд аккаунт сможет выполнить следующее добавление
+        """
+        wait = self.bucket.wait_time()
+        if self.cooldown_until:
+            wait = max(wait, (self.cooldown_until - datetime.now()).total_seconds())
+        return max(wait, 0.0)
+
+
+class AdminLease:
+    """
+    Аренда клиента администратора на время обработки одной заявки
+    """
+
+    def __init__(self, slot):
+        self._slot = slot
+        self.failed = False
+        self.cooldown = None
+
+    def throttle(self, seconds):
+        """
+        Отмечает, что Telegram запретил аккаунту добавления на seconds секунд
+        """
+        self.cooldown = max(self.cooldown or 0, seconds)
+
+    @property
+    def account_id(self):
+        return self._slot.account_id
+
+    @property
+    def phone(self):
+        return self._slot.phone
+
+    @property
+    def client(self):
+        return self._slot.client
+
+
+class AdminClientPool:
+    """
+    Пул постоянно запущенных клиентов всех активных аккаунтов администраторов.
+
+    Каждая заявка арендует клиент, который раньше других может выполнить
+    добавление: у каждого аккаунта свой TokenBucket и время окончания паузы
+    после FloodWait/PeerFlood (хранится в admin_accounts.cooldown_until).
+    Неисправные клиенты убираются из пула и перезапускаются в фоне.
+    Заявки получают только клиенты, которые фоновая проверка считает исправными.
+
+    shard=(index, count) - при нескольких процессах каждый запускает только
+    аккаунты с id % count == index, поэтому аккаунты процессов не пересекаются.
+    """
+
+    def __init__(self, api_id, api_hash, max_leases=1, acquire_timeout=30, restart_delay=30, on_stop=None,
+                 add_burst=5, add_interval=60, shard=(0, 1)):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.max_leases = max_leases
+        self.acquire_timeout = acquire_timeout
+        self.restart_delay = restart_delay
+        self.on_stop = on_stop
+        self.add_burst = add_burst
+        self.add_interval = add_interval
+        self.shard = shard
+        self._buckets = {}
+        self._slots = {}
+        self._restarts = {}
+        self._cond = asyncio.Condition()
+        self._closed = False
+
+    @property
+    def size(self):
+        return len(self._slots)
+
+    def clients(self):
+        """
+        Запущенные клиенты: список (ID аккаунта, клиент)
+        """
+        return [(slot.account_id, slot.client) for slot in self._slots.values()]
+
+    def status(self):
+        """
+        Состояние запущенных клиентов: список (ID аккаунта, телефон, исправен, аренд, пауза до)
+        """
+        return [
+            (slot.account_id, slot.phone, slot.healthy, slot.leases, slot.cooldown_until)
+            for slot in self._slots.values()
+        ]
+
+    @property
+    def healthy_size(self):
+        return sum(1 for slot in self._slots.values() if slot.healthy)
+
+    async def start(self):
+        """
+        Запускает клиенты всех активных аккаунтов одновременно
+        """
+        account_ids = await run_in_session(_load_account_ids, *self.shard)
+
+        if not account_ids:
+            logger.error("Нет доступных аккаунтов администраторов")
+            return
+
+        results = await asyncio.gather(*(self._start_account(account_id) for account_id in account_ids))
+        logger.info(f"Пул администраторов запущен: {sum(results)} из {len(account_ids)} аккаунтов")
+
+    async def reload(self):
+        """
+        Сверяет пул с активными аккаунтами в БД: запускает добавленные (session_creator.py)
+        и убирает удаленные или деактивированные. Возвращает (запущено, убрано).
+        """
+        account_ids = set(await run_in_session(_load_account_ids, *self.shard))
+        if self._closed:
+            return 0, 0
+
+        removed = [account_id for account_id in self._slots if account_id not in account_ids]
+        for account_id in removed:
+            await self.remove(account_id)
+
+        added = [account_id for account_id in account_ids if account_id not in self._slots and account_id not in self._restarts]
+        started = sum(await asyncio.gather(*(self._start_account(account_id) for account_id in added)))
+        if started or removed:
+            logger.info(f"Пул администраторов обновлен: запущено {started}, убрано {len(removed)}")
+        return started, len(removed)
+
+    async def _start_account(self, account_id, retry_delay=None):
+        """
+        Запускает клиент аккаунта и добавляет его в пул. Возвращает True при успехе.
+        """
+        account = await run_in_session(_load_account, account_id)
+        if not account:
+            return False
+
+        phone, served, encrypted_data, cooldown_until = account
+        try:
+            session_data = session_vault.get(account_id, encrypted_data)
+        except Exception as e:
+            logger.error(f"Не удалось расшифровать сессию аккаунта {phone}: {e}")
+            return False
+
+        session_string = session_data.get("session_string")
+        if not session_string:
+            logger.error(f"Нет строки сессии в данных аккаунта {phone}")
+            return False
+
+        client = Client(
+            name=f"admin_{account_id}",
+            api_id=self.api_id,
+            api_hash=self.api_hash,
+            session_string=session_string,
+            in_memory=True
+        )
+
+        try:
+            await client.start()
+            me = await client.get_me()
+            logger.info(f"Аккаунт {phone} авторизован как: {me.first_name} {me.last_name or ''} (@{me.username or 'нет'})")
+        except Unauthorized as e:
+            # Сессия отозвана - перезапуск не поможет
+            logger.error(f"Сессия аккаунта {phone} недействительна: {type(e).__name__}")
+            await self._deactivate(account_id, phone)
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при запуске клиента {phone}: {type(e).__name__}: {e}")
+            self._schedule_restart(account_id, delay=retry_delay)
+            return False
+
+        if not await self.attach_client(account_id, phone, client, served, cooldown_until):
+            await client.stop()
+            return False
+        return True
+
+    async def attach_client(self, account_id, phone, client, served=0, cooldown_until=None):
+        """
+        Добавляет в пул уже запущенный клиент. Возвращает False, если пул остановлен.
+        """
+        async with self._cond:
+            if self._closed:
+                return False
+            # Ограничитель сохраняется между перезапусками клиента
+            bucket = self._buckets.setdefault(account_id, TokenBucket(self.add_burst, self.add_interval))
+            self._slots[account_id] = _Slot(account_id, phone, client, served, bucket, cooldown_until)
+            self._cond.notify_all()
+        return True
+
+    async def acquire(self, accept=None):
+        """
+        Арендует клиент аккаунта, который раньше других сможет выполнить добавление.
+        accept(account_id) отбирает подходящие аккаунты (например, с доступом к целевому чату).
+        Возвращает None, если такой аккаунт не освободится за acquire_timeout.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.acquire_timeout
+
+        async with self._cond:
+            while True:
+                if not self._slots and not self._restarts:
+                    logger.error("Нет запущенных клиентов администраторов")
+                    return None
+
+                candidates = [slot for slot in self._slots.values() if accept is None or accept(slot.account_id)]
+                if not candidates and not self._restarts:
+                    logger.error("Нет аккаунтов администраторов, подходящих для заявки")
+                    return None
+
+                # Неисправные клиенты не получают заявок, пока проверка не пройдет успешно
+                free = [slot for slot in candidates if slot.healthy and slot.leases < self.max_leases]
+                wait = None
+                if free:
+                    waits = {slot.account_id: slot.wait_time() for slot in free}
+                    slot = min(free, key=lambda slot: (waits[slot.account_id], slot.leases, slot.served))
+                    wait = waits[slot.account_id]
+                    if wait <= 0:
+                        break
+
+                remaining = deadline - loop.time()
+                # Сразу отказываемся, только если все подходящие аккаунты свободны, но на паузе дольше
+                # оставшегося времени: занятый, неисправный или перезапускаемый аккаунт может освободиться раньше
+                if wait is not None and wait > remaining and len(free) == len(candidates) and not self._restarts:
+                    logger.error(f"Все аккаунты администраторов на паузе, ближайший освободится через {wait:.0f} с.")
+                    return None
+                if remaining <= 0:
+                    logger.error("Не дождались свободного клиента администратора")
+                    return None
+
+                # Ждем освобождения аренды или окончания паузы ближайшего аккаунта
+                try:
+                    await asyncio.wait_for(self._cond.wait(), min(wait, remaining) if wait is not None else remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            slot.bucket.take()
+            slot.leases += 1
+            slot.served += 1
+
+        await self._record_usage(slot.account_id)
+        return AdminLease(slot)
+
+    async def release(self, lease):
+        """
+        Возвращает клиент в пул; неисправный клиент убирается и перезапускается в фоне
+        """
+        slot = lease._slot
+        if lease.cooldown:
+            slot.cooldown_until = datetime.now() + timedelta(seconds=lease.cooldown)
+            logger.warning(f"Аккаунт {slot.phone} на паузе до {slot.cooldown_until.strftime('%d.%m.%Y %H:%M:%S')}")
+            try:
+                await run_in_session(_set_cooldown, slot.account_id, slot.cooldown_until)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении паузы аккаунта: {e}")
+
+        async with self._cond:
+            slot.leases -= 1
+            if lease.failed and self._slots.get(slot.account_id) is slot:
+                logger.warning(f"Клиент аккаунта {slot.phone} убран из пула из-за ошибки")
+                del self._slots[slot.account_id]
+                self._schedule_restart(slot.account_id, slot.client)
+            self._cond.notify_all()
+
+    async def set_healthy(self, account_id, healthy):
+        """
+        Отмечает результат фоновой проверки клиента; исправный клиент снова получает заявки
+        """
+        async with self._cond:
+            slot = self._slots.get(account_id)
+            if slot is None or slot.healthy == healthy:
+                return
+            slot.healthy = healthy
+            if healthy:
+                logger.info(f"Клиент аккаунта {slot.phone} снова исправен")
+            else:
+                logger.warning(f"Клиент аккаунта {slot.phone} не прошел проверки и не получает заявок")
+            self._cond.notify_all()
+
+    async def restart(self, account_id):
+        """
+        Убирает клиент из пула и перезапускает его в фоне (долгие временные сбои)
+        """
+        async with self._cond:
+            slot = self._slots.pop(account_id, None)
+            if slot is None:
+                return
+            logger.warning(f"Клиент аккаунта {slot.phone} перезапускается после неудачных проверок")
+            self._schedule_restart(account_id, slot.client)
+            self._cond.notify_all()
+
+    async def revoke(self, account_id):
+        """
+        Убирает клиент с отозванной сессией из пула без перезапуска и деактивирует аккаунт
+        """
+        async with self._cond:
+            slot = self._slots.pop(account_id, None)
+            self._cond.notify_all()
+        if slot is None:
+            return
+        await self._stop_client(account_id, slot.client)
+        await self._deactivate(account_id, slot.phone)
+
+    async def remove(self, account_id):
+        """
+        Убирает из пула и останавливает клиент удаленного аккаунта (запись в БД не меняется).
+        Возвращает True, если клиент был запущен.
+        """
+        async with self._cond:
+            slot = self._slots.pop(account_id, None)
+            restart = self._restarts.pop(account_id, None)
+            self._cond.notify_all()
+        if restart:
+            restart.cancel()
+        # Расшифрованная сессия удаленного аккаунта не должна оставаться в памяти
+        session_vault.wipe(account_id)
+        if slot is None:
+            return False
+        await self._stop_client(account_id, slot.client)
+        logger.info(f"Клиент аккаунта {slot.phone} убран из пула")
+        return True
+
+    async def _deactivate(self, account_id, phone):
+        try:
+            await run_in_session(_deactivate_account, account_id)
+        except Exception as e:
+            logger.error(f"Ошибка при деактивации аккаунта {phone}: {e}")
+        session_vault.wipe(account_id)
+        logger.warning(f"Аккаунт {phone} деактивирован из-за ошибки авторизации")
+
+    async def _record_usage(self, account_id):
+        try:
+            await run_in_session(_record_usage, account_id)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении статистики аккаунта: {e}")
+
+    def _schedule_restart(self, account_id, old_client=None, delay=None):
+        if self._closed or account_id in self._restarts:
+            return
+        delay = delay or self.restart_delay
+        self._restarts[account_id] = asyncio.create_task(self._restart(account_id, old_client, delay))
+
+    async def _restart(self, account_id, old_client, delay):
+        """
+        Фоновый перезапуск клиента; при повторной неудаче пауза удваивается
+        """
+        if old_client is not None:
+            await self._stop_client(account_id, old_client)
+        await asyncio.sleep(delay)
+        self._restarts.pop(account_id, None)
+
+        logger.info(f"Перезапуск клиента аккаунта {account_id}")
+        await self._start_account(account_id, retry_delay=min(delay * 2, MAX_RESTART_DELAY))
+
+    async def _stop_client(self, account_id, client):
+        try:
+            if client.is_connected:
+                await client.stop()
+        except Exception as e:
+            logger.error(f"Ошибка при остановке клиента: {e}")
+        if self.on_stop:
+            self.on_stop(account_id)
+
+    async def stop(self):
+        """
+        Останавливает все клиенты и фоновые перезапуски
+        """
+        self._closed = True
+        for task in list(self._restarts.values()):
+            task.cancel()
+        async with self._cond:
+            slots = list(self._slots.values())
+            self._slots.clear()
+            self._cond.notify_all()
+        await asyncio.gather(*(self._stop_client(slot.account_id, slot.client) for slot in slots))
+        session_vault.wipe()
@@ -0,0 +1,193 @@
+import os
+import gzip
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete, func
+from database import run_db, run_in_session, JoinRequest
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Завершенные заявки, которые переносятся в архив
+ARCHIVED_STATUSES = ("approved", "rejected", "link_sent")
+
+ARCHIVE_COLUMNS = ("id", "user_id", "chat_id", "status", "created_at", "message_id")
+
+archived_total = registry.counter("archived_join_requests_total", "Заявок перенесено в архив")
+
+
+def _archive_path(directory, month):
+    return os.path.join(directory, f"join_requests-{month}.jsonl.gz")
+
+
+def _archive_batch(session, directory, before, batch_size):
+    """
+    Переносит до batch_size самых старых завершенных заявок в файлы архива (по месяцу создания)
+    и удаляет их из join_requests. Возвращает (перенесено, байт в JSON, байт записано в файлы).
+    """
+    table = JoinRequest.__table__
+    rows = session.connection().execute(
+        select(*(table.c[name] for name in ARCHIVE_COLUMNS))
+        .where(table.c.status.in_(ARCHIVED_STATUSES), table.c.created_at < before)
+        .order_by(table.c.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0, 0, 0
+
+    by_month = {}
+    for row in rows:
+        record = dict(zip(ARCHIVE_COLUMNS, row))
+        record["created_at"] = record["created_at"].isoformat() if record["created_at"] else None
+        month = (record["created_at"] or "0000-00")[:7]
+        by_month.setdefault(month, []).append(json.dumps(record, ensure_ascii=False) + "\n")
+
+    raw_bytes = 0
+    written_bytes = 0
+    for month, lines in by_month.items():
+        path = _archive_path(directory, month)
+        size_before = os.path.getsize(path) if os.path.exists(path) else 0
+        data = "".join(lines).encode()
+        raw_bytes += len(data)
+        # Каждая пачка дописывается отдельным участком gzip; файл читается целиком как один поток
+        with open(path, "ab") as file:
+            file.write(gzip.compress(data))
+            file.flush()
+            os.fsync(file.fileno())
+        written_bytes += os.path.getsize(path) - size_before
+
+    # Строки удаляются только после записи в архив; при сбое между этими шагами
+    # заявка окажется в архиве дважды, поиск по архиву такие повторы отбрасывает
+    session.execute(delete(table).where(table.c.id.in_([row.id for row in rows]), table.c.status.in_(ARCHIVED_STATUSES)))
+    session.commit()
+    return len(rows), raw_bytes, written_bytes
+
+
+def _count_join_requests(session):
+    return session.query(func.count(JoinRequest.id)).scalar()
+
+
+def _search_archive(directory, user_id, chat_id, status, since, until, limit):
+    """
+    Ищет заявки в файлах архива. Файлы вне интервала since..until по месяцу не читаются.
+    Возвращает записи от новых к старым.
+    """
+    if not os.path.isdir(directory):
+        return []
+    first_month = since.strftime("%Y-%m") if since else None
+    last_month = until.strftime("%Y-%m") if until else None
+
+    found = {}
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not (name.startswith("join_requests-") and name.endswith(".jsonl.gz")):
+            continue
+        month = name[len("join_requests-"):-len(".jsonl.gz")]
+        if (first_month and month < first_month) or (last_month and month > last_month):
+            continue
+        with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                if user_id is not None and record["user_id"] != user_id:
+                    continue
+                if chat_id is not None and record["chat_id"] != chat_id:
+                    continue
+                if status is not None and record["status"] != status:
+                    continue
+                created_at = datetime.fromisoformat(record["created_at"]) if record["created_at"] else None
+                if since and (created_at is None or created_at < since):
+                    continue
+                if until and (created_at is None or created_at >= until):
+                    continue
+                record["created_at"] = created_at
+                found[record["id"]] = record
+
+    return sorted(found.values(), key=lambda record: record["id"], reverse=True)[:limit]
+
+
+class ArchiveReport:
+    """
+    Итог одного прохода архивации
+    """
+
+    def __init__(self):
+        self.moved = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+        self.remaining = None
+        self.seconds = 0.0
+
+    def __str__(self):
+        return (
+            f"перенесено заявок: {self.moved}, освобождено в join_requests около {self.raw_bytes / 1024:.0f} КБ данных, "
+            f"записано в архив {self.written_bytes / 1024:.0f} КБ, осталось заявок: {self.remaining}, {self.seconds:.1f} с"
+        )
+
+
+class JoinRequestArchiver:
+    """
+    Перенос завершенных заявок (approved/rejected/link_sent) старше max_age_days
+    из join_requests в сжатые файлы JSONL в directory, по одному файлу на месяц
+    создания заявки. Запускается в фоне раз в interval секунд; перенос идет
+    пачками по batch_size строк, каждая пачка - своя транзакция.
+    """
+
+    def __init__(self, directory="archive", max_age_days=30, interval=3600, batch_size=5000):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    async def run_once(self):
+        """
+        Переносит все подходящие заявки. Возвращает ArchiveReport.
+        """
+        async with self._lock:
+            report = ArchiveReport()
+            started = time.perf_counter()
+            os.makedirs(self.directory, exist_ok=True)
+            before = datetime.now() - timedelta(days=self.max_age_days)
+
+            while True:
+                moved, raw_bytes, written_bytes = await run_in_session(
+                    _archive_batch, self.directory, before, self.batch_size
+                )
+                report.moved += moved
+                report.raw_bytes += raw_bytes
+                report.written_bytes += written_bytes
+                archived_total.inc(moved)
+                if moved < self.batch_size:
+                    break
+
+            report.remaining = await run_in_session(_count_join_requests)
+            report.seconds = time.perf_counter() - started
+            if report.moved:
+                logger.info(f"Архивация заявок: {report}")
+            return report
+
+    async def search(self, user_id=None, chat_id=None, status=None, since=None, until=None, limit=50):
+        """
+        Поиск заявок в архиве по запросу (чтение файлов выполняется в пуле потоков)
+        """
+        return await run_db(_search_archive, self.directory, user_id, chat_id, status, since, until, limit)
+
+    async def start(self):
+        async def run():
+            while True:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    logger.error(f"Ошибка при архивации заявок: {type(e).__name__}: {e}")
+                await asyncio.sleep(self.interval)
+
+        if self.max_age_days > 0 and self.interval > 0:
+            self._task = asyncio.create_task(run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
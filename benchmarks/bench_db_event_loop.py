@@ -0,0 +1,108 @@
+"""
+Бенчмарк простоя цикла событий при параллельных обращениях к БД.
+
+Сравнивает прямые вызовы синхронной сессии из корутин (как было в обработчиках)
+с вызовами через run_in_session. Каждый "обработчик" повторяет работу /start и
+выбора чата: регистрация пользователя и создание заявки.
+
+Запуск:
+    python benchmarks/bench_db_event_loop.py --callbacks 500 --concurrency 50
+
+По умолчанию используется временная SQLite-база; для Postgres укажите --database-url.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--callbacks", type=int, default=500, help="количество обработчиков")
+parser.add_argument("--concurrency", type=int, default=50, help="одновременно выполняемых обработчиков")
+parser.add_argument("--tick", type=float, default=0.005, help="интервал замера задержки цикла (с)")
+parser.add_argument("--database-url", default=None, help="URL базы данных (по умолчанию временная SQLite)")
+args = parser.parse_args()
+
+if args.database_url:
+    os.environ["DATABASE_URL"] = args.database_url
+else:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("ENCRYPTION_KEY", "bench")
+
+from database import init_db, get_session, run_in_session, User, JoinRequest
+
+
+def handle_callback(session, user_id):
+    user = session.query(User).filter_by(user_id=user_id).first()
+    if not user:
+        session.add(User(user_id=user_id, first_name="bench"))
+        session.commit()
+    session.add(JoinRequest(user_id=user_id, chat_id=-100, status="pending"))
+    session.commit()
+
+
+async def sync_callback(user_id):
+    session = get_session()
+    try:
+        handle_callback(session, user_id)
+    finally:
+        session.close()
+
+
+async def executor_callback(user_id):
+    await run_in_session(handle_callback, user_id)
+
+
+async def measure_lag(tick, lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(tick)
+        lags.append(max(0.0, loop.time() - started - tick))
+
+
+async def run(callback, offset):
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_lag(args.tick, lags, stop))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(user_id):
+        async with semaphore:
+            await callback(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(offset + n) for n in range(args.callbacks)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "rate": args.callbacks / elapsed,
+        "stall_total": sum(lags),
+        "lag_p50": statistics.median(lags) if lags else 0.0,
+        "lag_p99": lags[int(len(lags) * 0.99)] if lags else 0.0,
+        "lag_max": lags[-1] if lags else 0.0,
+    }
+
+
+async def main():
+    init_db()
+    print(f"callbacks={args.callbacks} concurrency={args.concurrency} db={os.environ['DATABASE_URL']}")
+    print(f"{'mode':<10}{'elapsed,s':>11}{'cb/s':>9}{'stall,s':>10}{'lag p50,ms':>12}{'lag p99,ms':>12}{'lag max,ms':>12}")
+    for offset, (name, callback) in enumerate((("sync", sync_callback), ("executor", executor_callback))):
+        r = await run(callback, offset * 10_000_000)
+        print(
+            f"{name:<10}{r['elapsed']:>11.2f}{r['rate']:>9.0f}{r['stall_total']:>10.2f}"
+            f"{r['lag_p50'] * 1000:>12.1f}{r['lag_p99'] * 1000:>12.1f}{r['lag_max'] * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""
+Бенчмарк пути добавления в чат на заменителе клиента Pyrogram.
+
+Для каждого сочетания числа диалогов аккаунта и размера чата измеряет:
+  add_user_to_chat      - прямой вызов добавления (аренда аккаунта, поиск чата, добавление, проверка);
+  select_chat_callback  - нажатие кнопки до ответа обработчика (callback) и до завершения заявки
+                          в очереди (end-to-end).
+Первое добавление на каждом аккаунте включает однократный просмотр диалогов.
+Задержка проверки членства (membership.VERIFY_DELAYS) входит в время добавления.
+
+Запуск:
+    python benchmarks/bench_join.py --joins 200 --dialogs 100,1000,10000 --members 1000,100000
+"""
+import time
+import asyncio
+import argparse
+
+from harness import prepare_env, setup_bot, reset_admins, teardown_bot, percentile, CHAT_ID_1
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--joins", type=int, default=200, help="добавлений в каждом сценарии")
+parser.add_argument("--concurrency", type=int, default=20, help="одновременных добавлений")
+parser.add_argument("--accounts", type=int, default=4, help="аккаунтов администраторов")
+parser.add_argument("--dialogs", default="100,1000,10000", help="числа диалогов аккаунта через запятую")
+parser.add_argument("--members", default="1000,100000", help="размеры целевого чата через запятую")
+parser.add_argument("--latency", type=float, default=0.02, help="задержка одного вызова API (с)")
+parser.add_argument("--dialog-page-size", type=int, default=100, help="диалогов на странице get_dialogs")
+parser.add_argument("--member-page-size", type=int, default=200, help="участников на странице get_chat_members")
+parser.add_argument("--privacy-rate", type=float, default=0.1, help="доля пользователей с ограничением приватности")
+parser.add_argument("--peer-flood-rate", type=float, default=0.0, help="доля добавлений с PeerFlood")
+parser.add_argument("--flood-wait-rate", type=float, default=0.0, help="доля добавлений с FloodWait")
+parser.add_argument("--flood-wait-seconds", type=int, default=1, help="значение FloodWait (с)")
+parser.add_argument("--seed", type=int, default=1, help="зерно генератора случайных ошибок")
+parser.add_argument("--database-url", default=None, help="URL базы данных (по умолчанию временная SQLite)")
+args = parser.parse_args()
+
+prepare_env(args.database_url)
+
+from fake_client import FakeConfig, make_callback_query
+
+
+def make_config(dialogs, members):
+    return FakeConfig(
+        latency=args.latency,
+        dialogs=dialogs,
+        dialog_page_size=args.dialog_page_size,
+        members=members,
+        member_page_size=args.member_page_size,
+        peer_flood_rate=args.peer_flood_rate,
+        privacy_rate=args.privacy_rate,
+        flood_wait_rate=args.flood_wait_rate,
+        flood_wait_seconds=args.flood_wait_seconds,
+        seed=args.seed
+    )
+
+
+async def run_concurrently(count, func):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(n):
+        async with semaphore:
+            await func(n)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(count)))
+    return time.perf_counter() - started
+
+
+async def bench_add_user(bot, first_user_id):
+    latencies = []
+    succeeded = 0
+
+    async def one(n):
+        nonlocal succeeded
+        started = time.perf_counter()
+        success, _ = await bot.add_user_to_chat(first_user_id + n, CHAT_ID_1)
+        latencies.append(time.perf_counter() - started)
+        succeeded += success
+
+    elapsed = await run_concurrently(args.joins, one)
+    return elapsed, succeeded, latencies
+
+
+async def bench_select_chat(bot, bot_client, first_user_id):
+    callback_latencies = []
+    end_to_end = []
+    started_at = {}
+    done = asyncio.Event()
+    handler = bot.join_queue.handler
+
+    # Время завершения заявки фиксируется обработчиком очереди
+    async def tracked(job):
+        try:
+            await handler(job)
+        finally:
+            end_to_end.append(time.perf_counter() - started_at[job.user_id])
+            if len(end_to_end) >= args.joins:
+                done.set()
+
+    bot.join_queue.handler = tracked
+
+    async def one(n):
+        user_id = first_user_id + n
+        callback_query = make_callback_query(bot_client, user_id, "select_chat_1", message_id=n + 1)
+        started_at[user_id] = started = time.perf_counter()
+        await bot.select_chat_callback(bot_client, callback_query)
+        callback_latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await run_concurrently(args.joins, one)
+        await asyncio.wait_for(done.wait(), timeout=max(60, args.joins))
+        elapsed = time.perf_counter() - started
+    finally:
+        bot.join_queue.handler = handler
+    return elapsed, callback_latencies, end_to_end
+
+
+async def main():
+    dialog_counts = [int(value) for value in args.dialogs.split(",")]
+    member_counts = [int(value) for value in args.members.split(",")]
+
+    bot, bot_client, _ = await setup_bot(make_config(dialog_counts[0], member_counts[0]), args.accounts)
+    print(
+        f"joins={args.joins} concurrency={args.concurrency} accounts={args.accounts} "
+        f"latency={args.latency * 1000:.0f}ms workers={bot.JOIN_WORKERS} privacy={args.privacy_rate}"
+    )
+    print(f"{'dialogs':>8}{'members':>9}  {'path':<22}{'ok':>6}{'joins/s':>9}{'p50,ms':>9}{'p99,ms':>9}{'dialog pages':>14}")
+
+    user_id = 1
+    try:
+        for dialogs in dialog_counts:
+            for members in member_counts:
+                config = make_config(dialogs, members)
+                admins = await reset_admins(bot, config, args.accounts)
+
+                elapsed, succeeded, latencies = await bench_add_user(bot, user_id)
+                user_id += args.joins
+                pages = sum(admin.calls.get("get_dialogs", 0) for admin in admins)
+                print(
+                    f"{dialogs:>8}{members:>9}  {'add_user_to_chat':<22}{succeeded:>6}{args.joins / elapsed:>9.1f}"
+                    f"{percentile(latencies, 0.5) * 1000:>9.0f}{percentile(latencies, 0.99) * 1000:>9.0f}{pages:>14}"
+                )
+
+                admins = await reset_admins(bot, config, args.accounts)
+                elapsed, callback_latencies, end_to_end = await bench_select_chat(bot, bot_client, user_id)
+                user_id += args.joins
+                pages = sum(admin.calls.get("get_dialogs", 0) for admin in admins)
+                print(
+                    f"{dialogs:>8}{members:>9}  {'select_chat (callback)':<22}{len(callback_latencies):>6}"
+                    f"{args.joins / elapsed:>9.1f}{percentile(callback_latencies, 0.5) * 1000:>9.0f}"
+                    f"{percentile(callback_latencies, 0.99) * 1000:>9.0f}{'':>14}"
+                )
+                print(
+                    f"{dialogs:>8}{members:>9}  {'select_chat (e2e)':<22}{len(end_to_end):>6}"
+                    f"{args.joins / elapsed:>9.1f}{percentile(end_to_end, 0.5) * 1000:>9.0f}"
+                    f"{percentile(end_to_end, 0.99) * 1000:>9.0f}{pages:>14}"
+                )
+    finally:
+        await teardown_bot(bot)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Бенчмарк индекса пользователей в памяти (user_index.UserIndex).
+
+Сравнивает память и скорость проверки для IntIdSet (отсортированный массив int64
+с множествами изменений) и обычного множества Python на --users пользователях,
+из которых --blacklisted-share заблокированы. С --load-from-db также измеряет
+загрузку индекса из временной SQLite-базы при запуске.
+
+Запуск:
+    python benchmarks/bench_user_index.py --users 1000000
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=1_000_000, help="зарегистрированных пользователей")
+parser.add_argument("--blacklisted-share", type=float, default=0.01, help="доля заблокированных")
+parser.add_argument("--lookups", type=int, default=1_000_000, help="проверок для замера скорости")
+parser.add_argument("--updates", type=int, default=50_000, help="новых регистраций после загрузки")
+parser.add_argument("--load-from-db", action="store_true", help="измерить загрузку индекса из SQLite")
+parser.add_argument("--seed", type=int, default=1, help="зерно генератора")
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+os.environ.setdefault("ENCRYPTION_KEY", "bench")
+
+from user_index import IntIdSet, UserIndex
+
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size, elapsed
+
+
+def lookups_per_second(container, probes):
+    started = time.perf_counter()
+    for probe in probes:
+        probe in container
+    return len(probes) / (time.perf_counter() - started)
+
+
+def load_from_db(user_ids, blacklisted):
+    from sqlalchemy import insert
+    from database import init_db, engine, User
+
+    init_db()
+    started = time.perf_counter()
+    with engine.begin() as connection:
+        for offset in range(0, len(user_ids), 50_000):
+            connection.execute(insert(User), [
+                {"user_id": user_id, "first_name": "bench", "is_blacklisted": user_id in blacklisted}
+                for user_id in user_ids[offset:offset + 50_000]
+            ])
+    print(f"inserted {len(user_ids)} users into SQLite in {time.perf_counter() - started:.1f}s")
+
+    index = UserIndex()
+    started = time.perf_counter()
+    asyncio.run(index.load())
+    print(f"UserIndex.load: {time.perf_counter() - started:.2f}s, {index.nbytes / 1024 / 1024:.1f} MB")
+
+
+def main():
+    rng = random.Random(args.seed)
+    # Telegram user ID - до 10 знаков, поэтому плотная битовая карта не подходит
+    user_ids = rng.sample(range(10 ** 9, 8 * 10 ** 9), args.users)
+    blacklisted = set(rng.sample(user_ids, int(args.users * args.blacklisted_share)))
+    probes = [rng.choice(user_ids) if n % 2 else rng.randrange(10 ** 9, 8 * 10 ** 9) for n in range(args.lookups)]
+
+    print(f"users={args.users} blacklisted={len(blacklisted)} lookups={args.lookups} (50% hits)")
+    print(f"{'structure':<24}{'memory, MB':>12}{'bytes/id':>10}{'build, s':>10}{'lookups/s':>12}")
+
+    for name, build in (
+        ("IntIdSet (array int64)", lambda: IntIdSet(user_ids)),
+        # Свои объекты int, как при загрузке из БД
+        ("set()", lambda: {user_id + 1 - 1 for user_id in user_ids}),
+    ):
+        container, size, elapsed = measure(build)
+        rate = lookups_per_second(container, probes)
+        print(f"{name:<24}{size / 1024 / 1024:>12.1f}{size / args.users:>10.1f}{elapsed:>10.2f}{rate:>12,.0f}")
+        del container
+
+    # Регистрации после загрузки попадают в множество изменений и периодически сливаются в массив
+    index = IntIdSet(user_ids)
+    new_ids = rng.sample(range(8 * 10 ** 9, 9 * 10 ** 9), args.updates)
+    started = time.perf_counter()
+    for user_id in new_ids:
+        index.add(user_id)
+    elapsed = time.perf_counter() - started
+    print(f"\n{args.updates} add() after load: {elapsed:.2f}s, {index.nbytes / 1024 / 1024:.1f} MB reported by nbytes")
+
+    if args.load_from_db:
+        load_from_db(user_ids, blacklisted)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+Заменитель клиента Pyrogram для бенчмарков и нагрузочных тестов.
+
+Реализует методы Client, которые использует бот (get_dialogs, resolve_peer,
+get_users, add_chat_members, get_chat_member(s), send_message, send_photo,
+send_media_group, edit_message_text и др.), с настраиваемой задержкой,
+размером страниц, размером чатов и частотой ошибок PeerFlood,
+UserPrivacyRestricted и FloodWait. Сеть не используется.
+"""
+import random
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from pyrogram import raw, types
+from pyrogram.enums import ChatMemberStatus, ChatType
+from pyrogram.errors import PeerFlood, UserPrivacyRestricted, FloodWait, UserNotParticipant, PeerIdInvalid
+
+# Первый ID "посторонних" диалогов, которыми заполняется список диалогов аккаунта
+FILLER_CHAT_ID = -1009000000000
+
+
+class FakeConfig:
+    """
+    Параметры поведения заменителя. Задержки - в секундах на один вызов
+    (для постраничных методов - на одну страницу).
+    """
+
+    def __init__(self, latency=0.02, latency_jitter=0.5, dialogs=100, dialog_page_size=100,
+                 members=1000, member_page_size=200, peer_flood_rate=0.0, privacy_rate=0.0,
+                 flood_wait_rate=0.0, flood_wait_seconds=5, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.dialogs = dialogs
+        self.dialog_page_size = dialog_page_size
+        self.members = members
+        self.member_page_size = member_page_size
+        self.peer_flood_rate = peer_flood_rate
+        self.privacy_rate = privacy_rate
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.random = random.Random(seed)
+        # Пользователи с ограничением приватности определяются один раз для всех аккаунтов
+        self.restricted = {}
+
+
+class FakeClient:
+    """
+    Клиент с состоянием в памяти: диалоги аккаунта и участники целевых чатов.
+    Целевые чаты помещаются в конец списка диалогов, как редко используемые.
+    """
+
+    def __init__(self, name="fake", chat_ids=(), config=None, user_id=1):
+        self.name = name
+        self.config = config or FakeConfig()
+        self.me = SimpleNamespace(id=user_id, first_name=name, last_name=None, username=name)
+        self.is_connected = False
+        self.calls = {}
+        self._message_id = 0
+        self._chats = {chat_id: {} for chat_id in chat_ids}
+        self._known_peers = set()
+
+        # Уже состоящие участники: ID начиная с 10^12, чтобы не пересекаться с тестовыми пользователями
+        for chat_id in self._chats:
+            for n in range(self.config.members):
+                self._chats[chat_id][10 ** 12 + n] = ChatMemberStatus.MEMBER
+
+    async def _delay(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        latency = self.config.latency
+        if latency > 0:
+            jitter = self.config.latency_jitter
+            await asyncio.sleep(latency * self.config.random.uniform(1 - jitter, 1 + jitter))
+
+    def _next_message(self, chat_id, **fields):
+        self._message_id += 1
+        return SimpleNamespace(id=self._message_id, chat=SimpleNamespace(id=chat_id), **fields)
+
+    async def start(self):
+        await self._delay("start")
+        self.is_connected = True
+        return self
+
+    async def stop(self):
+        self.is_connected = False
+        return self
+
+    async def get_me(self):
+        await self._delay("get_me")
+        return self.me
+
+    async def resolve_peer(self, peer_id):
+        # Как и Pyrogram, без предварительного get_dialogs пира нет в хранилище
+        if peer_id not in self._known_peers:
+            raise KeyError(f"ID not found: {peer_id}")
+        if peer_id not in self._chats:
+            raise PeerIdInvalid()
+        return raw.types.InputPeerChannel(channel_id=-peer_id - 10 ** 12, access_hash=0)
+
+    async def get_dialogs(self, limit=0):
+        """
+        Диалоги страницами по dialog_page_size с задержкой на каждую страницу
+        """
+        chat_ids = [FILLER_CHAT_ID - n for n in range(max(self.config.dialogs - len(self._chats), 0))]
+        chat_ids += list(self._chats)
+        if limit:
+            chat_ids = chat_ids[:limit]
+
+        for offset in range(0, len(chat_ids), self.config.dialog_page_size):
+            await self._delay("get_dialogs")
+            for chat_id in chat_ids[offset:offset + self.config.dialog_page_size]:
+                self._known_peers.add(chat_id)
+                yield SimpleNamespace(chat=SimpleNamespace(id=chat_id, title=f"Чат {chat_id}"))
+
+    async def get_users(self, user_ids):
+        await self._delay("get_users")
+        make = lambda user_id: SimpleNamespace(id=user_id, first_name=f"user{user_id}", last_name=None, username=None)
+        if isinstance(user_ids, (list, tuple)):
+            return [make(user_id) for user_id in user_ids]
+        return make(user_ids)
+
+    async def add_chat_members(self, chat_id, user_ids, forward_limit=100):
+        await self._delay("add_chat_members")
+        config = self.config
+        roll = config.random.random()
+        if roll < config.peer_flood_rate:
+            raise PeerFlood()
+        roll -= config.peer_flood_rate
+        if roll < config.flood_wait_rate:
+            raise FloodWait(value=config.flood_wait_seconds)
+
+        members = self._chats.setdefault(chat_id, {})
+        for user_id in user_ids if isinstance(user_ids, (list, tuple)) else [user_ids]:
+            restricted = config.restricted.setdefault(user_id, config.random.random() < config.privacy_rate)
+            if restricted:
+                raise UserPrivacyRestricted()
+            members[user_id] = ChatMemberStatus.MEMBER
+        return True
+
+    async def get_chat_member(self, chat_id, user_id):
+        await self._delay("get_chat_member")
+        if user_id == "me":
+            # Аккаунт администратора - администратор своих целевых чатов
+            if chat_id not in self._chats:
+                raise UserNotParticipant()
+            return SimpleNamespace(user=self.me, status=ChatMemberStatus.ADMINISTRATOR, privileges=None, is_member=True)
+        status = self._chats.get(chat_id, {}).get(user_id)
+        if status is None:
+            raise UserNotParticipant()
+        return SimpleNamespace(user=SimpleNamespace(id=user_id), status=status, is_member=True)
+
+    async def get_chat_members(self, chat_id, limit=0):
+        """
+        Участники страницами по member_page_size с задержкой на каждую страницу
+        """
+        members = list(self._chats.get(chat_id, {}).items())
+        if limit:
+            members = members[:limit]
+        for offset in range(0, len(members), self.config.member_page_size):
+            await self._delay("get_chat_members")
+            for user_id, status in members[offset:offset + self.config.member_page_size]:
+                yield SimpleNamespace(user=SimpleNamespace(id=user_id), status=status, is_member=True)
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._delay("send_message")
+        return self._next_message(chat_id, text=text)
+
+    async def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        await self._delay("send_photo")
+        return self._next_message(chat_id, photo=SimpleNamespace(file_id=f"fake:{photo}"), caption=caption)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        await self._delay("send_media_group")
+        return [
+            self._next_message(chat_id, photo=SimpleNamespace(file_id=f"fake:{item.media}"), caption=item.caption)
+            for item in media
+        ]
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self._delay("edit_message_text")
+        return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=chat_id), text=text)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._delay("answer_callback_query")
+        return True
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._delay("delete_messages")
+        return len(message_ids) if isinstance(message_ids, (list, tuple)) else 1
+
+
+def _make_user(client, user_id):
+    return types.User(id=user_id, first_name=f"user{user_id}", is_bot=False, client=client)
+
+
+def _make_private_chat(client, user_id):
+    return types.Chat(id=user_id, type=ChatType.PRIVATE, first_name=f"user{user_id}", client=client)
+
+
+def make_message(client, user_id, text, message_id=1):
+    """
+    Входящее личное сообщение пользователя (например, /start) - настоящий объект Pyrogram,
+    поэтому к нему применимы фильтры обработчиков, а ответы уходят в заменитель клиента
+    """
+    return types.Message(
+        id=message_id,
+        from_user=_make_user(client, user_id),
+        chat=_make_private_chat(client, user_id),
+        date=datetime.now(),
+        text=text,
+        client=client
+    )
+
+
+def make_callback_query(client, user_id, data, message_id=1):
+    """
+    Нажатие инлайн-кнопки в сообщении бота с ID message_id
+    """
+    message = types.Message(
+        id=message_id,
+        chat=_make_private_chat(client, user_id),
+        date=datetime.now(),
+        client=client
+    )
+    return types.CallbackQuery(
+        id=f"{user_id}:{message_id}",
+        from_user=_make_user(client, user_id),
+        chat_instance=str(user_id),
+        message=message,
+        data=data,
+        client=client
+    )
+
+
+async def install_fake_admins(pool, chat_ids, accounts=1, config=None):
+    """
+    Заполняет пул администраторов заменителями клиентов (без обращения к БД и Telegram)
+    """
+    clients = []
+    for account_id in range(1, accounts + 1):
+        client = FakeClient(f"admin_{account_id}", chat_ids, config, user_id=account_id)
+        await client.start()
+        await pool.attach_client(account_id, f"+000{account_id}", client)
+        clients.append(client)
+    return clients
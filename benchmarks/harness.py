@@ -0,0 +1,102 @@
+"""
+Запуск обработчиков bot.py в одном процессе с заменителями клиентов Pyrogram.
+
+prepare_env() нужно вызвать до импорта bot: модуль читает настройки при импорте.
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ID целевых чатов в тестовом окружении (переносятся в таблицу chats при создании базы)
+CHAT_ID_1 = -1001000000001
+CHAT_ID_2 = -1001000000002
+
+
+def prepare_env(database_url=None):
+    """
+    Настройки окружения для запуска без Telegram: временная SQLite-база, без эндпоинта метрик,
+    без ограничения частоты добавлений и с короткими паузами аккаунтов
+    """
+    workdir = tempfile.mkdtemp(prefix="bot-bench-")
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{workdir}/bench.db"
+    defaults = {
+        "ENCRYPTION_KEY": "bench",
+        "BOT_TOKEN": "0:bench",
+        "API_ID": "1",
+        "API_HASH": "bench",
+        "ADMIN_IDS": "1",
+        "CHAT_ID_1": str(CHAT_ID_1),
+        "CHAT_ID_2": str(CHAT_ID_2),
+        "METRICS_PORT": "0",
+        "LOG_LEVEL": "ERROR",
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "ADMIN_ADD_INTERVAL": "0",
+        "PEER_FLOOD_COOLDOWN": "1",
+        "JOIN_COOLDOWN": "0",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    return workdir
+
+
+async def setup_bot(config, accounts=1):
+    """
+    Импортирует bot.py, подменяет клиент бота и клиенты администраторов заменителями
+    и запускает фоновые компоненты. Возвращает (модуль bot, клиент бота, клиенты администраторов).
+    """
+    import bot
+    from database import init_db
+    from fake_client import FakeClient
+
+    init_db()
+    await bot.chat_registry.load()
+    await bot.user_index.load()
+
+    bot_client = FakeClient("bot", config=config)
+    bot.bot = bot_client
+    bot.instruction_media.client = bot_client
+    bot.admin_notifier.client = bot_client
+    await bot.admin_notifier.start()
+    await bot.user_writer.start()
+    await bot.daily_stats.start()
+
+    admins = await reset_admins(bot, config, accounts)
+    await bot.join_queue.start()
+    return bot, bot_client, admins
+
+
+async def reset_admins(bot, config, accounts):
+    """
+    Новый пул администраторов и пустой кэш пиров (следующее добавление снова просматривает диалоги)
+    """
+    from admin_pool import AdminClientPool
+    from chat_resolver import ChatPeerResolver
+    from fake_client import install_fake_admins
+
+    bot.chat_resolver = ChatPeerResolver(bot.chat_registry.chat_ids)
+    bot.admin_pool = AdminClientPool(
+        bot.API_ID, bot.API_HASH,
+        max_leases=bot.ADMIN_CLIENT_MAX_LEASES,
+        acquire_timeout=bot.ADMIN_ACQUIRE_TIMEOUT,
+        on_stop=bot.chat_resolver.invalidate,
+        add_burst=bot.ADMIN_ADD_BURST,
+        add_interval=bot.ADMIN_ADD_INTERVAL
+    )
+    return await install_fake_admins(bot.admin_pool, [CHAT_ID_1, CHAT_ID_2], accounts, config)
+
+
+async def teardown_bot(bot):
+    await bot.join_queue.stop()
+    await bot.admin_pool.stop()
+    await bot.admin_notifier.stop()
+    await bot.user_writer.stop()
+    await bot.daily_stats.stop()
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
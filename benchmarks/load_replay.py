@@ -0,0 +1,173 @@
+"""
+Нагрузочный тест: поток обновлений /start и выбора чата через зарегистрированные обработчики бота.
+
+Обновления (настоящие объекты Message/CallbackQuery Pyrogram) проходят через фильтры
+и обработчики диспетчера бота так же, как при получении из Telegram. Клиенты бота
+и администраторов заменены на benchmarks/fake_client.py, база - локальная SQLite
+или Postgres (--database-url).
+
+Синтетическая нагрузка: пользователи приходят с частотой --rate в секунду,
+каждый отправляет /start и через --think секунд нажимает "Чат #1" или "Чат #2".
+Повтор записанной нагрузки: --replay файл.jsonl со строками
+    {"at": 0.125, "user_id": 1001, "text": "/start"}
+    {"at": 1.300, "user_id": 1001, "data": "select_chat_1"}
+Синтетическое расписание можно сохранить для повтора через --record.
+
+Отчет: задержка цикла событий, глубина очереди заявок и очереди потоков БД,
+длительность обработчиков и обращений к БД (включая ожидание потока).
+
+Запуск:
+    python benchmarks/load_replay.py --users 2000 --rate 200
+"""
+import os
+import json
+import random
+import asyncio
+import argparse
+
+from harness import prepare_env, setup_bot, teardown_bot, percentile
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--users", type=int, default=1000, help="пользователей в синтетической нагрузке")
+parser.add_argument("--rate", type=float, default=100, help="новых пользователей в секунду")
+parser.add_argument("--poisson", action="store_true", help="случайные (пуассоновские) интервалы прихода вместо равномерных")
+parser.add_argument("--think", type=float, default=1.0, help="секунд между /start и выбором чата")
+parser.add_argument("--double-click", type=float, default=0.1, help="доля пользователей, нажимающих кнопку дважды")
+parser.add_argument("--replay", default=None, help="файл JSONL с записанными обновлениями")
+parser.add_argument("--record", default=None, help="сохранить синтетическое расписание в файл JSONL")
+parser.add_argument("--speed", type=float, default=1.0, help="ускорение повтора (2 - вдвое быстрее)")
+parser.add_argument("--accounts", type=int, default=4, help="аккаунтов администраторов")
+parser.add_argument("--latency", type=float, default=0.02, help="задержка одного вызова API (с)")
+parser.add_argument("--privacy-rate", type=float, default=0.1, help="доля пользователей с ограничением приватности")
+parser.add_argument("--drain", type=float, default=60, help="сколько секунд ждать обработки очереди заявок после нагрузки")
+parser.add_argument("--sample", type=float, default=0.01, help="интервал замера задержки цикла и очередей (с)")
+parser.add_argument("--seed", type=int, default=1, help="зерно генератора")
+parser.add_argument("--database-url", default=None, help="URL базы данных (по умолчанию временная SQLite)")
+args = parser.parse_args()
+
+prepare_env(args.database_url)
+
+import bot
+from pyrogram.handlers import MessageHandler, CallbackQueryHandler
+from database import db_executor, db_call_seconds, DB_THREADS
+from fake_client import FakeConfig, make_message, make_callback_query
+
+# Обработчики регистрируются в диспетчере настоящего клиента бота (в его цикле событий)
+dispatcher = bot.bot.dispatcher
+loop = bot.bot.loop
+
+
+def synthesize():
+    """
+    Расписание обновлений: (время, user_id, текст сообщения или данные кнопки)
+    """
+    rng = random.Random(args.seed)
+    events = []
+    at = 0.0
+    for n in range(args.users):
+        user_id = 100000 + n
+        events.append({"at": at, "user_id": user_id, "text": "/start"})
+        data = f"select_chat_{rng.choice((1, 2))}"
+        events.append({"at": at + args.think, "user_id": user_id, "data": data})
+        if rng.random() < args.double_click:
+            events.append({"at": at + args.think + 0.2, "user_id": user_id, "data": data})
+        at += rng.expovariate(args.rate) if args.poisson else 1 / args.rate
+    events.sort(key=lambda event: event["at"])
+    return events
+
+
+def load_replay(path):
+    with open(path, encoding="utf-8") as file:
+        events = [json.loads(line) for line in file if line.strip()]
+    events.sort(key=lambda event: event["at"])
+    return events
+
+
+async def dispatch(client, update, handler_type):
+    """
+    Как диспетчер Pyrogram: в каждой группе срабатывает первый обработчик с подходящими фильтрами
+    """
+    for handlers in list(dispatcher.groups.values()):
+        for handler in handlers:
+            if type(handler) is handler_type and await handler.check(client, update):
+                await handler.callback(client, update)
+                break
+
+
+async def monitor(stop, samples):
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(args.sample)
+        samples["lag"].append(max(0.0, loop.time() - started - args.sample))
+        samples["join_queue"].append(bot.join_queue.depth)
+        samples["db_queue"].append(db_executor._work_queue.qsize())
+
+
+async def main():
+    events = load_replay(args.replay) if args.replay else synthesize()
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as file:
+            for event in events:
+                file.write(json.dumps(event) + "\n")
+
+    config = FakeConfig(latency=args.latency, privacy_rate=args.privacy_rate, seed=args.seed)
+    _, bot_client, _ = await setup_bot(config, args.accounts)
+
+    samples = {"lag": [], "join_queue": [], "db_queue": []}
+    errors = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(monitor(stop, samples))
+
+    async def fire(n, event):
+        try:
+            if "text" in event:
+                update = make_message(bot_client, event["user_id"], event["text"], message_id=n + 1)
+                await dispatch(bot_client, update, MessageHandler)
+            else:
+                update = make_callback_query(bot_client, event["user_id"], event["data"], message_id=n + 1)
+                await dispatch(bot_client, update, CallbackQueryHandler)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    # Открытая модель нагрузки: обновления приходят по расписанию независимо от скорости обработки
+    tasks = []
+    started = loop.time()
+    for n, event in enumerate(events):
+        delay = started + event["at"] / args.speed - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(fire(n, event)))
+    await asyncio.gather(*tasks)
+    handled = loop.time() - started
+
+    try:
+        await asyncio.wait_for(bot.join_queue._queue.join(), args.drain)
+    except asyncio.TimeoutError:
+        print(f"join queue not drained within {args.drain}s")
+    total = loop.time() - started
+
+    stop.set()
+    await sampler
+    await teardown_bot(bot)
+
+    lag = samples["lag"]
+    print(f"updates={len(events)} duration={events[-1]['at'] / args.speed if events else 0:.1f}s "
+          f"handled_in={handled:.1f}s drained_in={total:.1f}s accounts={args.accounts} db={os.environ['DATABASE_URL']}")
+    print(f"event loop lag, ms: p50={percentile(lag, 0.5) * 1000:.1f} p99={percentile(lag, 0.99) * 1000:.1f} "
+          f"max={max(lag, default=0) * 1000:.1f}")
+    print(f"join queue depth: max={max(samples['join_queue'], default=0)} "
+          f"avg={sum(samples['join_queue']) / max(len(samples['join_queue']), 1):.1f}")
+    print(f"db thread queue: max={max(samples['db_queue'], default=0)} "
+          f"avg={sum(samples['db_queue']) / max(len(samples['db_queue']), 1):.1f} (threads={DB_THREADS})")
+    print("\nhandlers:")
+    for label, value in bot.handler_seconds.summary():
+        print(f"  {label}: {value}")
+    print("\ndb calls (incl. wait for a thread):")
+    for label, value in db_call_seconds.summary():
+        print(f"  {label}: {value}")
+    if errors:
+        print(f"\nerrors: {len(errors)}, first: {errors[0]}")
+
+
+if __name__ == "__main__":
+    loop.run_until_complete(main())
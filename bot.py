@@ -1,25 +1,50 @@
 import os
+import re
+import io
+import csv
+import math
+import time
 import logging
 import asyncio
 import base64
 import hashlib
+import itertools
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from pyrogram import Client, filters, types, errors, raw
+from pyrogram import Client, filters, types, errors, raw, idle
 from pyrogram.raw import functions
-from pyrogram.errors import UserAlreadyParticipant, UserPrivacyRestricted, PeerFlood, InviteHashExpired
+from pyrogram.errors import UserAlreadyParticipant, UserPrivacyRestricted, PeerFlood, FloodWait, InviteHashExpired, ChatAdminRequired
 from cryptography.fernet import Fernet
+from sqlalchemy import tuple_, select, update
+from sqlalchemy.exc import IntegrityError
 import json
-from database import init_db, get_session, User, AdminAccount, JoinRequest, encrypt_session, decrypt_session, get_fernet_key
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
+from database import init_db, run_db, run_in_session, rotate_session_keys, ENCRYPTION_KEYS, User, AdminAccount, JoinRequest, encrypt_session, decrypt_session, get_fernet_key
+from chat_resolver import ChatPeerResolver, PEER_ERRORS
+from chat_registry import ChatRegistry
+from membership import Membership, verify_membership
+from admin_pool import AdminClientPool, ACCOUNT_ERRORS
+from admin_health import AdminHealthProber
+from join_queue import JoinQueue, JoinJob
+from join_leases import JoinLeaseClaimer, default_owner
+from notifications import AdminNotifier
+from instruction_media import InstructionMedia
+from metrics import registry as metrics, timed, start_metrics_server
+from logging_setup import setup_logging, set_correlation_id, correlated
+from user_index import UserIndex
+from user_writer import UserWriter
+from archiver import JoinRequestArchiver
+from daily_stats import DailyStats
+
+# Настройка логирования (запись в файл и консоль выполняется в отдельном потоке)
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    # У каждого процесса-обработчика (WORKER_INDEX > 0) свой файл лога
+    log_file=os.getenv("LOG_FILE") or ("bot.log" if os.getenv("WORKER_INDEX", "0") == "0" else f"bot.worker{os.getenv('WORKER_INDEX')}.log"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+    sample_burst=int(os.getenv("LOG_SAMPLE_BURST", "20")),
+    sample_window=int(os.getenv("LOG_SAMPLE_WINDOW", "60"))
 )
 logger = logging.getLogger(__name__)
 
@@ -31,26 +56,142 @@ API_HASH = os.getenv("API_HASH")
 ADMIN_IDS = list(map(int, os.getenv("ADMIN_IDS").split(",")))
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 
-# Получаем ID чатов напрямую из переменных окружения
-CHAT_ID_1_STR = os.getenv("CHAT_ID_1")
-CHAT_ID_2_STR = os.getenv("CHAT_ID_2")
+# Целевые чаты хранятся в таблице chats (CHAT_ID_1/CHAT_ID_2 переносятся в нее при первом запуске).
+# Интервал пересчета матрицы доступа аккаунтов к чатам (секунды, 0 - только при запуске)
+CHAT_ACCESS_REFRESH_INTERVAL = int(os.getenv("CHAT_ACCESS_REFRESH_INTERVAL", "600"))
+
+# Сколько заявок одновременно может обрабатывать один аккаунт администратора
+ADMIN_CLIENT_MAX_LEASES = int(os.getenv("ADMIN_CLIENT_MAX_LEASES", "1"))
+
+# Ограничение частоты добавлений одним аккаунтом: ADMIN_ADD_BURST подряд, затем одно в ADMIN_ADD_INTERVAL секунд
+ADMIN_ADD_BURST = int(os.getenv("ADMIN_ADD_BURST", "5"))
+ADMIN_ADD_INTERVAL = float(os.getenv("ADMIN_ADD_INTERVAL", "60"))
+
+# Сколько ждать доступного аккаунта, пауза аккаунта после PeerFlood и число попыток на разных аккаунтах
+ADMIN_ACQUIRE_TIMEOUT = int(os.getenv("ADMIN_ACQUIRE_TIMEOUT", "300"))
+PEER_FLOOD_COOLDOWN = int(os.getenv("PEER_FLOOD_COOLDOWN", "86400"))
+JOIN_ADD_ATTEMPTS = int(os.getenv("JOIN_ADD_ATTEMPTS", "3"))
+
+# Фоновая проверка клиентов администраторов: интервал и таймаут (секунды), после скольких неудач подряд
+# клиент не получает заявок и после скольких перезапускается
+ADMIN_HEALTH_INTERVAL = int(os.getenv("ADMIN_HEALTH_INTERVAL", "60"))
+ADMIN_HEALTH_TIMEOUT = int(os.getenv("ADMIN_HEALTH_TIMEOUT", "10"))
+ADMIN_HEALTH_FAILURES = int(os.getenv("ADMIN_HEALTH_FAILURES", "2"))
+ADMIN_HEALTH_RESTART_FAILURES = int(os.getenv("ADMIN_HEALTH_RESTART_FAILURES", "5"))
+
+# Количество обработчиков очереди заявок и время на их завершение при остановке
+JOIN_WORKERS = int(os.getenv("JOIN_WORKERS", "4"))
+JOIN_DRAIN_TIMEOUT = int(os.getenv("JOIN_DRAIN_TIMEOUT", "30"))
+
+# Повторные проверки заявки, если добавление не удалось подтвердить: пауза (секунды) и число попыток
+JOIN_RECHECK_DELAY = int(os.getenv("JOIN_RECHECK_DELAY", "60"))
+JOIN_RECHECK_ATTEMPTS = int(os.getenv("JOIN_RECHECK_ATTEMPTS", "3"))
+
+# Минимальный интервал между новыми попытками вступления одного пользователя (секунды)
+JOIN_COOLDOWN = int(os.getenv("JOIN_COOLDOWN", "10"))
+
+# Рассылка уведомлений администраторам: параллельность, окно подавления дубликатов и интервал сводки (0 - без сводки)
+ADMIN_NOTIFY_CONCURRENCY = int(os.getenv("ADMIN_NOTIFY_CONCURRENCY", "5"))
+ADMIN_NOTIFY_DEDUP_WINDOW = int(os.getenv("ADMIN_NOTIFY_DEDUP_WINDOW", "300"))
+ADMIN_DIGEST_INTERVAL = int(os.getenv("ADMIN_DIGEST_INTERVAL", "0"))
+
+# Чат для однократной загрузки скриншотов инструкции при запуске (по умолчанию первый администратор)
+MEDIA_WARMUP_CHAT_ID = int(os.getenv("MEDIA_WARMUP_CHAT_ID", "0")) or ADMIN_IDS[0]
+
+# Отложенная запись пользователей: интервал (секунды) и максимальный размер пачки
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", "0.3"))
+USER_FLUSH_BATCH = int(os.getenv("USER_FLUSH_BATCH", "500"))
 
-# Прямое использование ID чатов
-CHAT_ID_1 = int(CHAT_ID_1_STR) if CHAT_ID_1_STR and CHAT_ID_1_STR != "0" else 0
-CHAT_ID_2 = int(CHAT_ID_2_STR) if CHAT_ID_2_STR and CHAT_ID_2_STR != "0" else 0
+# Несколько процессов с одной базой Postgres: WORKER_COUNT процессов с номерами WORKER_INDEX от 0.
+# Процесс 0 получает обновления Telegram, остальные только обрабатывают заявки. Каждый процесс
+# запускает свою часть аккаунтов администраторов и захватывает заявки в аренду на JOIN_LEASE_SECONDS.
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+JOIN_LEASE_SECONDS = int(os.getenv("JOIN_LEASE_SECONDS", "600"))
+JOIN_POLL_INTERVAL = float(os.getenv("JOIN_POLL_INTERVAL", "1"))
+JOIN_ORPHAN_AFTER = int(os.getenv("JOIN_ORPHAN_AFTER", "60"))
+JOIN_HEARTBEAT_INTERVAL = int(os.getenv("JOIN_HEARTBEAT_INTERVAL", "10"))
+RECEIVES_UPDATES = WORKER_INDEX == 0
 
-# Запасные ссылки на чаты
-CHAT_LINK_1 = os.getenv("CHAT_LINK_1", "")
-CHAT_LINK_2 = os.getenv("CHAT_LINK_2", "")
+# Архивация завершенных заявок старше ARCHIVE_AFTER_DAYS дней (0 - не архивировать) в сжатые файлы в ARCHIVE_DIR
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "5000"))
 
-logger.info(f"Используются ID чатов: {CHAT_ID_1}, {CHAT_ID_2}")
-logger.info(f"Запасные ссылки на чаты: {CHAT_LINK_1}, {CHAT_LINK_2}")
+# Интервал записи дневных счетчиков событий в БД (секунды)
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "5"))
+
+# Адрес HTTP-эндпоинта с метриками (METRICS_PORT=0 отключает эндпоинт, процессы-обработчики используют METRICS_PORT + WORKER_INDEX)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
 
 # Инициализация бота
-bot = Client("telegram_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+# Процессы-обработчики только отправляют сообщения (no_updates) и используют свой файл сессии
+bot = Client(
+    "telegram_bot" if RECEIVES_UPDATES else f"telegram_bot_worker{WORKER_INDEX}",
+    api_id=API_ID,
+    api_hash=API_HASH,
+    bot_token=BOT_TOKEN,
+    no_updates=not RECEIVES_UPDATES
+)
+
+# Очередь уведомлений администраторам
+admin_notifier = AdminNotifier(
+    bot,
+    ADMIN_IDS,
+    concurrency=ADMIN_NOTIFY_CONCURRENCY,
+    dedup_window=ADMIN_NOTIFY_DEDUP_WINDOW,
+    digest_interval=ADMIN_DIGEST_INTERVAL
+)
+
+# Скриншоты инструкции по настройкам приватности
+instruction_media = InstructionMedia(bot)
+
+# Целевые чаты и матрица доступа аккаунтов администраторов к ним (загружаются при запуске)
+chat_registry = ChatRegistry(refresh_interval=CHAT_ACCESS_REFRESH_INTERVAL)
+
+# Кэш пиров целевых чатов для аккаунтов администраторов
+chat_resolver = ChatPeerResolver([])
+
+# Пул запущенных клиентов администраторов
+admin_pool = AdminClientPool(
+    API_ID,
+    API_HASH,
+    max_leases=ADMIN_CLIENT_MAX_LEASES,
+    acquire_timeout=ADMIN_ACQUIRE_TIMEOUT,
+    on_stop=chat_resolver.invalidate,
+    add_burst=ADMIN_ADD_BURST,
+    add_interval=ADMIN_ADD_INTERVAL,
+    shard=(WORKER_INDEX, WORKER_COUNT)
+)
+
+# Фоновая проверка клиентов пула (обработка заявок не вызывает get_me)
+admin_health = AdminHealthProber(
+    admin_pool,
+    interval=ADMIN_HEALTH_INTERVAL,
+    timeout=ADMIN_HEALTH_TIMEOUT,
+    failure_threshold=ADMIN_HEALTH_FAILURES,
+    restart_threshold=ADMIN_HEALTH_RESTART_FAILURES
+)
+
+# Зарегистрированные и заблокированные пользователи в памяти (загружаются при запуске)
+user_index = UserIndex()
 
-# Глобальная переменная для хранения активной сессии администратора
-active_admin_client = None
+# Регистрации и обновления профилей пользователей записываются в БД пачками
+user_writer = UserWriter(flush_interval=USER_FLUSH_INTERVAL, max_batch=USER_FLUSH_BATCH)
+
+# Дневные счетчики событий для /summary (записываются в БД пачками)
+daily_stats = DailyStats(flush_interval=STATS_FLUSH_INTERVAL)
+
+# Перенос старых завершенных заявок в архив
+archiver = JoinRequestArchiver(ARCHIVE_DIR, max_age_days=ARCHIVE_AFTER_DAYS, interval=ARCHIVE_INTERVAL, batch_size=ARCHIVE_BATCH)
+
+# Метрики этапов добавления и обработчиков
+join_stage_seconds = metrics.histogram("join_stage_seconds", "Длительность этапов добавления в чат", ["stage"])
+join_outcomes_total = metrics.counter("join_outcomes_total", "Результаты попыток добавления в чат", ["outcome"])
+handler_seconds = metrics.histogram("handler_seconds", "Длительность обработчиков бота", ["handler"])
+startup_phase_seconds = metrics.histogram("startup_phase_seconds", "Длительность этапов запуска", ["phase"])
 
 def convert_to_supergroup_id(chat_id):
     """
@@ -63,173 +204,132 @@ def convert_to_supergroup_id(chat_id):
             return int(str(chat_id)[4:])
     return chat_id
 
-async def get_admin_client():
+def _update_pending_status(session, user_id, chat_id, status):
+    join_request = session.query(JoinRequest).filter_by(user_id=user_id, chat_id=chat_id, status="pending").first()
+    if join_request:
+        join_request.status = status
+        session.commit()
+
+async def set_request_status(user_id, chat_id, status):
     """
-    Получение активного клиента администратора с ротацией
+    Обновление статуса ожидающей заявки пользователя
     """
-    global active_admin_client
-    
-    # Если клиент уже создан и активен, возвращаем его
-    if active_admin_client and active_admin_client.is_connected:
-        logger.info("Используем существующий клиент администратора")
-        return active_admin_client
-    
-    # Если клиент существует, но не активен, пытаемся остановить его
-    if active_admin_client:
-        try:
-            await active_admin_client.stop()
-        except Exception as e:
-            logger.error(f"Ошибка при остановке клиента: {e}")
-        active_admin_client = None
-    
-    session = get_session()
     try:
-        # Получаем аккаунт администратора с наименьшим количеством использований
-        admin_account = session.query(AdminAccount).filter_by(active=True).order_by(AdminAccount.usage_count).first()
-        
-        if not admin_account:
-            logger.error("Нет доступных аккаунтов администраторов")
-            return None
-        
-        logger.info(f"Используем аккаунт администратора: {admin_account.phone}")
-        
-        # Расшифровываем данные сессии
-        try:
-            session_data = decrypt_session(admin_account.session_data)
-            session_string = session_data.get("session_string")
-            
-            if not session_string:
-                logger.error("Нет строки сессии в данных аккаунта")
-                return None
-                
-            # Создаем клиент из строки сессии
-            client = Client(
-                name="admin",
-                api_id=API_ID,
-                api_hash=API_HASH,
-                session_string=session_string,
-                in_memory=True
-            )
-            
-            # Запускаем клиент
-            await client.start()
-            logger.info("Клиент администратора запущен успешно")
-            
-            # Получаем информацию о самом себе для проверки
-            me = await client.get_me()
-            logger.info(f"Авторизован как: {me.first_name} {me.last_name or ''} (@{me.username or 'нет'})")
-            
-            # Обновляем статистику использования
-            admin_account.last_used = datetime.now()
-            admin_account.usage_count += 1
-            session.commit()
-            
-            active_admin_client = client
-            return client
-        except Exception as e:
-            logger.error(f"Ошибка при инициализации клиента: {e}")
-            # Деактивируем проблемный аккаунт
-            admin_account.active = False
-            session.commit()
-            logger.warning(f"Аккаунт {admin_account.phone} деактивирован из-за ошибки")
-            return None
+        await run_in_session(_update_pending_status, user_id, chat_id, status)
     except Exception as e:
-        logger.error(f"Ошибка при получении клиента администратора: {e}")
-        return None
-    finally:
-        session.close()
+        logger.error(f"Ошибка при обновлении статуса заявки: {e}")
 
 async def add_user_to_chat(user_id, chat_id):
     """
-    Прямое добавление пользователя в чат администратором
+    Прямое добавление пользователя в чат администратором.
+    Возвращает (успех, сообщение); успех None - добавление выполнено, но не подтверждено проверкой.
+    """
+    # По матрице доступа исключаются аккаунты, которые не могут добавлять в этот чат
+    # (еще не проверенные аккаунты допускаются)
+    accept = lambda account_id: chat_registry.can_add(account_id, chat_id) is not False
+    
+    for attempt in range(JOIN_ADD_ATTEMPTS):
+        # Пул ждет аккаунт, который раньше других сможет выполнить добавление
+        with join_stage_seconds.time(stage="acquire_admin"):
+            lease = await admin_pool.acquire(accept)
+        if not lease:
+            logger.error(f"Нет доступного администратора")
+            join_outcomes_total.inc(outcome="no_admin")
+            return False, "Нет доступного администратора для добавления в чат"
+        
+        try:
+            result = await add_user_with_lease(lease, user_id, chat_id)
+        finally:
+            await admin_pool.release(lease)
+        
+        # Аккаунт получил FloodWait/PeerFlood или оказался без доступа к чату - повторяем на следующем аккаунте
+        # (неподтвержденное добавление не повторяем: пользователь, скорее всего, уже в чате)
+        if result[0] is None or (not lease.cooldown and accept(lease.account_id)):
+            return result
+        logger.info(f"Попытка {attempt + 1}/{JOIN_ADD_ATTEMPTS} не удалась из-за лимитов или доступа аккаунта {lease.phone}")
+    
+    return False, "Достигнут лимит добавлений. Попробуйте позже."
+
+async def add_user_with_lease(lease, user_id, chat_id):
+    """
+    Добавление пользователя в чат через арендованный клиент администратора
     """
-    admin_client = await get_admin_client()
-    if not admin_client:
-        logger.error(f"Нет доступного администратора")
-        return False, "Нет доступного администратора для добавления в чат"
+    admin_client = lease.client
+    logger.info(f"Используем аккаунт администратора: {lease.phone}")
     
     # Определяем имя чата
-    chat_name = "основной чат" if chat_id == CHAT_ID_1 else "второй чат"
+    chat_name = chat_registry.title(chat_id)
     
     try:
-        # Получаем список всех чатов для админа
-        logger.info("Получаем список чатов")
-        dialogs = []
-        async for dialog in admin_client.get_dialogs():
-            dialogs.append(dialog)
-            logger.info(f"Найден чат: {dialog.chat.title or dialog.chat.first_name} (ID: {dialog.chat.id})")
-        
-        # Ищем чат с заголовком "test"
-        target_chat = None
-        for dialog in dialogs:
-            if dialog.chat.title == "test":
-                target_chat = dialog.chat
-                logger.info(f"Найден нужный чат: {dialog.chat.title} (ID: {dialog.chat.id})")
-                break
-        
-        if not target_chat:
+        # Получаем пир целевого чата из кэша (поиск по диалогам выполняется только один раз на аккаунт)
+        with join_stage_seconds.time(stage="resolve_chat"):
+            target_peer = await chat_resolver.resolve(lease.account_id, admin_client, chat_id)
+        
+        if not target_peer:
             logger.error("Не удалось найти целевой чат")
+            join_outcomes_total.inc(outcome="chat_not_found")
+            chat_registry.set_access(lease.account_id, chat_id, False)
             return False, "Не удалось найти чат для добавления"
         
         # Добавляем пользователя напрямую
-        logger.info(f"Попытка прямого добавления пользователя {user_id} в чат {target_chat.id}")
+        logger.info(f"Попытка прямого добавления пользователя {user_id} в чат {chat_id}")
         
+        # Проверка настроек приватности перед добавлением. Ошибка пира здесь относится к пользователю,
+        # а не к чату: кэш пира и матрица доступа не меняются, другие аккаунты не пробуются
         try:
-            # Проверка настроек приватности перед добавлением
-            user_info = await admin_client.get_users(user_id)
-            logger.info(f"Получена информация о пользователе: {user_info.first_name} {user_info.last_name or ''}")
+            with join_stage_seconds.time(stage="get_users"):
+                user_info = await admin_client.get_users(user_id)
+        except (KeyError, *PEER_ERRORS) as peer_error:
+            logger.error(f"Аккаунт {lease.phone} не может найти пользователя {user_id}: {type(peer_error).__name__}")
+            join_outcomes_total.inc(outcome="user_not_found")
+            return False, "Не удалось найти ваш аккаунт Telegram"
+        
+        try:
+            logger.debug(f"Получена информация о пользователе: {user_info.first_name} {user_info.last_name or ''}")
             
             # Дополнительное логирование для проверки настроек приватности
-            logger.info(f"Проверяем возможность добавления пользователя {user_id} в чат {target_chat.id}...")
+            logger.debug(f"Проверяем возможность добавления пользователя {user_id} в чат {chat_id}...")
             
             # Попытка добавления
-            result = await admin_client.add_chat_members(
-                chat_id=target_chat.id,
-                user_ids=user_id
-            )
-            logger.info(f"Результат вызова add_chat_members: {result}")
-            
-            # Проверяем, действительно ли пользователь добавлен
-            # Добавляем паузу для обновления списка участников
-            await asyncio.sleep(1)
-            
-            # Получаем список участников чата после добавления
-            logger.info(f"Проверяем наличие пользователя {user_id} в списке участников чата...")
-            chat_members = []
-            async for member in admin_client.get_chat_members(target_chat.id):
-                chat_members.append(member.user.id)
+            with join_stage_seconds.time(stage="add_chat_members"):
+                result = await admin_client.add_chat_members(
+                    chat_id=chat_id,
+                    user_ids=user_id
+                )
+            logger.debug(f"Результат вызова add_chat_members: {result}")
             
-            logger.info(f"Найдено {len(chat_members)} участников чата")
+            # Проверяем, действительно ли пользователь добавлен (запрос одного участника с повторами)
+            logger.debug(f"Проверяем членство пользователя {user_id} в чате {chat_id}...")
+            with join_stage_seconds.time(stage="verify_membership"):
+                membership = await verify_membership(admin_client, chat_id, user_id)
+            logger.debug(f"Результат проверки членства: {membership.value}")
             
-            if user_id in chat_members:
-                logger.info(f"Пользователь {user_id} найден в списке участников чата")
+            if membership == Membership.MEMBER:
                 logger.info(f"Пользователь {user_id} успешно добавлен в чат (проверено)")
+                join_outcomes_total.inc(outcome="approved")
+                daily_stats.inc("account_adds", chat_id, lease.account_id)
                 
                 # Отправляем пользователю уведомление об успешном добавлении ТОЛЬКО ЕСЛИ ДОБАВЛЕНИЕ ПРОШЛО УСПЕШНО!
                 await bot.send_message(
                     user_id,
-                    f"✅ Вы были успешно добавлены в {chat_name}!\n\n"
+                    f"✅ Вы были успешно добавлены в чат «{chat_name}»!\n\n"
                     f"Можете открыть чат в своем приложении Telegram."
                 )
                 
                 # Обновляем статус заявки
-                session = get_session()
-                try:
-                    join_request = session.query(JoinRequest).filter_by(user_id=user_id, chat_id=chat_id, status="pending").first()
-                    if join_request:
-                        join_request.status = "approved"
-                        session.commit()
-                except Exception as e:
-                    logger.error(f"Ошибка при обновлении статуса заявки: {e}")
-                finally:
-                    session.close()
+                await set_request_status(user_id, chat_id, "approved")
                 
                 return True, "Пользователь успешно добавлен в чат"
+            elif membership == Membership.UNKNOWN:
+                # Добавление прошло без ошибок, но Telegram не ответил на проверку - заявка остается
+                # в ожидании и проверяется повторно (success=None), а не отклоняется
+                logger.warning(f"Не удалось проверить членство пользователя {user_id} в чате {chat_id}")
+                join_outcomes_total.inc(outcome="unconfirmed")
+                return None, "Не удалось подтвердить добавление в чат"
             else:
-                # Если add_chat_members не вызвало исключение, но пользователь не в списке участников,
+                # Если add_chat_members не вызвало исключение, но пользователь не состоит в чате,
                 # значит, скорее всего, проблема с приватностью не была правильно обработана
-                logger.warning(f"Пользователь {user_id} не найден в списке участников чата ({len(chat_members)} участников)")
-                logger.warning(f"Вызов add_chat_members завершился без ошибок, но пользователь {user_id} не найден в списке участников")
+                logger.warning(f"Вызов add_chat_members завершился без ошибок, но пользователь {user_id} не состоит в чате")
                 
                 # Проверяем другие возможные причины
                 logger.info(f"Проверяем дополнительные сведения о пользователе {user_id}...")
@@ -244,9 +344,8 @@ async def add_user_to_chat(user_id, chat_id):
             logger.warning(f"ОШИБКА ПРИВАТНОСТИ: {user_id} не может быть добавлен из-за настроек приватности")
             logger.warning(f"Детали ошибки: {str(privacy_error)}")
             logger.warning(f"Тип исключения: {type(privacy_error).__name__}")
-            
-            # Если не удалось добавить из-за настроек приватности, отправляем ссылку
-            chat_info = await admin_client.get_chat(target_chat.id)
+            join_outcomes_total.inc(outcome="privacy_restricted")
+            daily_stats.inc("privacy", chat_id)
             
             # Отправляем только инструкции по настройкам приватности
             await bot.send_message(
@@ -262,24 +361,8 @@ async def add_user_to_chat(user_id, chat_id):
             
             # Отправляем инструкции с картинками
             try:
-                # Отправляем изображения с инструкциями, если они доступны
-                await bot.send_photo(
-                    user_id,
-                    "screen/1.jpg",
-                    caption="1. Откройте настройки и выберите 'Конфиденциальность'"
-                )
-                
-                await bot.send_photo(
-                    user_id,
-                    "screen/2.jpg",
-                    caption="2. Выберите 'Группы и каналы'"
-                )
-                
-                await bot.send_photo(
-                    user_id,
-                    "screen/3.jpg",
-                    caption="3. Установите 'Кто может добавить меня в группы' на 'Все'"
-                )
+                # Отправляем изображения с инструкциями одним альбомом по сохраненным file_id
+                await instruction_media.send(user_id)
                 
                 await bot.send_message(
                     user_id,
@@ -290,42 +373,16 @@ async def add_user_to_chat(user_id, chat_id):
                 logger.error(f"Ошибка при отправке инструкций с изображениями: {photo_err}")
             
             # Обновляем статус заявки
-            session = get_session()
-            try:
-                join_request = session.query(JoinRequest).filter_by(user_id=user_id, chat_id=chat_id, status="pending").first()
-                if join_request:
-                    join_request.status = "link_sent"
-                    session.commit()
-            except Exception as db_err:
-                logger.error(f"Ошибка при обновлении статуса заявки: {db_err}")
-            finally:
-                session.close()
+            await set_request_status(user_id, chat_id, "link_sent")
             
-            # Отправляем уведомление администраторам о проблеме с приватностью
-            try:
-                user_info = await bot.get_users(user_id)
-                admin_text = (
-                    f"⚠️ Пользователь с ограничениями приватности:\n\n"
-                    f"👤 {user_info.first_name} {user_info.last_name or ''} (@{user_info.username or 'нет'})\n"
-                    f"📱 ID: {user_id}\n\n"
-                    f"❌ Невозможно добавить автоматически из-за настроек приватности\n"
-                    f"📋 Отправлены инструкции по изменению настроек\n"
-                    f"⏰ {datetime.now().strftime('%H:%M:%S %d.%m.%Y')}\n"
-                )
-                
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await bot.send_message(admin_id, admin_text)
-                    except Exception as admin_err:
-                        logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {admin_err}")
-            except Exception as notify_err:
-                logger.error(f"Ошибка при отправке уведомления администраторам: {notify_err}")
+            # Уведомление администраторам отправляет process_join_request
             
             # Возвращаем сообщение с явным указанием на проблему с приватностью
             return False, "UserPrivacyRestricted: Пользователь не может быть добавлен из-за настроек приватности"
             
         except UserAlreadyParticipant:
             logger.info(f"Пользователь {user_id} уже состоит в чате")
+            join_outcomes_total.inc(outcome="already_participant")
             
             await bot.send_message(
                 user_id,
@@ -333,43 +390,51 @@ async def add_user_to_chat(user_id, chat_id):
             )
             
             # Обновляем статус заявки
-            session = get_session()
-            try:
-                join_request = session.query(JoinRequest).filter_by(user_id=user_id, chat_id=chat_id, status="pending").first()
-                if join_request:
-                    join_request.status = "approved"
-                    session.commit()
-            except Exception as e:
-                logger.error(f"Ошибка при обновлении статуса заявки: {e}")
-            finally:
-                session.close()
+            await set_request_status(user_id, chat_id, "approved")
                 
             return True, "Пользователь уже состоит в чате"
             
         except PeerFlood:
             logger.error(f"Слишком много запросов на добавление, лимит превышен")
+            join_outcomes_total.inc(outcome="peer_flood")
+            daily_stats.inc("flood", chat_id, lease.account_id)
             
-            # Деактивируем текущий аккаунт администратора
-            session = get_session()
-            try:
-                if hasattr(admin_client, '_phone'):
-                    admin_account = session.query(AdminAccount).filter_by(phone=admin_client._phone).first()
-                    if admin_account:
-                        admin_account.active = False
-                        session.commit()
-                        logger.warning(f"Аккаунт {admin_account.phone} деактивирован из-за лимита добавлений")
-                else:
-                    logger.warning("Не удалось определить телефон аккаунта для деактивации")
-            except Exception as e:
-                logger.error(f"Ошибка при деактивации аккаунта: {e}")
-            finally:
-                session.close()
-                
+            # Ставим аккаунт на паузу (сохраняется в БД и переживает перезапуск)
+            lease.throttle(PEER_FLOOD_COOLDOWN)
+            return False, "Достигнут лимит добавлений. Попробуйте позже."
+            
+        except FloodWait as flood_wait:
+            logger.warning(f"FloodWait для аккаунта {lease.phone}: {flood_wait.value} с.")
+            join_outcomes_total.inc(outcome="flood_wait")
+            daily_stats.inc("flood", chat_id, lease.account_id)
+            
+            # Аккаунт не используется, пока не истечет указанное сервером время
+            lease.throttle(flood_wait.value)
             return False, "Достигнут лимит добавлений. Попробуйте позже."
             
+        except PEER_ERRORS as peer_error:
+            # Ошибка add_chat_members: пир чата устарел (чат удалён, аккаунт исключён и т.п.) - сбрасываем кэш
+            logger.error(f"Ошибка пира при добавлении в чат {chat_id}: {type(peer_error).__name__}")
+            join_outcomes_total.inc(outcome="peer_invalid")
+            chat_resolver.invalidate(lease.account_id, chat_id)
+            chat_registry.set_access(lease.account_id, chat_id, False)
+            return False, "Не удалось найти чат для добавления"
+            
+        except ChatAdminRequired:
+            # У аккаунта нет права приглашать в чат - до следующего пересчета матрицы он не используется для этого чата
+            logger.error(f"Аккаунт {lease.phone} не может добавлять участников в чат {chat_id}")
+            join_outcomes_total.inc(outcome="no_access")
+            chat_registry.set_access(lease.account_id, chat_id, False)
+            return False, "Нет доступного администратора для добавления в чат"
+            
         except Exception as e:
             # Логируем все другие возможные ошибки для диагностики
             logger.error(f"Необработанная ошибка при добавлении пользователя: {type(e).__name__}: {str(e)}")
+            join_outcomes_total.inc(outcome="error")
+            
+            # Сетевые ошибки и ошибки авторизации - клиент будет перезапущен пулом
+            if isinstance(e, ACCOUNT_ERRORS):
+                lease.failed = True
             
             # Проверяем, содержит ли сообщение об ошибке строку о приватности
             error_str = str(e).lower()
@@ -381,76 +446,121 @@ async def add_user_to_chat(user_id, chat_id):
         
     except Exception as e:
         logger.error(f"Основная ошибка при добавлении пользователя: {type(e).__name__}: {str(e)}")
+        join_outcomes_total.inc(outcome="error")
+        if isinstance(e, ACCOUNT_ERRORS):
+            lease.failed = True
         return False, f"Ошибка при добавлении пользователя: {str(e)}"
 
+def chat_selection_keyboard():
+    """
+    Клавиатура выбора чата: кнопка на каждый активный целевой чат и поддержка
+    """
+    return types.InlineKeyboardMarkup([
+        [types.InlineKeyboardButton(chat.title, callback_data=f"select_chat_{chat.id}")] for chat in chat_registry.chats
+    ] + [
+        [types.InlineKeyboardButton("📞 Поддержка", callback_data="support")]
+    ])
+
 @bot.on_message(filters.command("start") & filters.private)
+@timed(handler_seconds, handler="start_command")
+@correlated
 async def start_command(client, message):
     """
     Обработка команды /start
     """
     user_id = message.from_user.id
-    session = get_session()
     
     try:
-        # Проверяем, зарегистрирован ли пользователь
-        user = session.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            new_user = User(
-                user_id=user_id,
-                username=message.from_user.username,
-                first_name=message.from_user.first_name,
-                last_name=message.from_user.last_name
-            )
-            session.add(new_user)
-            session.commit()
+        # Регистрация или обновление профиля записывается в БД в фоне пачкой (INSERT ... ON CONFLICT)
+        user_writer.submit(message.from_user)
+        if user_index.ready and not user_index.is_known(user_id):
+            daily_stats.inc("registrations")
+        user_index.add_user(user_id)
         
         # Формируем приветственное сообщение
         welcome_text = f"👋 Привет, {message.from_user.first_name}!\n\n"
         welcome_text += "Я бот для добавления в закрытые чаты. Выберите чат, в который хотите вступить:"
         
         # Создаем клавиатуру для выбора чатов
-        keyboard = types.InlineKeyboardMarkup([
-            [types.InlineKeyboardButton("Чат #1", callback_data="select_chat_1")],
-            [types.InlineKeyboardButton("Чат #2", callback_data="select_chat_2")],
-            [types.InlineKeyboardButton("📞 Поддержка", callback_data="support")]
-        ])
+        keyboard = chat_selection_keyboard()
         
         await message.reply(welcome_text, reply_markup=keyboard)
     except Exception as e:
         logger.error(f"Ошибка в команде start: {e}")
         await message.reply("Произошла ошибка. Пожалуйста, попробуйте позже.")
-    finally:
-        session.close()
+
+def _find_pending_request(session, user_id, chat_id):
+    return session.query(JoinRequest.id).filter_by(user_id=user_id, chat_id=chat_id, status="pending").scalar()
 
 @bot.on_callback_query(filters.regex(r"^select_chat_(\d+)$"))
+@timed(handler_seconds, handler="select_chat_callback")
+@correlated
 async def select_chat_callback(client, callback_query):
     """
     Обработка выбора чата
     """
     user_id = callback_query.from_user.id
-    chat_num = callback_query.data.split("_")[-1]
-    chat_id = CHAT_ID_1 if chat_num == "1" else CHAT_ID_2
+    chat = chat_registry.get(int(callback_query.data.split("_")[-1]))
     
-    if chat_id == 0:
+    if chat is None:
         await callback_query.answer("Этот чат временно недоступен")
         return
+    chat_id = chat.chat_id
     
-    session = get_session()
-    try:
-        # Проверяем, не в черном ли списке пользователь
-        user = session.query(User).filter_by(user_id=user_id).first()
-        if user and user.is_blacklisted:
-            await callback_query.answer("Вы не можете быть добавлены в чат")
-            return
+    message_id = callback_query.message.id
+    
+    # Повторное нажатие, пока заявка в работе, присоединяется к ней
+    if join_queue.attach(user_id, chat_id, message_id):
+        await callback_query.answer("⏳ Ваша заявка уже обрабатывается")
+        return
+    
+    wait = join_queue.cooldown_left(user_id)
+    if wait:
+        await callback_query.answer(f"Слишком частые попытки. Повторите через {math.ceil(wait)} сек.")
+        return
+    
+    if user_index.is_blacklisted(user_id):
+        await callback_query.answer("Вы не можете быть добавлены в чат")
+        return
+    
+    def create_request(session):
+        # Пока индекс не загружен, проверяем черный список в БД
+        if not user_index.ready:
+            user = session.query(User).filter_by(user_id=user_id).first()
+            if user and user.is_blacklisted:
+                return None, False
+        
+        # Используем уже существующую ожидающую заявку, если она есть
+        existing_id = _find_pending_request(session, user_id, chat_id)
+        if existing_id:
+            return existing_id, False
         
         # Создаем заявку на добавление
         join_request = JoinRequest(
             user_id=user_id,
             chat_id=chat_id,
-            status="pending"
+            status="pending",
+            message_id=message_id
         )
         session.add(join_request)
-        session.commit()
+        try:
+            session.commit()
+        except IntegrityError:
+            # Параллельное нажатие уже создало заявку (уникальный индекс uq_join_requests_pending)
+            session.rollback()
+            return _find_pending_request(session, user_id, chat_id), False
+        return join_request.id, True
+    
+    try:
+        request_id, created = await run_in_session(create_request)
+        if request_id is None:
+            await callback_query.answer("Вы не можете быть добавлены в чат")
+            return
+        if created:
+            daily_stats.inc("requests", chat_id)
+        
+        # Дальнейшие записи по этой заявке (и в обработчике очереди) связаны одним идентификатором
+        set_correlation_id(f"req{request_id}")
         
         # Сообщаем пользователю, что его заявка обрабатывается
         await callback_query.edit_message_text(
@@ -458,35 +568,130 @@ async def select_chat_callback(client, callback_query):
             "Пожалуйста, подождите несколько секунд."
         )
         
-        # Добавляем пользователя
-        success, message = await add_user_to_chat(user_id, chat_id)
-        logger.info(f"Результат add_user_to_chat: success={success}, message={message}")
+        if lease_claimer:
+            # Заявку захватит процесс, аккаунты которого могут добавлять в этот чат
+            join_queue.record_attempt(user_id)
+            lease_claimer.wake()
+            return
         
-        if success:
+        # Ставим заявку в очередь - добавление выполнят обработчики очереди
+        job = JoinJob(request_id, user_id, chat_id, message_id=message_id)
+        if not join_queue.submit(job):
+            logger.warning(f"Очередь остановлена, заявка {request_id} будет обработана после перезапуска")
+    except Exception as e:
+        logger.error(f"Ошибка при выборе чата: {e}")
+        await callback_query.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+async def send_join_result(job, text, keyboard=None):
+    """
+    Обновляет сообщения заявки результатом или отправляет новое сообщение
+    """
+    edited = False
+    for message_id in job.message_ids:
+        try:
+            await bot.edit_message_text(job.user_id, message_id, text, reply_markup=keyboard)
+            edited = True
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение заявки {job.request_id}: {e}")
+    if not edited:
+        await bot.send_message(job.user_id, text, reply_markup=keyboard)
+
+def _finish_join_request(session, request_id, user_id, chat_id, status):
+    join_request = session.query(JoinRequest).filter_by(id=request_id).first()
+    if join_request:
+        join_request.status = status
+    if status == "approved":
+        user = session.query(User).filter_by(user_id=user_id).first()
+        if user:
+            user.chat_joined = chat_id
+    session.commit()
+
+async def finish_join_request(job, status):
+    """
+    Записывает итоговый статус заявки и учитывает его в дневных счетчиках
+    """
+    await run_in_session(_finish_join_request, job.request_id, job.user_id, job.chat_id, status)
+    daily_stats.inc(status, job.chat_id)
+
+async def defer_join_request(job, message):
+    """
+    Заявка с неподтвержденным добавлением остается pending и через JOIN_RECHECK_DELAY секунд
+    снова ставится в очередь (повторное добавление уже состоящего в чате пользователя безопасно).
+    После JOIN_RECHECK_ATTEMPTS повторов заявка завершается.
+    """
+    chat_name = chat_registry.title(job.chat_id)
+    if job.rechecks < JOIN_RECHECK_ATTEMPTS:
+        job.rechecks += 1
+        join_queue.defer(job, JOIN_RECHECK_DELAY)
+        logger.info(f"Заявка {job.request_id} будет проверена повторно через {JOIN_RECHECK_DELAY} с. (попытка {job.rechecks}/{JOIN_RECHECK_ATTEMPTS})")
+        if job.rechecks == 1:
+            await send_join_result(
+                job,
+                f"⏳ Приглашение в чат «{chat_name}» отправлено, но Telegram пока не подтвердил добавление.\n\n"
+                f"Мы проверим еще раз автоматически. Если чат уже появился в вашем приложении Telegram, все в порядке."
+            )
+        return
+    
+    # Проверки исчерпаны: add_chat_members каждый раз проходил без ошибок, поэтому заявка завершается
+    # как approved с оговоркой (иначе в режиме аренды она захватывалась бы снова бесконечно),
+    # администраторы проверяют участника вручную
+    logger.warning(f"Добавление по заявке {job.request_id} так и не подтверждено, заявка завершена без проверки")
+    await finish_join_request(job, "approved")
+    keyboard = types.InlineKeyboardMarkup([
+        [types.InlineKeyboardButton("↩️ Вернуться в меню", callback_data="back_to_menu")],
+        [types.InlineKeyboardButton("📞 Поддержка", callback_data="support")]
+    ])
+    await send_join_result(
+        job,
+        f"✅ Приглашение в чат «{chat_name}» отправлено, но Telegram так и не подтвердил добавление.\n\n"
+        f"Если чата нет в вашем приложении Telegram, обратитесь в поддержку.",
+        keyboard
+    )
+    admin_text = f"⚠️ Не удалось подтвердить добавление пользователя:\n\n"
+    admin_text += f"ID: {job.user_id}\n"
+    admin_text += f"Чат: {chat_name}\n"
+    admin_text += f"Причина: {message}\n"
+    admin_text += f"Заявка завершена как approved без подтверждения, проверьте участника вручную\n"
+    admin_text += f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+    admin_notifier.notify(admin_text, key=f"unconfirmed:{job.request_id}")
+
+@timed(handler_seconds, handler="process_join_request")
+async def process_join_request(job):
+    """
+    Обработка заявки из очереди: добавление пользователя и уведомление о результате
+    """
+    user_id = job.user_id
+    chat_id = job.chat_id
+    set_correlation_id(f"req{job.request_id}")
+    
+    # Добавляем пользователя
+    success, message = await add_user_to_chat(user_id, chat_id)
+    logger.info(f"Результат add_user_to_chat: success={success}, message={message}")
+    
+    try:
+        if success is None:
+            # Добавление не подтверждено - заявка остается в ожидании и будет проверена повторно
+            await defer_join_request(job, message)
+        elif success:
             # Если пользователь успешно добавлен, не нужно повторно отправлять сообщение
             # так как оно уже отправлено в функции add_user_to_chat
             # Только отмечаем в БД, что пользователь добавлен
-            join_request.status = "approved"
-            user.chat_joined = chat_id
-            session.commit()
-            
-            return True, "Пользователь успешно добавлен в чат"
+            await finish_join_request(job, "approved")
         else:
             # Если не получилось добавить, проверяем тип ошибки
             logger.info(f"Не удалось добавить пользователя. Сообщение: {message}")
             
             # Дополнительное логирование для диагностики
-            logger.info(f"Проверка на ошибку приватности. Результаты проверок:")
-            logger.info(f"- 'приватности' in message.lower(): {('приватности' in message.lower())}")
-            logger.info(f"- 'privacy' in message.lower(): {('privacy' in message.lower())}")
-            logger.info(f"- 'UserPrivacyRestricted' in message: {('UserPrivacyRestricted' in message)}")
-            logger.info(f"- message.startswith('UserPrivacyRestricted:'): {message.startswith('UserPrivacyRestricted:')}")
+            logger.debug(f"Проверка на ошибку приватности. Результаты проверок:")
+            logger.debug(f"- 'приватности' in message.lower(): {('приватности' in message.lower())}")
+            logger.debug(f"- 'privacy' in message.lower(): {('privacy' in message.lower())}")
+            logger.debug(f"- 'UserPrivacyRestricted' in message: {('UserPrivacyRestricted' in message)}")
+            logger.debug(f"- message.startswith('UserPrivacyRestricted:'): {message.startswith('UserPrivacyRestricted:')}")
             
             # Проверяем сообщение об ошибке на наличие ключевых слов о приватности
             if "приватности" in message.lower() or "privacy" in message.lower() or "UserPrivacyRestricted" in message or message.startswith("UserPrivacyRestricted:"):
                 # В случае настроек приватности, отправляем инструкции и ссылку напрямую
-                join_request.status = "link_sent"
-                session.commit()
+                await finish_join_request(job, "link_sent")
                 
                 logger.info(f"Отправляю пользователю инструкции по настройкам приватности")
                 
@@ -494,15 +699,16 @@ async def select_chat_callback(client, callback_query):
                 keyboard = types.InlineKeyboardMarkup([
                     [types.InlineKeyboardButton("↩️ Вернуться в меню", callback_data="back_to_menu")]
                 ])
-                await callback_query.edit_message_text(
+                await send_join_result(
+                    job,
                     "🔒 Из-за ваших настроек приватности мы не смогли добавить вас автоматически.\n\n"
                     "✉️ Мы отправили вам инструкции по изменению настроек приватности в личном сообщении.\n\n"
                     "👆 Проверьте сообщения от бота и следуйте инструкциям.",
-                    reply_markup=keyboard
+                    keyboard
                 )
                 
                 # Отправляем администраторам информацию о пользователе
-                user_info = await client.get_users(user_id)
+                user_info = await bot.get_users(user_id)
                 admin_text = (
                     f"⚠️ Новая заявка (требуется изменение приватности):\n\n"
                     f"📋 Информация о пользователе:\n"
@@ -514,22 +720,17 @@ async def select_chat_callback(client, callback_query):
                     f"📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
                 )
                 
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await client.send_message(admin_id, admin_text)
-                    except Exception as e:
-                        logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+                admin_notifier.notify(admin_text, key=f"privacy:{user_id}:{chat_id}")
             else:
                 # Для других ошибок обновляем статус и показываем сообщение об ошибке
-                join_request.status = "rejected"
-                session.commit()
+                await finish_join_request(job, "rejected")
                 
                 error_text = f"❌ Не удалось добавить вас в чат: {message}\n\nПопробуйте позже или обратитесь в поддержку."
                 keyboard = types.InlineKeyboardMarkup([
                     [types.InlineKeyboardButton("↩️ Вернуться в меню", callback_data="back_to_menu")],
                     [types.InlineKeyboardButton("📞 Поддержка", callback_data="support")]
                 ])
-                await callback_query.edit_message_text(error_text, reply_markup=keyboard)
+                await send_join_result(job, error_text, keyboard)
                 
                 # Уведомляем администраторов об ошибке
                 admin_error_text = f"❌ Ошибка при добавлении пользователя:\n\n"
@@ -537,31 +738,58 @@ async def select_chat_callback(client, callback_query):
                 admin_error_text += f"Ошибка: {message}\n"
                 admin_error_text += f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
                 
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await client.send_message(admin_id, admin_error_text)
-                    except Exception as e:
-                        logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+                admin_notifier.notify(admin_error_text, key=f"error:{job.request_id}")
     except Exception as e:
-        logger.error(f"Ошибка при выборе чата: {e}")
-        await callback_query.answer("Произошла ошибка. Пожалуйста, попробуйте позже.")
-    finally:
-        session.close()
+        logger.error(f"Ошибка при обработке заявки {job.request_id}: {e}")
+
+# Очередь заявок на добавление
+join_queue = JoinQueue(
+    process_join_request,
+    workers=JOIN_WORKERS,
+    drain_timeout=JOIN_DRAIN_TIMEOUT,
+    cooldown=JOIN_COOLDOWN
+)
+
+def served_chat_ids():
+    """
+    Целевые чаты, в которые может добавлять хотя бы один аккаунт этого процесса (еще не проверенные считаются подходящими)
+    """
+    account_ids = [account_id for account_id, _ in admin_pool.clients()]
+    return [
+        chat_id for chat_id in chat_registry.chat_ids
+        if any(chat_registry.can_add(account_id, chat_id) is not False for account_id in account_ids)
+    ]
+
+# При нескольких процессах заявки попадают в очередь только через аренду в БД
+lease_claimer = JoinLeaseClaimer(
+    join_queue,
+    default_owner(WORKER_INDEX),
+    served_chat_ids,
+    lease_seconds=JOIN_LEASE_SECONDS,
+    poll_interval=JOIN_POLL_INTERVAL,
+    orphan_after=JOIN_ORPHAN_AFTER,
+    heartbeat_interval=JOIN_HEARTBEAT_INTERVAL
+) if WORKER_COUNT > 1 else None
+
+metrics.gauge("join_queue_depth", "Заявок в очереди", lambda: join_queue.depth)
+metrics.gauge("admin_pool_size", "Запущенных клиентов администраторов", lambda: admin_pool.size)
+metrics.gauge("admin_pool_healthy", "Исправных клиентов администраторов", lambda: admin_pool.healthy_size)
+metrics.gauge("user_writer_pending", "Пользователей, ожидающих записи в БД", lambda: user_writer.depth)
 
 @bot.on_callback_query(filters.regex(r"^back_to_menu$"))
+@timed(handler_seconds, handler="back_to_menu_callback")
+@correlated
 async def back_to_menu_callback(client, callback_query):
     """
     Возврат в главное меню
     """
     welcome_text = f"👋 Выберите чат, в который хотите вступить:"
-    keyboard = types.InlineKeyboardMarkup([
-        [types.InlineKeyboardButton("Чат #1", callback_data="select_chat_1")],
-        [types.InlineKeyboardButton("Чат #2", callback_data="select_chat_2")],
-        [types.InlineKeyboardButton("📞 Поддержка", callback_data="support")]
-    ])
+    keyboard = chat_selection_keyboard()
     await callback_query.edit_message_text(welcome_text, reply_markup=keyboard)
 
 @bot.on_callback_query(filters.regex(r"^support$"))
+@timed(handler_seconds, handler="support_callback")
+@correlated
 async def support_callback(client, callback_query):
     """
     Обработка запроса в поддержку
@@ -574,6 +802,8 @@ async def support_callback(client, callback_query):
 
 # Команды администратора
 @bot.on_message(filters.command("admin") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="admin_command")
+@correlated
 async def admin_command(client, message):
     """
     Панель администратора
@@ -588,73 +818,306 @@ async def admin_command(client, message):
         [types.InlineKeyboardButton("🔒 Заблокировать пользователя", callback_data="admin_block")],
         [types.InlineKeyboardButton("🔓 Разблокировать пользователя", callback_data="admin_unblock")],
         [types.InlineKeyboardButton("➕ Добавить админ-аккаунт", callback_data="admin_add_account")],
-        [types.InlineKeyboardButton("➖ Удалить админ-аккаунт", callback_data="admin_remove_account")]
+        [types.InlineKeyboardButton("➖ Удалить админ-аккаунт", callback_data="admin_remove_account")],
+        [types.InlineKeyboardButton("💬 Целевые чаты", callback_data="admin_chats")]
     ])
     
     await message.reply(admin_text, reply_markup=keyboard)
 
-@bot.on_callback_query(filters.regex(r"^admin_users$"))
+@bot.on_message(filters.command("accounts") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="accounts_command")
+@correlated
+async def accounts_command(client, message):
+    """
+    Состояние клиентов администраторов по фоновым проверкам
+    """
+    status = admin_pool.status()
+    if not status:
+        await message.reply("Нет запущенных клиентов администраторов.")
+        return
+    
+    accounts_text = "👤 Аккаунты администраторов:\n\n"
+    for account_id, phone, healthy, leases, cooldown_until in status:
+        health = admin_health.health.get(account_id)
+        accounts_text += f"{phone}: {'✅ исправен' if healthy else '⚠️ не получает заявок'}\n"
+        if health and health.last_success:
+            accounts_text += f"Последняя успешная проверка: {health.last_success.strftime('%d.%m.%Y %H:%M:%S')}, {health.latency * 1000:.0f} мс\n"
+        if health and health.error:
+            accounts_text += f"Ошибка: {health.error} ({health.error_class}), неудач подряд: {health.failures}\n"
+        if cooldown_until and cooldown_until > datetime.now():
+            accounts_text += f"Пауза до: {cooldown_until.strftime('%d.%m.%Y %H:%M:%S')}\n"
+        accounts_text += f"Заявок в работе: {leases}\n\n"
+    
+    await message.reply(accounts_text)
+
+@bot.on_message(filters.command("archive") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="archive_command")
+@correlated
+async def archive_command(client, message):
+    """
+    Немедленный перенос старых завершенных заявок в архив с отчетом
+    """
+    if ARCHIVE_AFTER_DAYS <= 0:
+        await message.reply("Архивация отключена (ARCHIVE_AFTER_DAYS=0).")
+        return
+    
+    try:
+        report = await archiver.run_once()
+        await message.reply(
+            f"🗄 Архивация заявок старше {ARCHIVE_AFTER_DAYS} дн.:\n\n"
+            f"Перенесено заявок: {report.moved}\n"
+            f"Освобождено в join_requests: ~{report.raw_bytes / 1024:.0f} КБ\n"
+            f"Записано в архив (сжато): {report.written_bytes / 1024:.0f} КБ\n"
+            f"Осталось заявок в таблице: {report.remaining}\n"
+            f"Время: {report.seconds:.1f} с"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при архивации заявок: {e}")
+        await message.reply("Произошла ошибка при архивации заявок.")
+
+@bot.on_message(filters.command("archive_search") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="archive_search_command")
+@correlated
+async def archive_search_command(client, message):
+    """
+    Поиск заявок пользователя в архиве: /archive_search USER_ID [CHAT_ID]
+    """
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit() or (len(args) > 2 and not re.fullmatch(r"-?\d+", args[2])):
+        await message.reply("Используйте формат: /archive_search USER_ID [CHAT_ID]")
+        return
+    
+    try:
+        records = await archiver.search(user_id=int(args[1]), chat_id=int(args[2]) if len(args) > 2 else None, limit=20)
+        if not records:
+            await message.reply("В архиве заявок не найдено.")
+            return
+        
+        archive_text = f"🗄 Заявки пользователя {args[1]} в архиве:\n\n"
+        for record in records:
+            created_at = record["created_at"].strftime("%d.%m.%Y %H:%M") if record["created_at"] else "нет даты"
+            archive_text += f"{created_at} · {chat_registry.title(record['chat_id'])} · {record['status']}\n"
+        await message.reply(archive_text)
+    except Exception as e:
+        logger.error(f"Ошибка при поиске в архиве: {e}")
+        await message.reply("Произошла ошибка при поиске в архиве.")
+
+# Подписи дневных счетчиков в /summary
+SUMMARY_METRICS = [
+    ("registrations", "Регистрации"),
+    ("requests", "Заявки"),
+    ("approved", "✅ Добавлены"),
+    ("link_sent", "🔒 Отправлены инструкции"),
+    ("rejected", "❌ Отклонены"),
+    ("privacy", "Ошибки приватности"),
+    ("flood", "FloodWait/PeerFlood"),
+]
+
+def _account_phones(session):
+    return dict(session.query(AdminAccount.id, AdminAccount.phone).all())
+
+@bot.on_message(filters.command("summary") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="summary_command")
+@correlated
+async def summary_command(client, message):
+    """
+    Сводка по дневным счетчикам за сегодня и 7 дней: читаются только строки daily_stats за эти дни
+    """
+    try:
+        totals = await daily_stats.totals(days=7)
+        phones = await run_in_session(_account_phones)
+    except Exception as e:
+        logger.error(f"Ошибка при получении сводки: {e}")
+        await message.reply("Произошла ошибка при получении сводки.")
+        return
+    
+    today = datetime.now().date()
+    by_metric = {}
+    for (day, metric, chat_id, account_id), value in totals.items():
+        period = by_metric.setdefault(metric, {"today": 0, "week": 0, "chats": {}, "accounts": {}})
+        period["week"] += value
+        if day == today:
+            period["today"] += value
+        if chat_id:
+            period["chats"][chat_id] = period["chats"].get(chat_id, 0) + value
+        if account_id:
+            period["accounts"][account_id] = period["accounts"].get(account_id, 0) + value
+    
+    empty = {"today": 0, "week": 0, "chats": {}, "accounts": {}}
+    summary_text = "📈 Сводка (сегодня / 7 дней):\n\n"
+    for metric, label in SUMMARY_METRICS:
+        period = by_metric.get(metric, empty)
+        summary_text += f"{label}: {period['today']} / {period['week']}\n"
+    
+    chat_ids = sorted({chat_id for period in by_metric.values() for chat_id in period["chats"]}, key=chat_registry.number)
+    if chat_ids:
+        summary_text += "\nПо чатам за 7 дней (заявки / добавлены / инструкции / отклонены):\n"
+        for chat_id in chat_ids:
+            counts = [by_metric.get(metric, empty)["chats"].get(chat_id, 0) for metric in ("requests", "approved", "link_sent", "rejected")]
+            summary_text += f"{chat_registry.title(chat_id)}: {' / '.join(map(str, counts))}\n"
+    
+    adds = by_metric.get("account_adds", empty)["accounts"]
+    floods = by_metric.get("flood", empty)["accounts"]
+    if adds or floods:
+        summary_text += "\nПо аккаунтам за 7 дней (добавлено / FloodWait+PeerFlood):\n"
+        for account_id in sorted(set(adds) | set(floods), key=lambda account_id: -adds.get(account_id, 0)):
+            summary_text += f"{phones.get(account_id, f'#{account_id}')}: {adds.get(account_id, 0)} / {floods.get(account_id, 0)}\n"
+    
+    await message.reply(summary_text)
+
+@bot.on_message(filters.command("stats") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="stats_command")
+@correlated
+async def stats_command(client, message):
+    """
+    Метрики этапов добавления и обработчиков
+    """
+    stats_text = "📊 Статистика с момента запуска:\n\n" + (metrics.summary() or "Данных пока нет.")
+    # Сообщение Telegram ограничено 4096 символами
+    for start in range(0, len(stats_text), 4096):
+        await message.reply(stats_text[start:start + 4096])
+
+# Размер страницы в списках панели администратора
+ADMIN_PAGE_SIZE = 20
+
+# Фильтры списков: значение в callback_data -> подпись кнопки
+REQUEST_STATUS_FILTERS = {"-": "все", "pending": "⏳ pending", "approved": "✅ approved", "rejected": "❌ rejected", "link_sent": "🔒 link_sent"}
+USER_STATUS_FILTERS = {"-": "все", "active": "✅ активные", "blocked": "🚫 заблокированные"}
+
+def _next_filter(filters_map, current):
+    keys = list(filters_map)
+    return keys[(keys.index(current) + 1) % len(keys)] if current in keys else keys[0]
+
+def _keyset_page(session, query, model, sort_column, direction, cursor):
+    """
+    Страница по ключу (sort_column, id) от записи cursor: direction "n" - старее, "p" - новее.
+    Возвращает (строки от новых к старым, есть ли новее, есть ли старее).
+    """
+    key = tuple_(sort_column, model.id)
+    anchor = session.query(sort_column, model.id).filter(model.id == cursor).first() if cursor else None
+    
+    if anchor and direction == "p":
+        rows = query.filter(key > tuple_(*anchor)).order_by(sort_column.asc(), model.id.asc()).limit(ADMIN_PAGE_SIZE + 1).all()
+        has_newer = len(rows) > ADMIN_PAGE_SIZE
+        return rows[:ADMIN_PAGE_SIZE][::-1], has_newer, True
+    
+    if anchor:
+        query = query.filter(key < tuple_(*anchor))
+    rows = query.order_by(sort_column.desc(), model.id.desc()).limit(ADMIN_PAGE_SIZE + 1).all()
+    return rows[:ADMIN_PAGE_SIZE], anchor is not None, len(rows) > ADMIN_PAGE_SIZE
+
+def _load_users_page(session, direction, cursor, status):
+    query = session.query(User)
+    if status == "blocked":
+        query = query.filter(User.is_blacklisted.is_(True))
+    elif status == "active":
+        query = query.filter(User.is_blacklisted.isnot(True))
+    return _keyset_page(session, query, User, User.registration_date, direction, cursor)
+
+def _load_requests_page(session, direction, cursor, status, chat_id):
+    # Один запрос с присоединением пользователя вместо запроса на каждую заявку
+    query = session.query(
+        JoinRequest.id,
+        JoinRequest.user_id,
+        JoinRequest.chat_id,
+        JoinRequest.status,
+        JoinRequest.created_at,
+        User.id.label("user_pk"),
+        User.username,
+        User.first_name,
+        User.last_name
+    ).outerjoin(User, User.user_id == JoinRequest.user_id)
+    if status != "-":
+        query = query.filter(JoinRequest.status == status)
+    if chat_id:
+        query = query.filter(JoinRequest.chat_id == chat_id)
+    return _keyset_page(session, query, JoinRequest, JoinRequest.created_at, direction, cursor)
+
+def _parse_page_data(data, defaults):
+    """
+    Разбирает callback_data вида "<раздел>:<направление>:<курсор>:<фильтры...>"
+    """
+    parts = data.split(":")[1:]
+    direction = parts[0] if parts else "n"
+    cursor = int(parts[1]) if len(parts) > 1 else 0
+    filters_values = parts[2:] + list(defaults[len(parts[2:]):])
+    return direction, cursor, filters_values
+
+def _page_navigation(prefix, rows, has_newer, has_older, suffix):
+    buttons = []
+    if rows and has_newer:
+        buttons.append(types.InlineKeyboardButton("⬅️ Новее", callback_data=f"{prefix}:p:{rows[0].id}:{suffix}"))
+    if rows and has_older:
+        buttons.append(types.InlineKeyboardButton("Старее ➡️", callback_data=f"{prefix}:n:{rows[-1].id}:{suffix}"))
+    return buttons
+
+@bot.on_callback_query(filters.regex(r"^admin_users(:.*)?$"))
+@timed(handler_seconds, handler="admin_users_callback")
+@correlated
 async def admin_users_callback(client, callback_query):
     """
-    Список пользователей через клавиатуру
+    Список пользователей через клавиатуру (постранично, с фильтром по статусу)
     """
-    session = get_session()
     try:
-        users = session.query(User).order_by(User.registration_date.desc()).limit(20).all()
+        direction, cursor, (status,) = _parse_page_data(callback_query.data, ["-"])
+        users, has_newer, has_older = await run_in_session(_load_users_page, direction, cursor, status)
         
         if not users:
-            await callback_query.edit_message_text("Список пользователей пуст.")
-            return
-        
-        users_text = "👥 Список последних пользователей:\n\n"
+            users_text = "Список пользователей пуст." if status == "-" else "Пользователи не найдены."
+        else:
+            users_text = "👥 Список пользователей:\n\n"
         for user in users:
             username = f"@{user.username}" if user.username else "нет"
-            status = "🚫 Заблокирован" if user.is_blacklisted else "✅ Активен"
-            chat = f"Чат #{1 if user.chat_joined == CHAT_ID_1 else 2}" if user.chat_joined else "Не в чате"
+            user_status = "🚫 Заблокирован" if user.is_blacklisted else "✅ Активен"
+            chat = chat_registry.title(user.chat_joined) if user.chat_joined else "Не в чате"
             
             users_text += f"ID: {user.user_id}\n"
             users_text += f"Имя: {user.first_name} {user.last_name or ''}\n"
             users_text += f"Username: {username}\n"
-            users_text += f"Статус: {status}\n"
+            users_text += f"Статус: {user_status}\n"
             users_text += f"Чат: {chat}\n"
             users_text += f"Регистрация: {user.registration_date.strftime('%d.%m.%Y %H:%M')}\n\n"
         
-        # Добавляем кнопку назад
+        # Навигация, фильтр и кнопка назад
         keyboard = types.InlineKeyboardMarkup([
-            [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
+            row for row in [
+                _page_navigation("admin_users", users, has_newer, has_older, status),
+                [types.InlineKeyboardButton(
+                    f"Статус: {USER_STATUS_FILTERS.get(status, 'все')}",
+                    callback_data=f"admin_users:n:0:{_next_filter(USER_STATUS_FILTERS, status)}"
+                )],
+                [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
+            ] if row
         ])
         
         await callback_query.edit_message_text(users_text, reply_markup=keyboard)
     except Exception as e:
         logger.error(f"Ошибка при получении списка пользователей: {e}")
         await callback_query.edit_message_text("Произошла ошибка при получении списка пользователей.")
-    finally:
-        session.close()
 
-@bot.on_callback_query(filters.regex(r"^admin_requests$"))
+@bot.on_callback_query(filters.regex(r"^admin_requests(:.*)?$"))
+@timed(handler_seconds, handler="admin_requests_callback")
+@correlated
 async def admin_requests_callback(client, callback_query):
     """
-    Список заявок через клавиатуру
+    Список заявок через клавиатуру (постранично, с фильтрами по статусу и чату)
     """
-    session = get_session()
     try:
-        requests = session.query(JoinRequest).order_by(JoinRequest.created_at.desc()).limit(20).all()
+        direction, cursor, (status, chat_num) = _parse_page_data(callback_query.data, ["-", "0"])
+        chat = chat_registry.get(int(chat_num))
+        chat_id = chat.chat_id if chat else 0
+        requests, has_newer, has_older = await run_in_session(_load_requests_page, direction, cursor, status, chat_id)
         
         if not requests:
-            keyboard = types.InlineKeyboardMarkup([
-                [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
-            ])
-            await callback_query.edit_message_text("Список заявок пуст.", reply_markup=keyboard)
-            return
-        
-        requests_text = "📝 Список последних заявок:\n\n"
+            requests_text = "Список заявок пуст." if status == "-" and not chat_id else "Заявки не найдены."
+        else:
+            requests_text = "📝 Список заявок:\n\n"
         
         for req in requests:
-            user = session.query(User).filter_by(user_id=req.user_id).first()
-            username = f"@{user.username}" if user and user.username else "нет"
-            name = f"{user.first_name} {user.last_name or ''}" if user else "Неизвестный пользователь"
+            username = f"@{req.username}" if req.username else "нет"
+            name = f"{req.first_name} {req.last_name or ''}" if req.user_pk else "Неизвестный пользователь"
             
-            chat_name = "Чат #1" if req.chat_id == CHAT_ID_1 else "Чат #2"
+            chat_name = chat_registry.title(req.chat_id)
             status_emoji = "✅" if req.status == "approved" else "❌" if req.status == "rejected" else "⏳"
             
             requests_text += f"ID: {req.user_id}\n"
@@ -664,58 +1127,85 @@ async def admin_requests_callback(client, callback_query):
             requests_text += f"Статус: {status_emoji} {req.status}\n"
             requests_text += f"Дата: {req.created_at.strftime('%d.%m.%Y %H:%M')}\n\n"
         
-        # Добавляем кнопку назад
+        # Навигация, фильтры и кнопка назад; фильтр по чату перебирает "все" и активные чаты
+        suffix = f"{status}:{chat_num}"
+        chat_filters = ["0"] + [str(chat.id) for chat in chat_registry.chats]
+        next_chat_num = chat_filters[(chat_filters.index(chat_num) + 1) % len(chat_filters)] if chat_num in chat_filters else "0"
         keyboard = types.InlineKeyboardMarkup([
-            [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
+            row for row in [
+                _page_navigation("admin_requests", requests, has_newer, has_older, suffix),
+                [
+                    types.InlineKeyboardButton(
+                        f"Статус: {REQUEST_STATUS_FILTERS.get(status, 'все')}",
+                        callback_data=f"admin_requests:n:0:{_next_filter(REQUEST_STATUS_FILTERS, status)}:{chat_num}"
+                    ),
+                    types.InlineKeyboardButton(
+                        f"Чат: {chat.title if chat else 'все'}",
+                        callback_data=f"admin_requests:n:0:{status}:{next_chat_num}"
+                    )
+                ],
+                [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
+            ] if row
         ])
         
         await callback_query.edit_message_text(requests_text, reply_markup=keyboard)
     except Exception as e:
         logger.error(f"Ошибка при получении списка заявок: {e}")
         await callback_query.edit_message_text("Произошла ошибка при получении списка заявок.")
-    finally:
-        session.close()
 
 @bot.on_callback_query(filters.regex(r"^admin_block$"))
+@timed(handler_seconds, handler="admin_block_callback")
+@correlated
 async def admin_block_callback(client, callback_query):
     """
     Запрос ID для блокировки пользователя
     """
     await callback_query.edit_message_text(
         "🔒 Введите ID пользователя, которого хотите заблокировать.\n\n"
-        "Отправьте сообщение в формате: /block ID",
+        "Отправьте сообщение в формате: /block ID\n"
+        "Несколько ID: /block ID1 ID2 ... или файл TXT/CSV с подписью /block\n"
+        "Все подавшие заявки за интервал: /block_requested 2h",
         reply_markup=types.InlineKeyboardMarkup([
             [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
         ])
     )
 
 @bot.on_callback_query(filters.regex(r"^admin_unblock$"))
+@timed(handler_seconds, handler="admin_unblock_callback")
+@correlated
 async def admin_unblock_callback(client, callback_query):
     """
     Запрос ID для разблокировки пользователя
     """
     await callback_query.edit_message_text(
         "🔓 Введите ID пользователя, которого хотите разблокировать.\n\n"
-        "Отправьте сообщение в формате: /unblock ID",
+        "Отправьте сообщение в формате: /unblock ID\n"
+        "Несколько ID: /unblock ID1 ID2 ... или файл TXT/CSV с подписью /unblock",
         reply_markup=types.InlineKeyboardMarkup([
             [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
         ])
     )
 
 @bot.on_callback_query(filters.regex(r"^admin_add_account$"))
+@timed(handler_seconds, handler="admin_add_account_callback")
+@correlated
 async def admin_add_account_callback(client, callback_query):
     """
     Информация о добавлении аккаунта
     """
     await callback_query.edit_message_text(
         "⚙️ Для добавления аккаунта администратора необходимо создать JSON-сессию Pyrogram.\n\n"
-        "Запустите скрипт session_creator.py для авторизации нового аккаунта.",
+        "Запустите скрипт session_creator.py для авторизации нового аккаунта.\n\n"
+        + (f"Новый аккаунт подключится к боту автоматически в течение {ADMIN_HEALTH_INTERVAL} с."
+           if ADMIN_HEALTH_INTERVAL > 0 else "Новый аккаунт подключится к боту после перезапуска."),
         reply_markup=types.InlineKeyboardMarkup([
             [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
         ])
     )
 
 @bot.on_callback_query(filters.regex(r"^admin_remove_account$"))
+@timed(handler_seconds, handler="admin_remove_account_callback")
+@correlated
 async def admin_remove_account_callback(client, callback_query):
     """
     Запрос номера для удаления аккаунта
@@ -728,7 +1218,81 @@ async def admin_remove_account_callback(client, callback_query):
         ])
     )
 
+def _chats_text():
+    chats = chat_registry.chats
+    if not chats:
+        return "💬 Целевых чатов нет.\n\nДобавьте чат командой: /add_chat ID [название]"
+    
+    running = {account_id for account_id, _ in admin_pool.clients()}
+    chats_text = "💬 Целевые чаты:\n\n"
+    for chat in chats:
+        capable = running.intersection(chat_registry.accounts_for(chat.chat_id))
+        chats_text += f"#{chat.id} {chat.title}\n"
+        chats_text += f"ID: {chat.chat_id}\n"
+        chats_text += f"Аккаунтов с правом добавления: {len(capable)} из {len(running)}\n\n"
+    chats_text += "Добавить: /add_chat ID [название]\nОтключить: /remove_chat ID"
+    return chats_text
+
+@bot.on_callback_query(filters.regex(r"^admin_chats$"))
+@timed(handler_seconds, handler="admin_chats_callback")
+@correlated
+async def admin_chats_callback(client, callback_query):
+    """
+    Список целевых чатов и число аккаунтов, которые могут в них добавлять
+    """
+    await callback_query.edit_message_text(
+        _chats_text(),
+        reply_markup=types.InlineKeyboardMarkup([
+            [types.InlineKeyboardButton("↩️ Назад", callback_data="back_to_admin")]
+        ])
+    )
+
+@bot.on_message(filters.command("add_chat") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="add_chat_command")
+@correlated
+async def add_chat_command(client, message):
+    """
+    Добавление целевого чата: /add_chat ID [название]
+    """
+    args = message.text.split(maxsplit=2)
+    if len(args) < 2 or not re.fullmatch(r"-?\d+", args[1]):
+        await message.reply("Используйте формат: /add_chat ID [название]\nID чата указывается в формате -100...")
+        return
+    
+    try:
+        chat = await chat_registry.add(int(args[1]), args[2].strip() if len(args) > 2 else None)
+        # Доступ аккаунтов к новому чату проверяется в фоне
+        chat_registry.schedule_refresh(admin_pool, chat_resolver)
+        await message.reply(f"✅ Чат «{chat.title}» (ID: {chat.chat_id}) добавлен. Доступ аккаунтов администраторов проверяется.")
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении чата: {e}")
+        await message.reply("Произошла ошибка при добавлении чата.")
+
+@bot.on_message(filters.command("remove_chat") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="remove_chat_command")
+@correlated
+async def remove_chat_command(client, message):
+    """
+    Отключение целевого чата: /remove_chat ID (заявки и история сохраняются)
+    """
+    args = message.text.split()
+    if len(args) < 2 or not re.fullmatch(r"-?\d+", args[1]):
+        await message.reply("Используйте формат: /remove_chat ID")
+        return
+    
+    try:
+        if not await chat_registry.remove(int(args[1])):
+            await message.reply(f"Активный чат с ID {args[1]} не найден.")
+            return
+        chat_resolver.chat_ids = chat_registry.chat_ids
+        await message.reply(f"✅ Чат {args[1]} отключен и больше не показывается пользователям.")
+    except Exception as e:
+        logger.error(f"Ошибка при отключении чата: {e}")
+        await message.reply("Произошла ошибка при отключении чата.")
+
 @bot.on_callback_query(filters.regex(r"^back_to_admin$"))
+@timed(handler_seconds, handler="back_to_admin_callback")
+@correlated
 async def back_to_admin_callback(client, callback_query):
     """
     Возврат в панель администратора
@@ -741,110 +1305,374 @@ async def back_to_admin_callback(client, callback_query):
         [types.InlineKeyboardButton("🔒 Заблокировать пользователя", callback_data="admin_block")],
         [types.InlineKeyboardButton("🔓 Разблокировать пользователя", callback_data="admin_unblock")],
         [types.InlineKeyboardButton("➕ Добавить админ-аккаунт", callback_data="admin_add_account")],
-        [types.InlineKeyboardButton("➖ Удалить админ-аккаунт", callback_data="admin_remove_account")]
+        [types.InlineKeyboardButton("➖ Удалить админ-аккаунт", callback_data="admin_remove_account")],
+        [types.InlineKeyboardButton("💬 Целевые чаты", callback_data="admin_chats")]
     ])
     
     await callback_query.edit_message_text(admin_text, reply_markup=keyboard)
 
+# HTTP-сервер метрик (запускается в startup)
+metrics_server = None
+
+async def rotate_keys_in_background():
+    """
+    Перешифровка данных сессий новым ключом, если задано несколько ключей
+    """
+    try:
+        await run_db(rotate_session_keys)
+    except Exception as e:
+        logger.error(f"Ошибка при ротации ключей шифрования: {e}")
+
+@contextmanager
+def startup_phase(name):
+    """
+    Замеряет и записывает в лог длительность этапа запуска
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        startup_phase_seconds.observe(elapsed, phase=name)
+        logger.info(f"Этап запуска \"{name}\": {elapsed:.2f} с")
+
 async def startup():
     """
-    Функция запуска
+    Функция запуска: последовательные этапы с замером времени, после которых бот готов к работе
     """
-    # Инициализация базы данных
-    init_db()
+    started = time.perf_counter()
     
-    # Запуск бота
-    await bot.start()
-    logger.info("Бот запущен")
+    with startup_phase("база данных"):
+        # Инициализация базы данных
+        init_db()
+        
+        # Целевые чаты для клавиатуры выбора и маршрутизации заявок
+        await chat_registry.load()
+        
+        # Индекс пользователей загружается до приема обновлений, чтобы не пропустить изменения
+        # (нужен только процессу, который получает обновления)
+        if RECEIVES_UPDATES:
+            try:
+                await user_index.load()
+            except Exception as e:
+                logger.error(f"Не удалось загрузить индекс пользователей, проверки выполняются через БД: {e}")
+    
+    # Перешифровка сессий новым ключом выполняется в фоне (одним процессом)
+    if RECEIVES_UPDATES and len(ENCRYPTION_KEYS) > 1:
+        asyncio.create_task(rotate_keys_in_background())
+    
+    # Эндпоинт с метриками для Prometheus
+    global metrics_server
+    if METRICS_PORT:
+        try:
+            metrics_server = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT + WORKER_INDEX)
+        except OSError as e:
+            logger.error(f"Не удалось запустить эндпоинт метрик: {e}")
+    
+    with startup_phase("клиенты администраторов"):
+        # Клиенты всех активных аккаунтов подключаются одновременно
+        await admin_pool.start()
+        await admin_health.start()
+    
+    with startup_phase("целевые чаты"):
+        # Пиры целевых чатов и матрица доступа аккаунтов (поиск по диалогам выполняется сейчас, а не на первой заявке)
+        await chat_registry.refresh(admin_pool, chat_resolver)
+        await chat_registry.start(admin_pool, chat_resolver)
+    
+    with startup_phase("бот"):
+        # Запуск бота (с этого момента принимаются обновления, если процесс их получает)
+        await bot.start()
+        logger.info(f"Бот запущен (процесс {WORKER_INDEX + 1} из {WORKER_COUNT}, {'получает обновления' if RECEIVES_UPDATES else 'только обработка заявок'})")
+        
+        # Запуск отправки уведомлений администраторам
+        await admin_notifier.start()
+        
+        # Запуск фоновой записи пользователей и счетчиков
+        await user_writer.start()
+        await daily_stats.start()
+    
+    with startup_phase("очередь заявок"):
+        # Запуск обработчиков очереди заявок (включая незавершенные до перезапуска)
+        if lease_claimer:
+            # Незавершенные заявки, в том числе других процессов, захватываются по истечении аренды
+            await join_queue.start(restore=False)
+            await lease_claimer.start()
+        else:
+            await join_queue.start()
+    
+    # Архивация выполняется одним процессом
+    if RECEIVES_UPDATES:
+        await archiver.start()
     
-    # Бесконечный цикл для поддержания работы бота
-    while True:
-        await asyncio.sleep(3600)  # Ждем 1 час
+    with startup_phase("скриншоты инструкции"):
+        # Подготовка file_id скриншотов инструкции
+        try:
+            await instruction_media.warm_up(MEDIA_WARMUP_CHAT_ID)
+        except Exception as e:
+            logger.error(f"Не удалось подготовить скриншоты инструкции: {e}")
+    
+    logger.info(f"Бот готов к работе: запуск занял {time.perf_counter() - started:.2f} с, аккаунтов администраторов: {admin_pool.size}")
 
 async def shutdown():
     """
     Функция остановки
     """
-    # Закрываем клиент администратора, если он активен
-    global active_admin_client
-    if active_admin_client and active_admin_client.is_connected:
-        await active_admin_client.stop()
+    # Дожидаемся обработки принятых заявок; необработанные сразу освобождаем для других процессов
+    if lease_claimer:
+        await lease_claimer.stop()
+    await join_queue.stop()
+    if lease_claimer:
+        await lease_claimer.release()
+    
+    # Останавливаем клиенты администраторов
+    await admin_pool.stop()
+    
+    # Отправляем оставшиеся уведомления администраторам
+    await admin_notifier.stop()
+    
+    await chat_registry.stop()
+    await admin_health.stop()
+    await archiver.stop()
     
-    # Останавливаем бот
-    await bot.stop()
+    # Останавливаем бот (если запуск прервался раньше, клиент не подключен)
+    if bot.is_connected:
+        await bot.stop()
+    
+    # Записываем накопленные регистрации пользователей и счетчики
+    await user_writer.stop()
+    await daily_stats.stop()
+    
+    if metrics_server:
+        metrics_server.close()
     logger.info("Бот остановлен")
 
-if __name__ == "__main__":
+# Оставляем обработчики команд для блокировки и разблокировки пользователей
+
+# Сколько ID передается в одном условии IN (ограничение числа параметров запроса в SQLite)
+BLACKLIST_CHUNK_SIZE = 5000
+# Максимальный размер загружаемого списка ID
+BLACKLIST_FILE_LIMIT = 5 * 1024 * 1024
+
+# Названия столбца с ID пользователя в заголовке CSV
+CSV_USER_ID_COLUMNS = ("user_id", "userid", "id")
+
+def _parse_user_ids(text):
+    """
+    Все числовые ID из текста: через пробел, запятую, точку с запятой или по строкам (текст команды, TXT)
+    """
+    return {int(token) for token in re.split(r"[\s,;]+", text or "") if token.isdigit()}
+
+def _parse_csv_user_ids(text):
+    """
+    ID из одного столбца CSV: user_id/id, если в первой строке есть заголовок, иначе первый столбец.
+    Остальные столбцы (телефоны, счетчики) не читаются.
+    """
     try:
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(startup())
-    except KeyboardInterrupt:
-        loop.run_until_complete(shutdown())
-    except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    rows = csv.reader(io.StringIO(text), dialect)
+    header = next(rows, None)
+    if header is None:
+        return set()
+    
+    names = [cell.strip().lower() for cell in header]
+    column = next((names.index(name) for name in CSV_USER_ID_COLUMNS if name in names), 0)
+    if column == 0 and names and names[0].isdigit():
+        # Заголовка нет - первая строка тоже данные
+        rows = itertools.chain([header], rows)
+    
+    return {int(row[column].strip()) for row in rows if len(row) > column and row[column].strip().isdigit()}
+
+def _set_blacklisted(session, user_ids, value):
+    """
+    Меняет статус блокировки всех пользователей из user_ids одним UPDATE на каждую пачку ID.
+    При блокировке ожидающие заявки этих пользователей отклоняются.
+    Возвращает (ID найденных пользователей, отклонено заявок).
+    """
+    user_ids = sorted(user_ids)
+    matched = []
+    rejected = 0
+    for start in range(0, len(user_ids), BLACKLIST_CHUNK_SIZE):
+        chunk = user_ids[start:start + BLACKLIST_CHUNK_SIZE]
+        matched += session.execute(select(User.user_id).where(User.user_id.in_(chunk))).scalars()
+        session.execute(update(User).where(User.user_id.in_(chunk)).values(is_blacklisted=value))
+        if value:
+            rejected += session.execute(
+                update(JoinRequest)
+                .where(JoinRequest.user_id.in_(chunk), JoinRequest.status == "pending")
+                .values(status="rejected")
+            ).rowcount
+    session.commit()
+    return matched, rejected
+
+def _block_requested_between(session, since, until):
+    """
+    Блокирует всех пользователей, подававших заявки с since по until, одним UPDATE.
+    Возвращает (ID заблокированных, отклонено заявок).
+    """
+    requested = select(JoinRequest.user_id).where(JoinRequest.created_at.between(since, until))
+    user_ids = set(session.execute(
+        select(User.user_id).where(User.user_id.in_(requested), User.is_blacklisted.isnot(True))
+    ).scalars())
+    session.execute(update(User).where(User.user_id.in_(requested)).values(is_blacklisted=True))
+    rejected = session.execute(
+        update(JoinRequest)
+        .where(JoinRequest.user_id.in_(requested), JoinRequest.status == "pending")
+        .values(status="rejected")
+    ).rowcount
+    session.commit()
+    return user_ids, rejected
+
+async def _read_user_ids(client, message):
+    """
+    ID из текста команды и из приложенного документа TXT/CSV (из CSV читается только столбец с ID)
+    """
+    text = (message.text or message.caption or "").split(maxsplit=1)
+    user_ids = _parse_user_ids(text[1] if len(text) > 1 else "")
+    
+    document = message.document
+    if document:
+        if document.file_size and document.file_size > BLACKLIST_FILE_LIMIT:
+            raise ValueError(f"Файл больше {BLACKLIST_FILE_LIMIT // (1024 * 1024)} МБ")
+        data = await client.download_media(message, in_memory=True)
+        content = bytes(data.getbuffer()).decode("utf-8-sig", errors="ignore")
+        if (document.file_name or "").lower().endswith(".csv") or document.mime_type in ("text/csv", "text/comma-separated-values"):
+            user_ids |= _parse_csv_user_ids(content)
+        else:
+            user_ids |= _parse_user_ids(content)
+    
+    return user_ids
+
+async def set_blacklisted(user_ids, value):
+    """
+    Единая точка изменения черного списка для всех команд: БД и индекс в памяти
+    """
+    matched, rejected = await run_in_session(_set_blacklisted, user_ids, value)
+    user_index.set_blacklisted(matched, value)
+    return len(matched), rejected
 
-# Оставляем обработчики команд для блокировки и разблокировки пользователей
 @bot.on_message(filters.command("block") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="block_command")
+@correlated
 async def block_command(client, message):
     """
-    Блокировка пользователя
+    Блокировка пользователей: ID в сообщении (несколько через пробел или запятую)
+    или в приложенном файле TXT/CSV с подписью /block
     """
     try:
-        args = message.text.split()
-        if len(args) != 2:
-            await message.reply("Использование: /block [user_id]")
+        user_ids = await _read_user_ids(client, message)
+        if not user_ids:
+            await message.reply(
+                "Использование: /block [user_id ...]\n"
+                "Можно указать несколько ID или отправить файл TXT/CSV с подписью /block"
+            )
             return
         
-        user_id = int(args[1])
-        session = get_session()
+        updated, rejected = await set_blacklisted(user_ids, True)
         
-        user = session.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            await message.reply(f"Пользователь с ID {user_id} не найден.")
+        if len(user_ids) == 1 and not updated:
+            await message.reply(f"Пользователь с ID {next(iter(user_ids))} не найден.")
             return
         
-        user.is_blacklisted = True
-        session.commit()
-        await message.reply(f"✅ Пользователь с ID {user_id} заблокирован.")
-    except ValueError:
-        await message.reply("ID пользователя должен быть числом.")
+        logger.info(f"Заблокировано пользователей: {updated} из {len(user_ids)}, отклонено заявок: {rejected}")
+        await message.reply(
+            f"✅ Заблокировано пользователей: {updated}\n"
+            f"Не найдено: {len(user_ids) - updated}\n"
+            f"Отклонено ожидающих заявок: {rejected}"
+        )
+    except ValueError as e:
+        await message.reply(f"Не удалось прочитать список ID: {e}")
     except Exception as e:
         logger.error(f"Ошибка при блокировке пользователя: {e}")
         await message.reply("Произошла ошибка при блокировке пользователя.")
-    finally:
-        session.close()
 
 @bot.on_message(filters.command("unblock") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="unblock_command")
+@correlated
 async def unblock_command(client, message):
     """
-    Разблокировка пользователя
+    Разблокировка пользователей: ID в сообщении или в приложенном файле TXT/CSV с подписью /unblock
     """
     try:
-        args = message.text.split()
-        if len(args) != 2:
-            await message.reply("Использование: /unblock [user_id]")
+        user_ids = await _read_user_ids(client, message)
+        if not user_ids:
+            await message.reply(
+                "Использование: /unblock [user_id ...]\n"
+                "Можно указать несколько ID или отправить файл TXT/CSV с подписью /unblock"
+            )
             return
         
-        user_id = int(args[1])
-        session = get_session()
+        updated, _ = await set_blacklisted(user_ids, False)
         
-        user = session.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            await message.reply(f"Пользователь с ID {user_id} не найден.")
+        if len(user_ids) == 1 and not updated:
+            await message.reply(f"Пользователь с ID {next(iter(user_ids))} не найден.")
             return
         
-        user.is_blacklisted = False
-        session.commit()
-        await message.reply(f"✅ Пользователь с ID {user_id} разблокирован.")
-    except ValueError:
-        await message.reply("ID пользователя должен быть числом.")
+        logger.info(f"Разблокировано пользователей: {updated} из {len(user_ids)}")
+        await message.reply(
+            f"✅ Разблокировано пользователей: {updated}\n"
+            f"Не найдено: {len(user_ids) - updated}"
+        )
+    except ValueError as e:
+        await message.reply(f"Не удалось прочитать список ID: {e}")
     except Exception as e:
         logger.error(f"Ошибка при разблокировке пользователя: {e}")
         await message.reply("Произошла ошибка при разблокировке пользователя.")
-    finally:
-        session.close()
+
+def _parse_window(args):
+    """
+    Интервал времени из аргументов команды: длительность (30m, 2h, 1d) до текущего момента,
+    "ДД.ММ.ГГГГ ЧЧ:ММ" до текущего момента или две такие даты
+    """
+    now = datetime.now()
+    if len(args) == 1:
+        match = re.fullmatch(r"(\d+)([smhd])", args[0])
+        if not match:
+            raise ValueError("длительность указывается как 30m, 2h или 1d")
+        seconds = int(match.group(1)) * {"s": 1, "m": 60, "h": 3600, "d": 86400}[match.group(2)]
+        return now - timedelta(seconds=seconds), now
+    if len(args) in (2, 4):
+        since = datetime.strptime(" ".join(args[:2]), "%d.%m.%Y %H:%M")
+        until = datetime.strptime(" ".join(args[2:]), "%d.%m.%Y %H:%M") if len(args) == 4 else now
+        return since, until
+    raise ValueError("укажите длительность или даты")
+
+@bot.on_message(filters.command("block_requested") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="block_requested_command")
+@correlated
+async def block_requested_command(client, message):
+    """
+    Блокировка всех пользователей, подававших заявки в указанный интервал времени
+    """
+    try:
+        since, until = _parse_window(message.text.split()[1:])
+    except ValueError as e:
+        await message.reply(
+            f"Неверный интервал: {e}\n\n"
+            "Использование:\n"
+            "/block_requested 2h - заявки за последние 2 часа\n"
+            "/block_requested 01.05.2024 10:00 01.05.2024 12:00 - заявки в интервале"
+        )
+        return
+    
+    try:
+        user_ids, rejected = await run_in_session(_block_requested_between, since, until)
+        user_index.set_blacklisted(user_ids, True)
+        
+        logger.info(f"Заблокированы подавшие заявки с {since} по {until}: {len(user_ids)}, отклонено заявок: {rejected}")
+        await message.reply(
+            f"✅ Заблокировано пользователей, подававших заявки "
+            f"с {since.strftime('%d.%m.%Y %H:%M')} по {until.strftime('%d.%m.%Y %H:%M')}: {len(user_ids)}\n"
+            f"Отклонено ожидающих заявок: {rejected}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при блокировке по интервалу заявок: {e}")
+        await message.reply("Произошла ошибка при блокировке пользователей.")
 
 @bot.on_message(filters.command("remove_admin") & filters.private & filters.user(ADMIN_IDS))
+@timed(handler_seconds, handler="remove_admin_command")
+@correlated
 async def remove_admin_command(client, message):
     """
     Удаление аккаунта администратора
@@ -856,18 +1684,43 @@ async def remove_admin_command(client, message):
             return
         
         phone = args[1]
-        session = get_session()
         
-        admin_account = session.query(AdminAccount).filter_by(phone=phone).first()
-        if not admin_account:
+        def delete_account(session):
+            admin_account = session.query(AdminAccount).filter_by(phone=phone).first()
+            if not admin_account:
+                return None
+            account_id = admin_account.id
+            session.delete(admin_account)
+            session.commit()
+            return account_id
+        
+        account_id = await run_in_session(delete_account)
+        if account_id is None:
             await message.reply(f"Аккаунт с номером {phone} не найден.")
             return
         
-        session.delete(admin_account)
-        session.commit()
+        # Запущенный клиент больше не получает заявок, его сессия удаляется из памяти
+        await admin_pool.remove(account_id)
+        
         await message.reply(f"✅ Аккаунт с номером {phone} удален.")
     except Exception as e:
         logger.error(f"Ошибка при удалении аккаунта администратора: {e}")
         await message.reply("Произошла ошибка при удалении аккаунта администратора.")
+
+async def main():
+    """
+    Запуск, ожидание сигнала остановки (SIGINT/SIGTERM) и остановка
+    """
+    try:
+        await startup()
+        await idle()
     finally:
-        session.close() 
\ No newline at end of file
+        await shutdown()
+
+if __name__ == "__main__":
+    # Обработчики зарегистрированы в цикле событий клиента бота
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(main())
+    except Exception as e:
+        logger.error(f"Критическая ошибка: {e}")
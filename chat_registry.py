@@ -0,0 +1,215 @@
+import asyncio
+import logging
+from datetime import datetime
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import UserNotParticipant, ChatAdminRequired
+from sqlalchemy import func
+from database import run_in_session, Chat
+from chat_resolver import PEER_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, означающие, что аккаунт не может добавлять в чат (в отличие от временных сбоев)
+NO_ACCESS_ERRORS = (UserNotParticipant, ChatAdminRequired, *PEER_ERRORS)
+
+
+def _load_chats(session):
+    return session.query(Chat).order_by(Chat.position, Chat.id).all()
+
+
+def _save_chat(session, chat_id, title, invite_link):
+    """
+    Добавляет чат или снова включает ранее удаленный. Возвращает запись чата.
+    """
+    chat = session.query(Chat).filter_by(chat_id=chat_id).first()
+    if chat is None:
+        last_position = session.query(func.max(Chat.position)).scalar() or 0
+        chat = Chat(chat_id=chat_id, position=last_position + 1, created_at=datetime.now())
+        session.add(chat)
+    chat.title = title or chat.title
+    chat.invite_link = invite_link or chat.invite_link
+    chat.active = True
+    session.commit()
+    if not chat.title:
+        chat.title = f"Чат #{chat.id}"
+        session.commit()
+    # После commit атрибуты сброшены - загружаем их, пока сессия открыта
+    session.refresh(chat)
+    return chat
+
+
+def _deactivate_chat(session, chat_id):
+    updated = session.query(Chat).filter_by(chat_id=chat_id, active=True).update({Chat.active: False})
+    session.commit()
+    return updated > 0
+
+
+async def probe_access(client, resolver, account_id, chat_id):
+    """
+    Может ли аккаунт добавлять участников в чат: True/False,
+    None - не удалось проверить (временная ошибка, прежнее значение сохраняется)
+    """
+    try:
+        if await resolver.resolve(account_id, client, chat_id) is None:
+            return False
+        member = await client.get_chat_member(chat_id, "me")
+        if member.status == ChatMemberStatus.OWNER:
+            return True
+        if member.status == ChatMemberStatus.ADMINISTRATOR:
+            return member.privileges is None or bool(member.privileges.can_invite_users)
+        if member.status == ChatMemberStatus.RESTRICTED:
+            return bool(member.permissions and member.permissions.can_invite_users)
+        if member.status == ChatMemberStatus.MEMBER:
+            # Обычный участник добавляет, только если это разрешено всем участникам чата
+            chat = await client.get_chat(chat_id)
+            return bool(chat.permissions and chat.permissions.can_invite_users)
+        return False
+    except NO_ACCESS_ERRORS:
+        return False
+    except Exception as e:
+        logger.warning(f"Не удалось проверить доступ аккаунта {account_id} к чату {chat_id}: {type(e).__name__}: {e}")
+        return None
+
+
+class ChatRegistry:
+    """
+    Целевые чаты (таблица chats) в памяти и матрица доступа "аккаунт x чат".
+
+    Список чатов загружается при запуске и меняется командами администратора.
+    Матрица показывает, какие аккаунты администраторов могут добавлять
+    участников в какой чат; она пересчитывается в фоне раз в refresh_interval
+    секунд, а при ошибках добавления обновляется сразу (set_access).
+    """
+
+    def __init__(self, refresh_interval=600):
+        self.refresh_interval = refresh_interval
+        self._chats = {}
+        self._by_chat_id = {}
+        self._access = {}
+        self._task = None
+        # Внеочередные пересчеты (schedule_refresh) - ссылки держатся до их завершения
+        self._refreshes = set()
+
+    async def load(self):
+        chats = await run_in_session(_load_chats)
+        self._chats = {chat.id: chat for chat in chats}
+        self._by_chat_id = {chat.chat_id: chat for chat in chats}
+        logger.info(f"Целевые чаты загружены: {len(self.chats)} активных")
+
+    @property
+    def chats(self):
+        """
+        Активные чаты в порядке кнопок
+        """
+        return [chat for chat in self._chats.values() if chat.active]
+
+    @property
+    def chat_ids(self):
+        return [chat.chat_id for chat in self.chats]
+
+    def get(self, number):
+        """
+        Активный чат по номеру из callback_data или None
+        """
+        chat = self._chats.get(number)
+        return chat if chat and chat.active else None
+
+    def title(self, chat_id):
+        chat = self._by_chat_id.get(chat_id)
+        return chat.title if chat else f"Чат {chat_id}"
+
+    def number(self, chat_id):
+        chat = self._by_chat_id.get(chat_id)
+        return chat.id if chat else 0
+
+    async def add(self, chat_id, title=None, invite_link=None):
+        chat = await run_in_session(_save_chat, chat_id, title, invite_link)
+        self._chats[chat.id] = chat
+        self._by_chat_id[chat.chat_id] = chat
+        logger.info(f"Добавлен целевой чат {chat.title} (ID: {chat.chat_id})")
+        return chat
+
+    async def remove(self, chat_id):
+        if not await run_in_session(_deactivate_chat, chat_id):
+            return False
+        chat = self._by_chat_id.get(chat_id)
+        if chat:
+            chat.active = False
+        for access in self._access.values():
+            access.pop(chat_id, None)
+        logger.info(f"Целевой чат {chat_id} отключен")
+        return True
+
+    def can_add(self, account_id, chat_id):
+        """
+        True/False по матрице доступа; None, если доступ аккаунта к чату еще не проверен
+        """
+        return self._access.get(account_id, {}).get(chat_id)
+
+    def set_access(self, account_id, chat_id, value):
+        self._access.setdefault(account_id, {})[chat_id] = value
+
+    def accounts_for(self, chat_id):
+        """
+        Аккаунты, которые по матрице могут добавлять в чат
+        """
+        return [account_id for account_id, access in self._access.items() if access.get(chat_id)]
+
+    async def refresh(self, pool, resolver):
+        """
+        Пересчитывает матрицу доступа для всех запущенных клиентов пула
+        """
+        chat_ids = self.chat_ids
+        resolver.chat_ids = chat_ids
+        # Чаты, которые раньше не нашлись, проверяются заново - иначе доступ к ним не восстановится
+        resolver.forget_missing()
+
+        async def refresh_account(account_id, client):
+            for chat_id in chat_ids:
+                value = await probe_access(client, resolver, account_id, chat_id)
+                if value is not None:
+                    self.set_access(account_id, chat_id, value)
+
+        clients = pool.clients()
+        await asyncio.gather(*(refresh_account(account_id, client) for account_id, client in clients))
+
+        for chat_id in chat_ids:
+            if not self.accounts_for(chat_id):
+                logger.error(f"Ни один аккаунт администратора не может добавлять в чат {self.title(chat_id)} ({chat_id})")
+        logger.info(f"Матрица доступа обновлена: аккаунтов {len(clients)}, чатов {len(chat_ids)}")
+
+    def schedule_refresh(self, pool, resolver):
+        """
+        Внеочередной пересчет матрицы доступа в фоне (например, после добавления чата)
+        """
+        async def run():
+            try:
+                await self.refresh(pool, resolver)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении матрицы доступа: {type(e).__name__}: {e}")
+
+        task = asyncio.create_task(run())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    async def start(self, pool, resolver):
+        """
+        Запускает фоновое обновление матрицы доступа
+        """
+        async def run():
+            while True:
+                await asyncio.sleep(self.refresh_interval)
+                try:
+                    await self.refresh(pool, resolver)
+                except Exception as e:
+                    logger.error(f"Ошибка при обновлении матрицы доступа: {type(e).__name__}: {e}")
+
+        if self.refresh_interval > 0:
+            self._task = asyncio.create_task(run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._refreshes):
+            task.cancel()
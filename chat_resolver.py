@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from pyrogram.errors import PeerIdInvalid, ChannelInvalid, ChannelPrivate, ChatIdInvalid
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых закэшированный пир считается недействительным
+PEER_ERRORS = (PeerIdInvalid, ChannelInvalid, ChannelPrivate, ChatIdInvalid)
+
+
+class ChatPeerResolver:
+    """
+    Кэш разрешённых пиров целевых чатов для каждого аккаунта администратора.
+
+    Пиры заполняются один раз на аккаунт: сначала пробуем resolve_peer по ID,
+    а для чатов, которых нет во внутреннем хранилище клиента, выполняем
+    один проход по диалогам (он же сохраняет пиры в хранилище Pyrogram).
+    """
+
+    def __init__(self, chat_ids):
+        self.chat_ids = [chat_id for chat_id in chat_ids if chat_id]
+        self._peers = {}
+        self._locks = {}
+
+    async def resolve(self, account_key, client, chat_id):
+        """
+        Возвращает InputPeer целевого чата для аккаунта или None, если чат недоступен
+        """
+        peers = self._peers.get(account_key)
+        if peers is not None and chat_id in peers:
+            return peers[chat_id]
+
+        lock = self._locks.setdefault(account_key, asyncio.Lock())
+        async with lock:
+            # Пока ждали блокировку, пиры мог заполнить другой запрос
+            peers = self._peers.get(account_key)
+            if peers is None or chat_id not in peers:
+                peers = await self._fill(client, peers or {}, chat_id)
+                self._peers[account_key] = peers
+            return peers.get(chat_id)
+
+    async def _fill(self, client, peers, chat_id):
+        """
+        Разрешает все ещё не найденные целевые чаты за один проход
+        """
+        wanted = set(self.chat_ids) | {chat_id}
+        missing = set()
+
+        for wanted_id in wanted - set(peers):
+            try:
+                peers[wanted_id] = await client.resolve_peer(wanted_id)
+            except (KeyError, *PEER_ERRORS):
+                missing.add(wanted_id)
+
+        if missing:
+            logger.info(f"Чаты {sorted(missing)} не найдены в хранилище клиента, выполняем однократный поиск по диалогам")
+            scanned = 0
+            async for dialog in client.get_dialogs():
+                scanned += 1
+                if dialog.chat.id in missing:
+                    peers[dialog.chat.id] = await client.resolve_peer(dialog.chat.id)
+                    missing.discard(dialog.chat.id)
+                    logger.info(f"Найден целевой чат: {dialog.chat.title} (ID: {dialog.chat.id})")
+                    if not missing:
+                        break
+            logger.info(f"Просмотрено диалогов: {scanned}")
+
+        # Недоступные чаты тоже запоминаем, чтобы не повторять поиск на каждом запросе
+        for missing_id in missing:
+            logger.error(f"Чат {missing_id} недоступен для аккаунта администратора")
+            peers[missing_id] = None
+
+        return peers
+
+    def invalidate(self, account_key, chat_id=None):
+        """
+        Сбрасывает кэш пиров аккаунта (целиком или для одного чата)
+        """
+        if chat_id is None:
+            self._peers.pop(account_key, None)
+        elif account_key in self._peers:
+            self._peers[account_key].pop(chat_id, None)
+
+    def forget_missing(self):
+        """
+        Сбрасывает запомненные недоступные чаты всех аккаунтов, чтобы следующий resolve искал их снова
+        (аккаунт мог вступить в чат или получить права после прошлого поиска)
+        """
+        for peers in self._peers.values():
+            for chat_id in [chat_id for chat_id, peer in peers.items() if peer is None]:
+                del peers[chat_id]
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from datetime import date, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from database import run_in_session, DailyStat
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ("day", "metric", "chat_id", "account_id")
+
+
+def _add_counts(session, rows):
+    """
+    Прибавляет накопленные приращения к счетчикам одним INSERT ... ON CONFLICT DO UPDATE
+    """
+    dialect = session.bind.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        # Для остальных СУБД - по одной строке через ORM
+        for row in rows:
+            stat = session.get(DailyStat, tuple(row[column] for column in KEY_COLUMNS))
+            if stat:
+                stat.value += row["value"]
+            else:
+                session.add(DailyStat(**row))
+        session.commit()
+        return
+
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    statement = insert(DailyStat).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=[getattr(DailyStat, column) for column in KEY_COLUMNS],
+        set_={"value": DailyStat.value + statement.excluded.value}
+    )
+    session.execute(statement)
+    session.commit()
+
+
+def _load_counts(session, since):
+    return session.query(DailyStat.day, DailyStat.metric, DailyStat.chat_id, DailyStat.account_id, DailyStat.value) \
+        .filter(DailyStat.day >= since).all()
+
+
+class DailyStats:
+    """
+    Дневные счетчики событий (регистрации, заявки, итоговые статусы, ошибки
+    приватности, FloodWait/PeerFlood, добавления по аккаунтам) в таблице daily_stats.
+
+    inc() только увеличивает счетчик в памяти; фоновая задача раз в
+    flush_interval секунд прибавляет накопленное к строкам таблицы. Сводка
+    читает строки за несколько дней, поэтому ее стоимость не зависит от
+    размера users и join_requests. Несколько процессов прибавляют к одним и
+    тем же строкам, поэтому счетчики общие.
+    """
+
+    def __init__(self, flush_interval=5):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._task = None
+        self._closing = False
+        self._wake = asyncio.Event()
+
+    def inc(self, metric, chat_id=0, account_id=0, amount=1):
+        key = (date.today(), metric, chat_id or 0, account_id or 0)
+        self._pending[key] = self._pending.get(key, 0) + amount
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        rows = [dict(zip(KEY_COLUMNS, key), value=value) for key, value in pending.items()]
+        try:
+            await run_in_session(_add_counts, rows)
+        except Exception as e:
+            logger.error(f"Ошибка при записи счетчиков ({len(rows)}): {type(e).__name__}: {e}")
+            # Возвращаем приращения, накопленные за время записи, складываются с ними
+            for key, value in pending.items():
+                self._pending[key] = self._pending.get(key, 0) + value
+
+    async def stop(self):
+        """
+        Останавливает фоновую запись и записывает все оставшееся
+        """
+        self._closing = True
+        self._wake.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def totals(self, days=7):
+        """
+        Счетчики за последние days дней (включая сегодня и еще не записанные приращения):
+        словарь (день, метрика, chat_id, account_id) -> значение
+        """
+        since = date.today() - timedelta(days=days - 1)
+        totals = {}
+        for row_day, metric, chat_id, account_id, value in await run_in_session(_load_counts, since):
+            totals[(row_day, metric, chat_id, account_id)] = value
+        for key, value in self._pending.items():
+            if key[0] >= since:
+                totals[key] = totals.get(key, 0) + value
+        return totals
@@ -1,16 +1,26 @@
 import os
 import json
 import base64
+import asyncio
+import time
 import hashlib
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Text, DateTime
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, inspect, select, insert, update, func, text, Column, Integer, BigInteger, String, Boolean, Text, Date, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from metrics import registry
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Инициализация базы данных
 database_url = os.getenv("DATABASE_URL")
 engine = create_engine(database_url)
@@ -25,8 +35,12 @@ def get_fernet_key(password):
     return base64.urlsafe_b64encode(key)
 
 # Инициализация шифрования
+# ENCRYPTION_KEYS - ключи через запятую, первый самый новый: им шифруются данные,
+# расшифровка возможна любым. Если не задан, используется один ENCRYPTION_KEY.
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
-cipher_suite = Fernet(get_fernet_key(ENCRYPTION_KEY))
+ENCRYPTION_KEYS = [key.strip() for key in os.getenv("ENCRYPTION_KEYS", "").split(",") if key.strip()] or [ENCRYPTION_KEY]
+primary_cipher = Fernet(get_fernet_key(ENCRYPTION_KEYS[0]))
+cipher_suite = MultiFernet([primary_cipher] + [Fernet(get_fernet_key(key)) for key in ENCRYPTION_KEYS[1:]])
 
 # Функция для шифрования данных сессии
 def encrypt_session(session_data):
@@ -40,13 +54,20 @@ class User(Base):
     __tablename__ = "users"
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, unique=True)
+    user_id = Column(BigInteger, unique=True)
     username = Column(String, nullable=True)
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     registration_date = Column(DateTime, default=datetime.now)
     is_blacklisted = Column(Boolean, default=False)
-    chat_joined = Column(Integer, nullable=True)  # ID чата, к которому присоединился
+    chat_joined = Column(BigInteger, nullable=True)  # ID чата, к которому присоединился
+    
+    __table_args__ = (
+        # Сортировка списка пользователей в панели администратора
+        Index("ix_users_registration_date", "registration_date"),
+        # Постраничный список пользователей с фильтром по блокировке
+        Index("ix_users_blacklisted_registration_date", "is_blacklisted", "registration_date", "id"),
+    )
     
 class AdminAccount(Base):
     __tablename__ = "admin_accounts"
@@ -57,18 +78,387 @@ class AdminAccount(Base):
     last_used = Column(DateTime, default=datetime.now)
     usage_count = Column(Integer, default=0)
     session_data = Column(Text)  # Зашифрованные данные сессии
+    cooldown_until = Column(DateTime, nullable=True)  # До какого времени аккаунт не используется (FloodWait/PeerFlood)
+    health_checked_at = Column(DateTime, nullable=True)  # Последняя фоновая проверка клиента
+    health_ok_at = Column(DateTime, nullable=True)  # Последняя успешная проверка
+    health_error = Column(String, nullable=True)  # Класс ошибки последней проверки (NULL - успешна)
     
 class JoinRequest(Base):
     __tablename__ = "join_requests"
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer)
-    chat_id = Column(Integer)
+    user_id = Column(BigInteger)
+    chat_id = Column(BigInteger)
     status = Column(String, default="pending")  # pending, approved, rejected
     created_at = Column(DateTime, default=datetime.now)
+    message_id = Column(Integer, nullable=True)  # Сообщение с меню, которое обновляется результатом
+    lease_owner = Column(String, nullable=True)  # Процесс, захвативший заявку (при нескольких процессах)
+    lease_expires_at = Column(DateTime, nullable=True)  # После этого времени заявку может захватить другой процесс
+    
+    __table_args__ = (
+        # Поиск ожидающей заявки пользователя на горячем пути
+        Index("ix_join_requests_user_chat_status", "user_id", "chat_id", "status"),
+        # Сортировка списка заявок в панели администратора
+        Index("ix_join_requests_created_at", "created_at"),
+        # Постраничный список заявок с фильтром по статусу или чату
+        Index("ix_join_requests_status_created_at", "status", "created_at", "id"),
+        Index("ix_join_requests_chat_created_at", "chat_id", "created_at", "id"),
+        # Захват ожидающих заявок процессами-обработчиками
+        Index("ix_join_requests_status_lease", "status", "lease_expires_at"),
+        # Не более одной ожидающей заявки пользователя в каждый чат
+        Index(
+            "uq_join_requests_pending", "user_id", "chat_id",
+            unique=True,
+            sqlite_where=text("status = 'pending'"),
+            postgresql_where=text("status = 'pending'")
+        ),
+    )
+    
+class Chat(Base):
+    __tablename__ = "chats"
+    
+    id = Column(Integer, primary_key=True)  # Номер чата в callback_data кнопок (select_chat_<id>)
+    chat_id = Column(BigInteger, unique=True)  # ID чата в Telegram (-100...)
+    title = Column(String)  # Подпись кнопки выбора чата
+    invite_link = Column(String, nullable=True)  # Запасная ссылка-приглашение
+    position = Column(Integer, default=0)  # Порядок кнопок
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.now)
+    
+class DailyStat(Base):
+    __tablename__ = "daily_stats"
+    
+    # Счетчик события за день; chat_id и account_id равны 0, если счетчик не относится к чату или аккаунту
+    day = Column(Date, primary_key=True)
+    metric = Column(String, primary_key=True)  # registrations, requests, approved, rejected, link_sent, privacy, flood, account_adds
+    chat_id = Column(BigInteger, primary_key=True, default=0)
+    account_id = Column(Integer, primary_key=True, default=0)
+    value = Column(Integer, default=0)
+    
+class JoinWorker(Base):
+    __tablename__ = "join_workers"
+    
+    # Процесс, захватывающий заявки (владелец аренды), и чаты, в которые могут добавлять его аккаунты
+    owner = Column(String, primary_key=True)
+    served_chats = Column(Text)  # JSON-список ID чатов
+    heartbeat_at = Column(DateTime)
+    
+class MediaCache(Base):
+    __tablename__ = "media_cache"
     
+    key = Column(String, primary_key=True)  # Имя файла на диске
+    file_id = Column(String)  # file_id загруженного в Telegram файла
+    updated_at = Column(DateTime, default=datetime.now)
+    
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.now)
+    
+def _create_indexes(*names):
+    """
+    Миграция, создающая объявленные в моделях индексы, если их еще нет в базе
+    """
+    def migrate(connection):
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in names:
+                    index.create(bind=connection, checkfirst=True)
+    return migrate
+
+def _add_columns(table, *names):
+    """
+    Миграция, добавляющая объявленные в модели столбцы, если их еще нет в таблице
+    """
+    def migrate(connection):
+        existing = {column["name"] for column in inspect(connection).get_columns(table.__tablename__)}
+        for name in names:
+            if name in existing:
+                continue
+            column = table.__table__.columns[name]
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table.__tablename__} ADD COLUMN {name} {column_type}"))
+    return migrate
+
+def _widen_columns(table, *names):
+    """
+    Миграция, переводящая столбцы ID Telegram в BIGINT (ID супергрупп -100... и новых
+    пользователей не помещаются в INTEGER Postgres). В SQLite INTEGER и так 64-битный.
+    """
+    def migrate(connection):
+        if connection.dialect.name != "postgresql":
+            return
+        for name in names:
+            connection.execute(text(f"ALTER TABLE {table.__tablename__} ALTER COLUMN {name} TYPE BIGINT"))
+    return migrate
+
+def _dedupe_pending_requests(connection):
+    """
+    Оставляет по одной ожидающей заявке на пару (пользователь, чат), остальные отклоняет
+    """
+    table = JoinRequest.__table__
+    keep = select(func.min(table.c.id)).where(table.c.status == "pending").group_by(table.c.user_id, table.c.chat_id)
+    connection.execute(
+        update(table)
+        .where(table.c.status == "pending", table.c.id.not_in(keep.scalar_subquery()))
+        .values(status="rejected")
+    )
+
+def _unique_pending_requests(connection):
+    _dedupe_pending_requests(connection)
+    _create_indexes("uq_join_requests_pending")(connection)
+
+def _seed_chats(connection):
+    """
+    Переносит целевые чаты из CHAT_ID_1/CHAT_ID_2 (и ссылки CHAT_LINK_1/CHAT_LINK_2) в таблицу chats.
+    Номера 1 и 2 сохраняются, чтобы кнопки select_chat_1/select_chat_2 в старых сообщениях продолжали работать.
+    """
+    table = Chat.__table__
+    if connection.execute(select(func.count()).select_from(table)).scalar():
+        return
+    for number in (1, 2):
+        chat_id = int(os.getenv(f"CHAT_ID_{number}") or 0)
+        if not chat_id:
+            continue
+        connection.execute(insert(table).values(
+            id=number,
+            chat_id=chat_id,
+            title=f"Чат #{number}",
+            invite_link=os.getenv(f"CHAT_LINK_{number}") or None,
+            position=number,
+            active=True,
+            created_at=datetime.now()
+        ))
+    if connection.dialect.name == "postgresql":
+        # Номера вставлены явно - сдвигаем последовательность, чтобы новые чаты их не заняли
+        connection.execute(text("SELECT setval(pg_get_serial_sequence('chats', 'id'), COALESCE(MAX(id), 1)) FROM chats"))
+
+def _join_request_leases(connection):
+    _add_columns(JoinRequest, "message_id", "lease_owner", "lease_expires_at")(connection)
+    _create_indexes("ix_join_requests_status_lease")(connection)
+
+def _widen_ids(connection):
+    _widen_columns(User, "user_id", "chat_joined")(connection)
+    _widen_columns(JoinRequest, "user_id", "chat_id")(connection)
+
+def _as_date(value):
+    # SQLite возвращает date() строкой
+    return datetime.strptime(value, "%Y-%m-%d").date() if isinstance(value, str) else value
+
+def _backfill_daily_stats(connection):
+    """
+    Заполняет счетчики по уже накопленным пользователям и заявкам (однократный полный проход).
+    Заявки, перенесенные в архив, не учитываются.
+    """
+    users = User.__table__
+    requests = JoinRequest.__table__
+    counts = {}
+    
+    day = func.date(users.c.registration_date)
+    for row_day, value in connection.execute(select(day, func.count()).where(users.c.registration_date.isnot(None)).group_by(day)):
+        counts[(_as_date(row_day), "registrations", 0)] = value
+    
+    day = func.date(requests.c.created_at)
+    query = select(day, requests.c.chat_id, requests.c.status, func.count()) \
+        .where(requests.c.created_at.isnot(None)).group_by(day, requests.c.chat_id, requests.c.status)
+    for row_day, chat_id, status, value in connection.execute(query):
+        row_day = _as_date(row_day)
+        key = (row_day, "requests", chat_id or 0)
+        counts[key] = counts.get(key, 0) + value
+        if status in ("approved", "rejected", "link_sent"):
+            counts[(row_day, status, chat_id or 0)] = value
+    
+    if counts:
+        connection.execute(insert(DailyStat.__table__), [
+            {"day": row_day, "metric": metric, "chat_id": chat_id, "account_id": 0, "value": value}
+            for (row_day, metric, chat_id), value in counts.items()
+        ])
+
+# Миграции схемы: (версия, описание, функция от соединения). Новые добавляются только в конец.
+MIGRATIONS = [
+    (1, "Индексы заявок и даты регистрации пользователей", _create_indexes(
+        "ix_join_requests_user_chat_status",
+        "ix_join_requests_created_at",
+        "ix_users_registration_date"
+    )),
+    (2, "Уникальность ожидающей заявки пользователя в чат", _unique_pending_requests),
+    (3, "Время окончания паузы аккаунта администратора", _add_columns(AdminAccount, "cooldown_until")),
+    (4, "Индексы постраничных списков панели администратора", _create_indexes(
+        "ix_join_requests_status_created_at",
+        "ix_join_requests_chat_created_at",
+        "ix_users_blacklisted_registration_date"
+    )),
+    (5, "Целевые чаты из CHAT_ID_1/CHAT_ID_2", _seed_chats),
+    (6, "Результаты проверки клиентов администраторов", _add_columns(
+        AdminAccount, "health_checked_at", "health_ok_at", "health_error"
+    )),
+    (7, "Аренда заявок процессами-обработчиками", _join_request_leases),
+    (8, "Дневные счетчики событий по накопленным данным", _backfill_daily_stats),
+    (9, "ID пользователей и чатов Telegram в BIGINT", _widen_ids),
+]
+
+def run_migrations():
+    """
+    Применяет к существующей базе миграции, которые еще не записаны в schema_version
+    """
+    with engine.connect() as connection:
+        applied = set(connection.execute(select(SchemaVersion.version)).scalars())
+    
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        # Каждая миграция выполняется в своей транзакции вместе с записью о ней
+        with engine.begin() as connection:
+            migrate(connection)
+            connection.execute(insert(SchemaVersion).values(
+                version=version,
+                description=description,
+                applied_at=datetime.now()
+            ))
+        logger.info(f"Применена миграция схемы {version}: {description}")
+    
+# Ключ рекомендательной блокировки Postgres, под которой создается схема и применяются миграции
+MIGRATION_LOCK_KEY = 7264019
+
+@contextmanager
+def _migration_lock():
+    """
+    Несколько процессов с одной базой Postgres создают схему и применяют миграции по очереди:
+    остальные ждут блокировку и затем видят уже примененные миграции (SQLite не требует блокировки)
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect() as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        connection.commit()
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            connection.commit()
+
 def init_db():
-    Base.metadata.create_all(engine)
+    with _migration_lock():
+        Base.metadata.create_all(engine)
+        run_migrations()
     
 def get_session():
-    return Session() 
\ No newline at end of file
+    return Session()
+
+# Пул потоков для запросов к БД из асинхронного кода (синхронная сессия не блокирует цикл событий)
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+# Время вызова с учетом ожидания свободного потока
+db_call_seconds = registry.histogram("db_call_seconds", "Длительность обращений к БД", ["operation"])
+
+async def run_db(func, *args):
+    """
+    Выполняет синхронную функцию работы с БД в пуле потоков
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args))
+
+def _call_in_session(func, *args):
+    session = Session()
+    try:
+        return func(session, *args)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+async def run_in_session(func, *args):
+    """
+    Выполняет func(session, *args) в пуле потоков с отдельной сессией.
+    Возвращаемые объекты отсоединены от сессии - читать можно только загруженные атрибуты.
+    """
+    with db_call_seconds.time(operation=func.__name__):
+        return await run_db(_call_in_session, func, *args)
+
+class SessionVault:
+    """
+    Кэш расшифрованных данных сессий администраторов в памяти.
+
+    Данные расшифровываются при первом обращении и хранятся до истечения ttl
+    или явной очистки. Если зашифрованные данные в БД изменились (новая сессия
+    или ротация ключей), запись расшифровывается заново.
+    """
+    
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+    
+    def get(self, account_id, encrypted_data):
+        self.purge_expired()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(account_id)
+            if entry and entry[0] == encrypted_data and entry[2] > now:
+                return entry[1]
+        
+        session_data = decrypt_session(encrypted_data)
+        with self._lock:
+            self._entries[account_id] = (encrypted_data, session_data, now + self.ttl)
+        return session_data
+    
+    def wipe(self, account_id=None):
+        """
+        Удаляет расшифрованные данные одного аккаунта или всех аккаунтов из памяти
+        """
+        with self._lock:
+            if account_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(account_id, None)
+    
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for account_id in [key for key, entry in self._entries.items() if entry[2] <= now]:
+                del self._entries[account_id]
+
+session_vault = SessionVault(ttl=int(os.getenv("SESSION_VAULT_TTL", "3600")))
+
+def rotate_session_keys(batch_size=100):
+    """
+    Перешифровывает данные сессий всех аккаунтов самым новым ключом.
+    Возвращает количество перешифрованных записей.
+    """
+    rotated = 0
+    last_id = 0
+    while True:
+        session = Session()
+        try:
+            accounts = session.query(AdminAccount).filter(AdminAccount.id > last_id) \
+                .order_by(AdminAccount.id).limit(batch_size).all()
+            if not accounts:
+                break
+            for account in accounts:
+                last_id = account.id
+                if not account.session_data:
+                    continue
+                token = account.session_data.encode()
+                try:
+                    # Уже зашифровано новым ключом - не трогаем
+                    primary_cipher.decrypt(token)
+                    continue
+                except InvalidToken:
+                    pass
+                try:
+                    account.session_data = cipher_suite.rotate(token).decode()
+                    rotated += 1
+                except InvalidToken:
+                    logger.error(f"Данные сессии аккаунта {account.phone} не расшифровываются ни одним ключом")
+            session.commit()
+        finally:
+            session.close()
+    
+    if rotated:
+        logger.info(f"Данные сессий перешифрованы новым ключом: {rotated}")
+    return rotated
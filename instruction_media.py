@@ -0,0 +1,115 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+from pyrogram import types
+from pyrogram.errors import FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, MediaEmpty
+from database import run_in_session, MediaCache
+
+logger = logging.getLogger(__name__)
+
+SCREEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "screen")
+
+# Скриншоты с инструкцией по настройкам приватности
+PRIVACY_INSTRUCTIONS = [
+    ("1.jpg", "1. Откройте настройки и выберите 'Конфиденциальность'"),
+    ("2.jpg", "2. Выберите 'Группы и каналы'"),
+    ("3.jpg", "3. Установите 'Кто может добавить меня в группы' на 'Все'"),
+]
+
+# Ошибки, при которых сохраненный file_id больше не годится
+STALE_FILE_ERRORS = (FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, MediaEmpty)
+
+
+def _load_file_ids(session, keys):
+    rows = session.query(MediaCache).filter(MediaCache.key.in_(keys)).all()
+    return {row.key: row.file_id for row in rows}
+
+
+def _save_file_ids(session, file_ids):
+    for key, file_id in file_ids.items():
+        session.merge(MediaCache(key=key, file_id=file_id, updated_at=datetime.now()))
+    session.commit()
+
+
+class InstructionMedia:
+    """
+    Альбом скриншотов с инструкцией, отправляемый по сохраненным file_id.
+
+    Файлы загружаются с диска только один раз (при прогреве или первой
+    отправке), после чего альбом уходит одним вызовом send_media_group.
+    """
+
+    def __init__(self, client, items=PRIVACY_INSTRUCTIONS):
+        self.client = client
+        self.items = items
+        self._file_ids = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def keys(self):
+        return [name for name, _ in self.items]
+
+    async def load(self):
+        """
+        Загружает сохраненные file_id из БД. Возвращает True, если есть file_id всех файлов.
+        """
+        file_ids = await run_in_session(_load_file_ids, self.keys)
+        if all(key in file_ids for key in self.keys):
+            self._file_ids = file_ids
+            return True
+        return False
+
+    def _media(self, file_ids=None):
+        return [
+            types.InputMediaPhoto(
+                file_ids[name] if file_ids else os.path.join(SCREEN_DIR, name),
+                caption=caption
+            )
+            for name, caption in self.items
+        ]
+
+    async def _upload(self, chat_id):
+        """
+        Отправляет альбом с диска и сохраняет полученные file_id
+        """
+        messages = await self.client.send_media_group(chat_id, self._media())
+        file_ids = {name: message.photo.file_id for (name, _), message in zip(self.items, messages)}
+        await run_in_session(_save_file_ids, file_ids)
+        self._file_ids = file_ids
+        logger.info(f"Скриншоты инструкции загружены, file_id сохранены")
+        return messages
+
+    async def warm_up(self, chat_id):
+        """
+        Подготавливает file_id при запуске: из БД или загрузкой альбома в служебный чат
+        """
+        async with self._lock:
+            if self._file_ids or await self.load():
+                return
+            messages = await self._upload(chat_id)
+
+        # Служебные сообщения больше не нужны - file_id остаются действительными
+        try:
+            await self.client.delete_messages(chat_id, [message.id for message in messages])
+        except Exception as e:
+            logger.warning(f"Не удалось удалить служебный альбом: {e}")
+
+    async def send(self, chat_id):
+        """
+        Отправляет альбом с инструкцией пользователю
+        """
+        file_ids = self._file_ids
+        if file_ids:
+            try:
+                await self.client.send_media_group(chat_id, self._media(file_ids))
+                return
+            except STALE_FILE_ERRORS as e:
+                logger.warning(f"Сохраненные file_id недействительны ({type(e).__name__}), загружаем файлы заново")
+                self._file_ids = None
+
+        async with self._lock:
+            if self._file_ids:
+                await self.client.send_media_group(chat_id, self._media(self._file_ids))
+            else:
+                await self._upload(chat_id)
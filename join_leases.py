@@ -0,0 +1,225 @@
+import os
+import json
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from database import run_in_session, JoinRequest, JoinWorker
+from join_queue import JoinJob
+
+logger = logging.getLogger(__name__)
+
+
+def _lease_free(now):
+    return or_(JoinRequest.lease_expires_at.is_(None), JoinRequest.lease_expires_at < now)
+
+
+def _live_served_chats(session, live_after):
+    """
+    Чаты, в которые может добавлять хотя бы один работающий процесс (heartbeat не старше live_after)
+    """
+    served = set()
+    for (chats,) in session.query(JoinWorker.served_chats).filter(JoinWorker.heartbeat_at >= live_after):
+        served.update(json.loads(chats or "[]"))
+    return served
+
+
+def _claim_requests(session, owner, limit, lease_seconds, chat_ids, orphan_before, live_after):
+    """
+    Захватывает до limit ожидающих заявок без действующей аренды.
+    Берутся заявки в чаты chat_ids, а также заявки старше orphan_before в чаты,
+    которые не обслуживает ни один работающий процесс (иначе заявка ждет свой процесс,
+    даже если он отстает из-за очереди).
+    """
+    now = datetime.now()
+    orphan = JoinRequest.created_at < orphan_before
+    live_chats = _live_served_chats(session, live_after)
+    if live_chats:
+        orphan = and_(orphan, JoinRequest.chat_id.notin_(live_chats))
+    query = session.query(JoinRequest.id).filter(
+        JoinRequest.status == "pending",
+        _lease_free(now),
+        or_(JoinRequest.chat_id.in_(chat_ids), orphan)
+    ).order_by(JoinRequest.id).limit(limit)
+    # В Postgres строки, которые сейчас захватывает другой процесс, пропускаются (в SQLite запись и так последовательна)
+    request_ids = [row.id for row in query.with_for_update(skip_locked=True)]
+    if not request_ids:
+        session.rollback()
+        return []
+
+    # Условие аренды повторяется: без блокировок строк (SQLite) заявку мог успеть захватить другой процесс
+    session.query(JoinRequest).filter(JoinRequest.id.in_(request_ids), _lease_free(now)).update({
+        JoinRequest.lease_owner: owner,
+        JoinRequest.lease_expires_at: now + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+    session.commit()
+
+    return session.query(JoinRequest.id, JoinRequest.user_id, JoinRequest.chat_id, JoinRequest.message_id) \
+        .filter(JoinRequest.id.in_(request_ids), JoinRequest.lease_owner == owner).order_by(JoinRequest.id).all()
+
+
+def _renew_leases(session, owner, request_ids, lease_seconds):
+    session.query(JoinRequest).filter(
+        JoinRequest.id.in_(request_ids),
+        JoinRequest.lease_owner == owner,
+        JoinRequest.status == "pending"
+    ).update({
+        JoinRequest.lease_expires_at: datetime.now() + timedelta(seconds=lease_seconds)
+    }, synchronize_session=False)
+    session.commit()
+
+
+def _heartbeat(session, owner, chat_ids, dead_before):
+    """
+    Записывает чаты процесса и время проверки, удаляет записи давно остановившихся процессов
+    """
+    session.merge(JoinWorker(owner=owner, served_chats=json.dumps(sorted(chat_ids)), heartbeat_at=datetime.now()))
+    session.query(JoinWorker).filter(JoinWorker.heartbeat_at < dead_before).delete(synchronize_session=False)
+    session.commit()
+
+
+def _remove_worker(session, owner):
+    session.query(JoinWorker).filter_by(owner=owner).delete(synchronize_session=False)
+    session.commit()
+
+
+def _release_leases(session, owner):
+    released = session.query(JoinRequest).filter(
+        JoinRequest.lease_owner == owner,
+        JoinRequest.status == "pending"
+    ).update({
+        JoinRequest.lease_owner: None,
+        JoinRequest.lease_expires_at: None
+    }, synchronize_session=False)
+    session.commit()
+    return released
+
+
+def default_owner(worker_index):
+    return f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+
+
+class JoinLeaseClaimer:
+    """
+    Источник заданий для очереди при работе нескольких процессов с одной базой.
+
+    Каждый процесс захватывает ожидающие заявки на lease_seconds секунд
+    (SELECT ... FOR UPDATE SKIP LOCKED) и ставит их в свою очередь JoinQueue.
+    Пока заявка обрабатывается, аренда продлевается; если процесс завершился
+    аварийно, аренда истекает и заявку захватывает другой процесс. При
+    штатной остановке необработанные заявки сразу освобождаются.
+
+    served_chats() возвращает чаты, в которые могут добавлять аккаунты
+    этого процесса. Раз в heartbeat_interval секунд они записываются в
+    таблицу join_workers. Заявку старше orphan_after секунд берет любой
+    процесс, только если ее чат не обслуживает ни один процесс, отметившийся
+    за последние три heartbeat_interval.
+    """
+
+    def __init__(self, queue, owner, served_chats, lease_seconds=600, poll_interval=1.0, orphan_after=60,
+                 heartbeat_interval=10):
+        self.queue = queue
+        self.owner = owner
+        self.served_chats = served_chats
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.orphan_after = orphan_after
+        self.heartbeat_interval = heartbeat_interval
+        self._wake = asyncio.Event()
+        self._tasks = []
+
+    def wake(self):
+        """
+        Проверить новые заявки сразу, не дожидаясь poll_interval
+        """
+        self._wake.set()
+
+    async def claim(self):
+        """
+        Захватывает заявки по числу свободных мест в очереди. Возвращает число захваченных.
+        """
+        capacity = self.queue.workers * 2 - len(self.queue.inflight_request_ids())
+        chat_ids = self.served_chats()
+        if capacity <= 0:
+            return 0
+        now = datetime.now()
+        orphan_before = now - timedelta(seconds=self.orphan_after)
+        live_after = now - timedelta(seconds=self.heartbeat_interval * 3)
+        rows = await run_in_session(
+            _claim_requests, self.owner, capacity, self.lease_seconds, chat_ids, orphan_before, live_after
+        )
+        for request_id, user_id, chat_id, message_id in rows:
+            self.queue.submit(JoinJob(request_id, user_id, chat_id, message_id=message_id))
+        if rows:
+            logger.info(f"Захвачено заявок: {len(rows)}")
+        return len(rows)
+
+    async def _claim_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Пока захватывается полная пачка, сразу берем следующую
+                while await self.claim():
+                    pass
+            except Exception as e:
+                logger.error(f"Ошибка при захвате заявок: {type(e).__name__}: {e}")
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            request_ids = self.queue.inflight_request_ids()
+            if not request_ids:
+                continue
+            try:
+                await run_in_session(_renew_leases, self.owner, request_ids, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Ошибка при продлении аренды заявок: {type(e).__name__}: {e}")
+
+    async def heartbeat(self):
+        """
+        Отмечает процесс работающим и обновляет список обслуживаемых им чатов
+        """
+        dead_before = datetime.now() - timedelta(seconds=self.heartbeat_interval * 3)
+        await run_in_session(_heartbeat, self.owner, self.served_chats(), dead_before)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Ошибка при записи состояния процесса: {type(e).__name__}: {e}")
+
+    async def start(self):
+        # Чаты процесса видны остальным до первого захвата заявок
+        await self.heartbeat()
+        self._tasks = [
+            asyncio.create_task(self._claim_loop()),
+            asyncio.create_task(self._renew_loop()),
+            asyncio.create_task(self._heartbeat_loop())
+        ]
+        logger.info(f"Захват заявок запущен (владелец аренды {self.owner})")
+
+    async def stop(self):
+        """
+        Прекращает захват; вызывается до остановки очереди, аренда освобождается после нее (release)
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def release(self):
+        try:
+            await run_in_session(_remove_worker, self.owner)
+            released = await run_in_session(_release_leases, self.owner)
+        except Exception as e:
+            logger.error(f"Ошибка при освобождении аренды заявок: {e}")
+            return
+        if released:
+            logger.info(f"Освобождено необработанных заявок: {released}")
@@ -0,0 +1,195 @@
+import time
+import asyncio
+import logging
+from database import run_in_session, JoinRequest
+
+logger = logging.getLogger(__name__)
+
+
+class JoinJob:
+    """
+    Задание на обработку одной заявки из таблицы join_requests
+    """
+
+    def __init__(self, request_id, user_id, chat_id, message_id=None):
+        self.request_id = request_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        # ID сообщений с меню, которые нужно обновить результатом
+        self.message_ids = [message_id] if message_id else []
+        # Сколько раз заявка повторно ставилась в очередь, потому что добавление не подтвердилось
+        self.rechecks = 0
+
+    @property
+    def key(self):
+        return self.user_id, self.chat_id
+
+
+def _is_pending(session, request_id):
+    status = session.query(JoinRequest.status).filter_by(id=request_id).scalar()
+    return status == "pending"
+
+
+class JoinQueue:
+    """
+    Очередь заявок на добавление с пулом обработчиков.
+
+    Источником истины остается таблица join_requests: при запуске все заявки
+    в статусе pending снова ставятся в очередь, а при остановке очередь
+    дорабатывает уже принятые задания.
+
+    Повторные заявки того же пользователя в тот же чат, пока первая
+    ожидает или выполняется, присоединяются к ней. Новая попытка того же
+    пользователя возможна не раньше чем через cooldown секунд.
+    """
+
+    def __init__(self, handler, workers=4, drain_timeout=30, cooldown=10):
+        self.handler = handler
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.cooldown = cooldown
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self._accepting = False
+        self._inflight = {}
+        # Отложенные повторы заявок (defer): ключ заявки -> таймер
+        self._deferred = {}
+        self._last_attempt = {}
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    async def start(self, restore=True):
+        """
+        Восстанавливает незавершенные заявки и запускает обработчиков.
+        restore=False - заявки поступают только через submit (их захватывает JoinLeaseClaimer).
+        """
+        def load_pending(session):
+            return session.query(JoinRequest.id, JoinRequest.user_id, JoinRequest.chat_id, JoinRequest.message_id) \
+                .filter_by(status="pending").order_by(JoinRequest.id).all()
+
+        # Новые заявки принимаются сразу; заявки, созданные во время загрузки, не дублируются
+        self._accepting = True
+        pending = await run_in_session(load_pending) if restore else []
+        restored = 0
+        for request_id, user_id, chat_id, message_id in pending:
+            job = JoinJob(request_id, user_id, chat_id, message_id=message_id)
+            if job.key in self._inflight:
+                continue
+            self._inflight[job.key] = job
+            self._queue.put_nowait(job)
+            restored += 1
+
+        if restored:
+            logger.info(f"Восстановлено незавершенных заявок: {restored}")
+
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"Запущено обработчиков заявок: {self.workers}")
+
+    def attach(self, user_id, chat_id, message_id=None):
+        """
+        Присоединяет повторное нажатие к заявке, которая уже в работе. Возвращает True, если такая заявка есть.
+        """
+        job = self._inflight.get((user_id, chat_id))
+        if job is None:
+            return False
+        if message_id and message_id not in job.message_ids:
+            job.message_ids.append(message_id)
+        return True
+
+    def inflight_request_ids(self):
+        """
+        ID заявок, которые ожидают в очереди или обрабатываются
+        """
+        return [job.request_id for job in self._inflight.values()]
+
+    def record_attempt(self, user_id):
+        """
+        Запоминает попытку пользователя для ограничения частоты (cooldown_left)
+        """
+        now = time.monotonic()
+        self._last_attempt[user_id] = now
+        if len(self._last_attempt) > 10000:
+            self._last_attempt = {k: v for k, v in self._last_attempt.items() if v + self.cooldown > now}
+
+    def cooldown_left(self, user_id):
+        """
+        Сколько секунд пользователь должен подождать до новой попытки
+        """
+        last = self._last_attempt.get(user_id)
+        if last is None:
+            return 0
+        return max(0.0, last + self.cooldown - time.monotonic())
+
+    def submit(self, job):
+        """
+        Ставит заявку в очередь. Возвращает False, если очередь уже останавливается.
+        """
+        if not self._accepting:
+            return False
+        # Заявка уже в работе - результат получат и сообщения новой попытки
+        if job.key in self._inflight:
+            for message_id in job.message_ids:
+                self.attach(job.user_id, job.chat_id, message_id)
+            return True
+
+        self.record_attempt(job.user_id)
+        self._inflight[job.key] = job
+        self._queue.put_nowait(job)
+        return True
+
+    def defer(self, job, delay):
+        """
+        Снова ставит заявку в очередь через delay секунд. До этого заявка остается в работе:
+        повторные нажатия присоединяются к ней, а аренда в БД продлевается.
+        Возвращает False, если очередь уже останавливается.
+        """
+        if not self._accepting:
+            return False
+        self._inflight[job.key] = job
+        self._deferred[job.key] = asyncio.get_running_loop().call_later(delay, self._resubmit, job)
+        return True
+
+    def _resubmit(self, job):
+        self._deferred.pop(job.key, None)
+        if not self._accepting:
+            # Заявка остается в статусе pending и будет обработана при следующем запуске
+            self._inflight.pop(job.key, None)
+            return
+        self._queue.put_nowait(job)
+
+    async def _worker(self, n):
+        while True:
+            job = await self._queue.get()
+            try:
+                # Заявка могла быть завершена другим путем, пока ждала в очереди
+                if await run_in_session(_is_pending, job.request_id):
+                    await self.handler(job)
+            except Exception as e:
+                logger.error(f"Обработчик {n}: ошибка при обработке заявки {job.request_id}: {type(e).__name__}: {e}")
+            finally:
+                # Отложенная заявка остается в работе до повторной постановки в очередь
+                if job.key not in self._deferred:
+                    self._inflight.pop(job.key, None)
+                self._queue.task_done()
+
+    async def stop(self):
+        """
+        Прекращает прием заявок и ждет обработки очереди не дольше drain_timeout
+        """
+        self._accepting = False
+        for key, timer in list(self._deferred.items()):
+            timer.cancel()
+            self._inflight.pop(key, None)
+        self._deferred.clear()
+        try:
+            await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            # Оставшиеся заявки остаются в статусе pending и будут обработаны при следующем запуске
+            logger.warning(f"Очередь не обработана до конца, осталось заявок: {self._queue.qsize()}")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
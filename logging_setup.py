@@ -0,0 +1,151 @@
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import functools
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Идентификатор текущего запроса (обновления или заявки), попадает в каждую запись лога
+correlation_id = contextvars.ContextVar("correlation_id", default="-")
+
+# Стандартные атрибуты LogRecord, не попадающие в поле extra
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id"}
+
+
+def set_correlation_id(value):
+    """
+    Задает идентификатор запроса для текущей задачи (и задач, созданных из нее)
+    """
+    correlation_id.set(str(value))
+
+
+class CorrelationFilter(logging.Filter):
+    """
+    Добавляет к записи идентификатор запроса. Выполняется в потоке, создавшем запись,
+    поэтому видит контекст корутины.
+    """
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничивает частоту записей ниже WARNING: не более burst записей
+    из одного места кода за window секунд. Количество пропущенных записей
+    добавляется к следующей записи из этого места.
+    """
+
+    def __init__(self, burst=20, window=60):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.burst <= 0:
+            return True
+
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        started, count, dropped = self._sites.get(site, (now, 0, 0))
+        if now - started >= self.window:
+            started, count = now, 0
+
+        if count >= self.burst:
+            self._sites[site] = (started, count, dropped + 1)
+            return False
+
+        self._sites[site] = (started, count + 1, 0)
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Запись лога одной строкой JSON
+    """
+
+    def format(self, record):
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value if isinstance(value, (str, int, float, bool, type(None))) else repr(value)
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class _RecordQueueHandler(QueueHandler):
+    """
+    QueueHandler, который передает в поток саму запись со всеми атрибутами,
+    а не отформатированную строку (ее форматируют обработчики в потоке)
+    """
+
+    def prepare(self, record):
+        # Сообщение и исключение вычисляются сразу, чтобы запись не держала ссылок на объекты корутины
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level="INFO", log_file="bot.log", max_bytes=10 * 1024 * 1024, backup_count=5,
+                  sample_burst=20, sample_window=60):
+    """
+    Настраивает логирование через очередь: обработчики (файл с ротацией по размеру
+    в формате JSON и консоль) работают в отдельном потоке и не блокируют цикл событий.
+    Возвращает QueueListener; он останавливается автоматически при выходе.
+    """
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s"
+    ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _RecordQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+    queue_handler.addFilter(SamplingFilter(sample_burst, sample_window))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def correlated(func):
+    """
+    Декоратор обработчика обновления: задает новый идентификатор запроса на время вызова
+    """
+    @functools.wraps(func)
+    async def wrapper(client, update, *args, **kwargs):
+        user = getattr(update, "from_user", None)
+        token = correlation_id.set(f"{user.id if user else '-'}:{uuid.uuid4().hex[:8]}")
+        try:
+            return await func(client, update, *args, **kwargs)
+        finally:
+            correlation_id.reset(token)
+    return wrapper
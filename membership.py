@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from enum import Enum
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import UserNotParticipant, FloodWait, RPCError
+
+logger = logging.getLogger(__name__)
+
+# Паузы перед попытками проверки (секунды): список участников обновляется не мгновенно
+VERIFY_DELAYS = (0.3, 0.7, 1.5)
+
+
+class Membership(Enum):
+    """
+    Результат проверки членства пользователя в чате
+    """
+    MEMBER = "member"
+    NOT_MEMBER = "not_member"
+    UNKNOWN = "unknown"
+
+
+def _is_member(member):
+    if member.status in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED):
+        return False
+    if member.status == ChatMemberStatus.RESTRICTED:
+        return bool(member.is_member)
+    return True
+
+
+async def verify_membership(client, chat_id, user_id, delays=VERIFY_DELAYS):
+    """
+    Проверяет членство одного пользователя через get_chat_member с ограниченным числом повторов.
+    Время проверки не зависит от размера чата.
+    """
+    outcome = Membership.UNKNOWN
+
+    for attempt, delay in enumerate(delays, start=1):
+        await asyncio.sleep(delay)
+        try:
+            member = await client.get_chat_member(chat_id, user_id)
+        except UserNotParticipant:
+            outcome = Membership.NOT_MEMBER
+            logger.debug(f"Проверка {attempt}/{len(delays)}: пользователь {user_id} пока не в чате {chat_id}")
+            continue
+        except FloodWait as e:
+            # Не ждем FloodWait на проверке - результат остается неизвестным
+            logger.warning(f"FloodWait {e.value} с. при проверке членства пользователя {user_id}")
+            break
+        except RPCError as e:
+            logger.warning(f"Ошибка при проверке членства пользователя {user_id}: {type(e).__name__}: {e}")
+            continue
+
+        if _is_member(member):
+            return Membership.MEMBER
+
+        outcome = Membership.NOT_MEMBER
+        logger.debug(f"Проверка {attempt}/{len(delays)}: статус пользователя {user_id} в чате {chat_id}: {member.status}")
+
+    return outcome
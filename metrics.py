@@ -0,0 +1,251 @@
+import time
+import bisect
+import asyncio
+import logging
+import functools
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Монотонно растущий счетчик с метками
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+    def summary(self):
+        return [(", ".join(key) or "всего", f"{value:g}") for key, value in sorted(self._values.items())]
+
+
+class Gauge:
+    """
+    Текущее значение, вычисляемое функцией в момент чтения (глубина очереди, размер пула)
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def _value(self):
+        try:
+            return self.func()
+        except Exception as e:
+            logger.warning(f"Не удалось получить значение метрики {self.name}: {e}")
+            return float("nan")
+
+    def samples(self):
+        yield self.name, "", self._value()
+
+    def summary(self):
+        return [("сейчас", f"{self._value():g}")]
+
+
+class _HistogramState:
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram:
+    """
+    Гистограмма длительностей с метками
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._states = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = _HistogramState(len(self.bounds) + 1)
+        state.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        state.count += 1
+        state.sum += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Замеряет длительность блока with (в том числе при исключении)
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _quantile(self, state, q):
+        # Оценка сверху: граница корзины, в которую попадает квантиль
+        rank = q * state.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), state.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        for key, state in sorted(self._states.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), state.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, ("le", le)), cumulative
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), state.count
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), state.sum
+
+    def summary(self):
+        rows = []
+        for key, state in sorted(self._states.items()):
+            avg = state.sum / state.count if state.count else 0
+            rows.append((
+                ", ".join(key) or "всего",
+                f"{state.count} шт., ср. {avg * 1000:.0f} мс, "
+                f"p50 ≤ {self._quantile(state, 0.5):g} с, p99 ≤ {self._quantile(state, 0.99):g} с"
+            ))
+        return rows
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса. Все изменения выполняются из цикла событий,
+    поэтому блокировки не нужны.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, func):
+        return self._register(Gauge(name, documentation, func))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Текстовый формат Prometheus (exposition format 0.0.4)
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Те же данные в виде, удобном для чтения в Telegram
+        """
+        parts = []
+        for metric in self._metrics.values():
+            rows = metric.summary()
+            if not rows:
+                continue
+            parts.append(f"{metric.documentation}:\n" + "\n".join(f"  {label}: {value}" for label, value in rows))
+        return "\n\n".join(parts)
+
+
+def timed(histogram, **labels):
+    """
+    Декоратор корутины, записывающий ее длительность в гистограмму
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def _handle_http(registry, reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Заголовки запроса не нужны, но их нужно дочитать
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Ошибка при обработке запроса метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(registry, host="127.0.0.1", port=9100):
+    """
+    Запускает HTTP-сервер с метриками в текстовом формате Prometheus
+    """
+    server = await asyncio.start_server(functools.partial(_handle_http, registry), host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+# Реестр метрик бота
+registry = MetricsRegistry()
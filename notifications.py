@@ -0,0 +1,120 @@
+import time
+import asyncio
+import logging
+from pyrogram.errors import FloodWait
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+class AdminNotifier:
+    """
+    Очередь уведомлений администраторам с отдельной задачей отправки.
+
+    notify() не ждет отправки, поэтому рассылка не влияет на время ответа
+    пользователю. Уведомления с одинаковым ключом в пределах dedup_window
+    отправляются один раз. При digest_interval > 0 уведомления копятся и
+    уходят одной сводкой раз в digest_interval секунд.
+    """
+
+    def __init__(self, client, admin_ids, concurrency=5, dedup_window=300, digest_interval=0, max_queue=1000):
+        self.client = client
+        self.admin_ids = admin_ids
+        self.dedup_window = dedup_window
+        self.digest_interval = digest_interval
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._seen = {}
+        # Уведомления текущей сводки, уже взятые из очереди (отправляются и при остановке)
+        self._batch = []
+        self._task = None
+
+    def notify(self, text, key=None):
+        """
+        Ставит уведомление в очередь. key - ключ события для подавления дубликатов.
+        """
+        now = time.monotonic()
+        if key is not None:
+            if self._seen.get(key, 0) > now:
+                logger.info(f"Повторное уведомление {key} пропущено")
+                return
+            self._seen[key] = now + self.dedup_window
+            if len(self._seen) > 10000:
+                self._seen = {k: v for k, v in self._seen.items() if v > now}
+
+        try:
+            self._queue.put_nowait(text)
+        except asyncio.QueueFull:
+            logger.warning("Очередь уведомлений администраторам переполнена, уведомление пропущено")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            text = await self._queue.get()
+            if self.digest_interval <= 0:
+                await self._broadcast(text)
+                continue
+
+            # Копим уведомления до конца интервала и отправляем сводкой
+            self._batch.append(text)
+            await asyncio.sleep(self.digest_interval)
+            while not self._queue.empty():
+                self._batch.append(self._queue.get_nowait())
+            texts, self._batch = self._batch, []
+            await self._send_digest(texts)
+
+    async def _send_digest(self, texts):
+        if len(texts) == 1:
+            await self._broadcast(texts[0])
+            return
+
+        header = f"📬 Сводка уведомлений ({len(texts)}):\n\n"
+        chunk = header
+        for text in texts:
+            part = text.strip() + "\n\n"
+            if len(chunk) + len(part) > MESSAGE_LIMIT and chunk != header:
+                await self._broadcast(chunk)
+                chunk = header
+            chunk += part[:MESSAGE_LIMIT - len(header)]
+        if chunk != header:
+            await self._broadcast(chunk)
+
+    async def _broadcast(self, text):
+        await asyncio.gather(*(self._send(admin_id, text) for admin_id in self.admin_ids))
+
+    async def _send(self, admin_id, text):
+        async with self._semaphore:
+            for attempt in range(2):
+                try:
+                    await self.client.send_message(admin_id, text)
+                    return
+                except FloodWait as e:
+                    if attempt:
+                        break
+                    await asyncio.sleep(e.value)
+                except Exception as e:
+                    logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
+                    return
+            logger.error(f"Не удалось отправить уведомление администратору {admin_id}: FloodWait")
+
+    async def stop(self, timeout=10):
+        """
+        Отправляет накопленные уведомления и останавливает задачу отправки
+        """
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        texts, self._batch = self._batch, []
+        while not self._queue.empty():
+            texts.append(self._queue.get_nowait())
+        if texts:
+            try:
+                await asyncio.wait_for(self._send_digest(texts), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Не все уведомления администраторам отправлены при остановке")
@@ -0,0 +1,153 @@
+import sys
+import bisect
+import logging
+from array import array
+from sqlalchemy import select
+from database import run_in_session, User
+
+logger = logging.getLogger(__name__)
+
+
+class IntIdSet:
+    """
+    Компактное множество целочисленных ID: отсортированный массив int64 (8 байт на ID)
+    и небольшие множества изменений после последнего уплотнения.
+
+    Обычное множество Python тратит на каждый ID около 60-70 байт, поэтому основная
+    часть хранится в массиве, а изменения сливаются в него, когда их становится
+    больше 1/8 размера массива.
+    """
+
+    def __init__(self, ids=()):
+        self._base = array("q", sorted(set(ids)))
+        self._added = set()
+        self._removed = set()
+
+    @classmethod
+    def from_sorted(cls, ids):
+        """
+        Множество из уже отсортированного массива уникальных ID (без копирования)
+        """
+        id_set = cls()
+        id_set._base = ids
+        return id_set
+
+    def __contains__(self, value):
+        if value in self._added:
+            return True
+        if value in self._removed:
+            return False
+        base = self._base
+        position = bisect.bisect_left(base, value)
+        return position < len(base) and base[position] == value
+
+    def __len__(self):
+        return len(self._base) + len(self._added) - len(self._removed)
+
+    def add(self, value):
+        if value in self:
+            return
+        self._removed.discard(value)
+        if not self._in_base(value):
+            self._added.add(value)
+        self._maybe_compact()
+
+    def discard(self, value):
+        if value not in self:
+            return
+        if value in self._added:
+            self._added.remove(value)
+        else:
+            self._removed.add(value)
+        self._maybe_compact()
+
+    def _in_base(self, value):
+        position = bisect.bisect_left(self._base, value)
+        return position < len(self._base) and self._base[position] == value
+
+    def _maybe_compact(self):
+        if len(self._added) + len(self._removed) > max(4096, len(self._base) // 8):
+            self.compact()
+
+    def compact(self):
+        """
+        Сливает изменения в отсортированный массив
+        """
+        removed = self._removed
+        merged = [value for value in self._base if value not in removed] if removed else list(self._base)
+        merged.extend(self._added)
+        merged.sort()
+        self._base = array("q", merged)
+        self._added = set()
+        self._removed = set()
+
+    @property
+    def nbytes(self):
+        """
+        Занимаемая память (массив, множества изменений и их элементы)
+        """
+        delta = sum(sys.getsizeof(part) + len(part) * sys.getsizeof(2 ** 40) for part in (self._added, self._removed))
+        return sys.getsizeof(self._base) + delta
+
+
+def _load_ids(session):
+    known = array("q")
+    blacklisted = array("q")
+    # Запрос уровня Core без построения ORM-строк: загрузка миллиона пользователей занимает секунды
+    rows = session.connection().execute(
+        select(User.user_id, User.is_blacklisted).order_by(User.user_id).execution_options(yield_per=10000)
+    )
+    for user_id, is_blacklisted in rows:
+        known.append(user_id)
+        if is_blacklisted:
+            blacklisted.append(user_id)
+    return known, blacklisted
+
+
+class UserIndex:
+    """
+    Индекс зарегистрированных и заблокированных пользователей в памяти.
+
+    Загружается один раз при запуске; после этого /start и выбор чата проверяют
+    регистрацию и блокировку без обращения к БД. Пока индекс не загружен
+    (ready = False), вызывающий код обращается к БД как раньше.
+    """
+
+    def __init__(self):
+        self.known = IntIdSet()
+        self.blacklisted = IntIdSet()
+        self.ready = False
+
+    async def load(self):
+        known, blacklisted = await run_in_session(_load_ids)
+        self.known = IntIdSet.from_sorted(known)
+        self.blacklisted = IntIdSet.from_sorted(blacklisted)
+        self.ready = True
+        logger.info(
+            f"Индекс пользователей загружен: {len(known)} пользователей, {len(blacklisted)} заблокированных, "
+            f"{self.nbytes / 1024 / 1024:.1f} МБ"
+        )
+
+    def is_known(self, user_id):
+        return user_id in self.known
+
+    def is_blacklisted(self, user_id):
+        return user_id in self.blacklisted
+
+    def add_user(self, user_id):
+        self.known.add(user_id)
+
+    def set_blacklisted(self, user_ids, value):
+        """
+        Отражает изменение черного списка в БД. user_ids - пользователи, найденные в БД.
+        """
+        for user_id in user_ids:
+            self.known.add(user_id)
+            if value:
+                self.blacklisted.add(user_id)
+            else:
+                self.blacklisted.discard(user_id)
+
+    @property
+    def nbytes(self):
+        return self.known.nbytes + self.blacklisted.nbytes
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+from datetime import datetime
+from sqlalchemy import or_
+from sqlalchemy.dialects import postgresql, sqlite
+from database import run_in_session, User
+
+logger = logging.getLogger(__name__)
+
+# Поля профиля, которые обновляются при повторном /start
+PROFILE_FIELDS = ("username", "first_name", "last_name")
+
+
+def _upsert_users(session, rows):
+    """
+    Вставляет новых пользователей и обновляет профиль существующих одним
+    INSERT ... ON CONFLICT (user_id) DO UPDATE. Строки без изменений не перезаписываются.
+    """
+    dialect = session.bind.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        # Для остальных СУБД - по одной строке через ORM
+        for row in rows:
+            user = session.query(User).filter_by(user_id=row["user_id"]).first()
+            if user:
+                for field in PROFILE_FIELDS:
+                    setattr(user, field, row[field])
+            else:
+                session.add(User(**row))
+        session.commit()
+        return
+
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    statement = insert(User).values(rows)
+    excluded = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.user_id],
+        set_={field: getattr(excluded, field) for field in PROFILE_FIELDS},
+        where=or_(*(getattr(User, field).is_distinct_from(getattr(excluded, field)) for field in PROFILE_FIELDS))
+    )
+    session.execute(statement)
+    session.commit()
+
+
+class UserWriter:
+    """
+    Отложенная запись регистраций и профилей пользователей.
+
+    submit() только запоминает профиль (последний для каждого пользователя);
+    фоновая задача записывает накопленное пачкой раз в flush_interval секунд
+    или сразу, когда накопилось max_batch пользователей. При остановке
+    записывается все оставшееся.
+    """
+
+    def __init__(self, flush_interval=0.3, max_batch=500):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = {}
+        self._full = asyncio.Event()
+        self._task = None
+        self._closing = False
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def submit(self, user):
+        """
+        Ставит в очередь регистрацию или обновление профиля пользователя (объект pyrogram User)
+        """
+        self._pending[user.id] = {
+            "user_id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            # Используются только при вставке новой строки
+            "registration_date": datetime.now(),
+            "is_blacklisted": False,
+        }
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """
+        Записывает накопленные профили пачками по max_batch
+        """
+        self._full.clear()
+        while self._pending:
+            user_ids = list(self._pending)[:self.max_batch]
+            rows = [self._pending.pop(user_id) for user_id in user_ids]
+            try:
+                await run_in_session(_upsert_users, rows)
+            except Exception as e:
+                logger.error(f"Ошибка при записи пользователей ({len(rows)}): {type(e).__name__}: {e}")
+                # Возвращаем строки, если за время записи не пришел более свежий профиль
+                for row in rows:
+                    self._pending.setdefault(row["user_id"], row)
+                return
+
+    async def stop(self):
+        """
+        Останавливает фоновую запись и записывает все оставшееся
+        """
+        # Задачу не отменяем, чтобы не прервать запись уже извлеченной пачки
+        self._closing = True
+        self._full.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error(f"При остановке не записаны пользователи: {len(self._pending)}")